@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+"""buergcontrolBASE API - Upload, Verarbeitung, Status, Export, Historie und Settings für ERP-Anbindungen
+
+Start (gleiches Arbeitsverzeichnis wie die Streamlit-App, nur SQLite und Dateisystem):
+    uvicorn api:api --host 0.0.0.0 --port 8000
+
+Ablauf:
+    POST /auth/login                              → Token, danach Header "Authorization: Bearer <token>"
+    POST /upload/{leit|ncar|eza|zlvav|ncts}?dateiname=Leitdatei.xlsx
+                                                  → Excel-Datei als Request-Body, wird blockweise auf die Platte geschrieben
+    POST /process/start                           → Job in der Warteschlange (Upload-IDs, Zeitraum, Parameter)
+    GET  /process/status?id=<job_id>              → Fortschritt; nach Abschluss Historie-Lauf (run_id) und Export-Link
+    GET  /exports/{run_id}                        → Excel-Datei (gestreamt)
+    GET  /history, GET /history/{run_id}, GET/PUT /settings
+
+Die Berechnung läuft in den Worker-Prozessen der Job-Warteschlange (worker.py), nicht im API-Prozess.
+"""
+
+import hashlib
+import logging
+import os
+import secrets
+import uuid
+from contextlib import asynccontextmanager
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+from fastapi import Depends, FastAPI, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from pydantic import BaseModel
+
+import app
+
+for logger_name in list(logging.root.manager.loggerDict):
+    if logger_name.startswith('streamlit'):
+        logging.getLogger(logger_name).setLevel(logging.ERROR)
+
+# SPEC: 300-400 MB pro Datei stabil
+UPLOAD_MAX_BYTES = int(os.environ.get('BUERGCONTROL_UPLOAD_MAX_MB', '400')) * 1024 * 1024
+UPLOAD_VERSION = 1
+TOKEN_GUELTIGKEIT = timedelta(hours=int(os.environ.get('BUERGCONTROL_API_TOKEN_STUNDEN', '12')))
+EXCEL_MEDIA_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+# Upload-Typ → (Bezeichnung, Pflichtspalten)
+UPLOAD_TYPEN = {
+    'leit': ('Leitdatei', app.LEIT_PFLICHTSPALTEN),
+    'ncar': ('NCAR-Datei', [[col] for col in app.NCAR_PFLICHTSPALTEN]),
+    'eza': ('Import EZA', app.IMPORT_PFLICHTSPALTEN['IMDC']),
+    'zlvav': ('Import ZL / VAV', app.IMPORT_PFLICHTSPALTEN['WIDS']),
+    'ncts': ('NCTS', app.IMPORT_PFLICHTSPALTEN['NCDP'])
+}
+
+@asynccontextmanager
+async def lifespan(_):
+    # Ohne externe Worker startet die API die Worker-Prozesse selbst (mindestens einen)
+    if not app.JOB_WORKER_EXTERN:
+        app.start_worker_pool()
+    yield
+
+api = FastAPI(title="buergcontrolBASE API", lifespan=lifespan)
+
+# === AUTHENTIFIZIERUNG ===
+
+class LoginAnfrage(BaseModel):
+    aktivierungscode: str
+    benutzer: str
+    passwort: str
+
+def hash_token(token):
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+@api.post('/auth/login')
+def login(anfrage: LoginAnfrage):
+    """Meldet einen Mandanten mit den Zugangsdaten aus config.json an und liefert ein Token"""
+    mandant_data = app.load_config().get(anfrage.aktivierungscode)
+    if not mandant_data or not app.check_credentials(anfrage.benutzer, anfrage.passwort, mandant_data):
+        raise HTTPException(401, "Ungültiger Aktivierungscode oder falsche Zugangsdaten")
+
+    token = secrets.token_urlsafe(32)
+    gueltig_bis = datetime.now() + TOKEN_GUELTIGKEIT
+    with app.db_verbindung() as conn:
+        conn.execute('DELETE FROM api_tokens WHERE gueltig_bis < ?', (app.jetzt_iso(),))
+        conn.execute(
+            'INSERT INTO api_tokens (token_hash, mandant, kunde, erstellt, gueltig_bis) VALUES (?, ?, ?, ?, ?)',
+            (hash_token(token), app.build_mandant_key(mandant_data['kunde']), mandant_data['kunde'],
+             app.jetzt_iso(), gueltig_bis.isoformat(timespec='seconds'))
+        )
+    return {'token': token, 'mandant': mandant_data['kunde'], 'gueltig_bis': gueltig_bis.isoformat(timespec='seconds')}
+
+def get_mandant(anmeldung: HTTPAuthorizationCredentials = Depends(HTTPBearer())):
+    """Mandanten-Schlüssel zum Bearer-Token"""
+    with app.db_verbindung() as conn:
+        row = conn.execute(
+            'SELECT mandant FROM api_tokens WHERE token_hash = ? AND gueltig_bis >= ?',
+            (hash_token(anmeldung.credentials), app.jetzt_iso())
+        ).fetchone()
+    if row is None:
+        raise HTTPException(401, "Token ungültig oder abgelaufen - bitte erneut anmelden")
+    return row['mandant']
+
+# === UPLOAD ===
+
+def read_upload(typ, pfad):
+    """Liest eine hochgeladene Datei ein und prüft die Pflichtspalten wie im Upload-Dialog"""
+    bezeichnung, pflichtspalten = UPLOAD_TYPEN[typ]
+    df = pd.read_excel(pfad)
+
+    # EZA wird erst bei der Verarbeitung über alle Dateien aufbereitet, geprüft wird die aufbereitete Form
+    geprueft = app.prepare_eza_import(df.copy()) if typ == 'eza' else df
+    fehlend = app.find_missing_columns(geprueft, pflichtspalten)
+    if fehlend:
+        raise ValueError(f"Fehlende Spalten in {bezeichnung}: " + "; ".join(" / ".join(gruppe) for gruppe in fehlend))
+    return df
+
+@api.post('/upload/{typ}', status_code=201)
+async def upload(typ: str, request: Request, dateiname: str = Query(...), mandant: str = Depends(get_mandant)):
+    """Nimmt eine Excel-Datei als Request-Body entgegen und schreibt sie blockweise in das Mandanten-Verzeichnis"""
+    if typ not in UPLOAD_TYPEN:
+        raise HTTPException(404, f"Unbekannter Upload-Typ '{typ}' (erlaubt: {', '.join(UPLOAD_TYPEN)})")
+    endung = os.path.splitext(dateiname)[1].lower()
+    if endung not in ('.xlsx', '.xls'):
+        raise HTTPException(415, "Nur Excel-Dateien (.xlsx oder .xls) werden unterstützt")
+
+    upload_id = uuid.uuid4().hex
+    verzeichnis = os.path.join(app.ARTEFAKT_VERZEICHNIS, mandant, 'uploads')
+    os.makedirs(verzeichnis, exist_ok=True)
+    pfad = os.path.join(verzeichnis, f'{upload_id}{endung}')
+
+    # Plattenzugriffe im Threadpool, damit große Uploads die Event-Loop nicht blockieren
+    groesse = 0
+    try:
+        f = await run_in_threadpool(open, pfad + '.tmp', 'wb')
+        try:
+            async for block in request.stream():
+                groesse += len(block)
+                if groesse > UPLOAD_MAX_BYTES:
+                    raise HTTPException(413, f"Datei größer als {UPLOAD_MAX_BYTES // (1024 * 1024)} MB")
+                await run_in_threadpool(f.write, block)
+        finally:
+            await run_in_threadpool(f.close)
+        await run_in_threadpool(os.replace, pfad + '.tmp', pfad)
+    finally:
+        if os.path.exists(pfad + '.tmp'):
+            os.remove(pfad + '.tmp')
+
+    # Einlesen und Prüfen außerhalb der Event-Loop
+    try:
+        df = await run_in_threadpool(read_upload, typ, pfad)
+    except Exception as e:
+        os.remove(pfad)
+        raise HTTPException(422, f"Fehler in {UPLOAD_TYPEN[typ][0]}: {e}")
+
+    # Eingelesene Tabelle für die Verarbeitung ablegen - die Excel-Datei wird nicht erneut geparst
+    await run_in_threadpool(app.save_mandant_stand, mandant, f'uploads/{upload_id}', {'version': UPLOAD_VERSION, 'df': df})
+    with app.db_verbindung() as conn:
+        conn.execute(
+            'INSERT INTO uploads (id, mandant, typ, dateiname, pfad, groesse, zeilen, erstellt) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (upload_id, mandant, typ, dateiname, pfad, groesse, len(df), app.jetzt_iso())
+        )
+    return {'upload_id': upload_id, 'typ': typ, 'dateiname': dateiname, 'groesse': groesse, 'zeilen': len(df)}
+
+def load_upload(mandant, upload_id, typ):
+    """Lädt die eingelesene Tabelle eines Uploads des Mandanten"""
+    with app.db_verbindung() as conn:
+        row = conn.execute('SELECT typ FROM uploads WHERE id = ? AND mandant = ?', (upload_id, mandant)).fetchone()
+    if row is None:
+        raise HTTPException(404, f"Upload '{upload_id}' nicht gefunden")
+    if row['typ'] != typ:
+        raise HTTPException(422, f"Upload '{upload_id}' ist vom Typ '{row['typ']}', erwartet '{typ}'")
+
+    stand = app.load_mandant_stand(mandant, f'uploads/{upload_id}', UPLOAD_VERSION)
+    if stand is None:
+        raise HTTPException(410, f"Daten zu Upload '{upload_id}' nicht mehr vorhanden - bitte erneut hochladen")
+    return stand['df']
+
+# === VERARBEITUNG ===
+
+class ParameterAnfrage(BaseModel):
+    """Überschreibt einzelne Werte der gespeicherten Konfiguration"""
+    startbuergschaft: Optional[float] = None
+    pauschalbetrag: Optional[float] = None
+    zollsatz_ersatz: Optional[float] = None
+    zollsatz_null_ersetzen: Optional[bool] = None
+    eust_satz: Optional[float] = None
+    verwahrungsfrist_tage: Optional[int] = None
+    wids_aggregation: Optional[str] = None
+    buergschaft_erhoehung_aktiv: Optional[bool] = None
+    buergschaft_erhoehung_datum: Optional[date] = None
+    buergschaft_erhoehung_betrag: Optional[float] = None
+
+class ProzessAnfrage(BaseModel):
+    leit: str
+    ncar: Optional[str] = None
+    eza: List[str] = []
+    zlvav: Optional[str] = None
+    ncts: Optional[str] = None
+    von: Optional[date] = None
+    bis: Optional[date] = None
+    konfiguration: Optional[str] = None
+    delta_modus: bool = False
+    eza_auto_reduce: bool = True
+    parameter: ParameterAnfrage = ParameterAnfrage()
+
+def build_werte(mandant, anfrage):
+    """Berechnungswerte wie in der Session: Standardwerte, gespeicherte Konfiguration, Angaben der Anfrage"""
+    settings = app.load_settings(mandant)
+    config_name = anfrage.konfiguration or settings.get('current_config')
+    if anfrage.konfiguration and anfrage.konfiguration not in settings:
+        raise HTTPException(404, f"Konfiguration '{anfrage.konfiguration}' nicht gefunden")
+
+    werte = {
+        key: app.DEFAULT_VALUES[key]
+        for key in ['eust_satz', 'verwahrungsfrist_tage', 'wids_aggregation', 'zollsatz_null_ersetzen']
+    }
+    werte.update(app.config_to_werte(settings.get(config_name, {}) if config_name else {}))
+
+    for name, wert in anfrage.parameter.model_dump(exclude_none=True).items():
+        werte[name.replace('erhoehung', 'erhöhung')] = wert
+    if anfrage.von:
+        werte['von_datum'] = anfrage.von
+    if anfrage.bis:
+        werte['bis_datum'] = anfrage.bis
+    return werte
+
+def build_eingaben(mandant, anfrage):
+    """Stellt die Eingaben eines Laufs aus den Uploads zusammen (wie collect_processing_inputs aus der Session)"""
+    werte = build_werte(mandant, anfrage)
+
+    try:
+        df_leit = app.filter_leit_zeitraum(load_upload(mandant, anfrage.leit, 'leit'), werte['von_datum'], werte['bis_datum'])
+        anmeldeart_col = app.find_col(df_leit, ['Anmeldeart Folgeverfahren'])
+    except ValueError as e:
+        raise HTTPException(422, f"Fehler in {UPLOAD_TYPEN['leit'][0]}: {e}")
+    if df_leit.empty:
+        raise HTTPException(422, "Keine Daten im gewählten Zeitraum gefunden")
+    werte['stats'] = app.calculate_statistics(df_leit, anmeldeart_col)
+
+    # Mehrere EZA-Dateien werden zusammengeführt und gemeinsam aufbereitet (Duplikate über alle Dateien)
+    df_import_eza = None
+    if anfrage.eza:
+        df_import_eza = app.prepare_eza_import(
+            pd.concat([load_upload(mandant, upload_id, 'eza') for upload_id in anfrage.eza], ignore_index=True),
+            anfrage.eza_auto_reduce
+        )
+    df_import_zl = load_upload(mandant, anfrage.zlvav, 'zlvav') if anfrage.zlvav else None
+    df_ncts = load_upload(mandant, anfrage.ncts, 'ncts') if anfrage.ncts else None
+
+    fehlend = app.find_missing_imports(werte['stats'], df_import_eza, df_import_zl, df_ncts)
+    if fehlend:
+        raise HTTPException(422, f"Fehlende Dateien: {', '.join(fehlend)}")
+
+    return {
+        'df_leit': df_leit,
+        'df_import_eza': df_import_eza,
+        'df_import_zl': df_import_zl,
+        'df_ncts': df_ncts if app.is_dataframe_valid(df_ncts) else None,
+        'df_ncar': load_upload(mandant, anfrage.ncar, 'ncar') if anfrage.ncar else None,
+        'leit_stats': dict(werte['stats']),
+        'params': app.get_processing_params(werte),
+        'mandant_key': mandant,
+        'delta_modus': anfrage.delta_modus,
+        'historie_basis': app.get_history_basis(werte),
+        'profiler': {}
+    }
+
+@api.post('/process/start', status_code=202)
+def process_start(anfrage: ProzessAnfrage, mandant: str = Depends(get_mandant)):
+    """Stellt einen Verarbeitungslauf in die Warteschlange - die Worker arbeiten sie reihum über alle Mandanten ab"""
+    job_id = app.submit_job(build_eingaben(mandant, anfrage), quelle='api')
+    return {'job_id': job_id, 'status': 'wartend', 'status_url': f'/process/status?id={job_id}'}
+
+def load_mandant_job(mandant, job_id):
+    job = app.load_job(job_id)
+    if job is None or job['mandant'] != mandant:
+        raise HTTPException(404, f"Job '{job_id}' nicht gefunden")
+    return job
+
+def pick_up_job(job):
+    """Übernimmt das Ergebnis eines fertigen Jobs einmalig in die Historie (wie die UI bei der Anzeige)"""
+    with app.db_verbindung() as conn:
+        uebernommen = conn.execute('UPDATE jobs SET abgeholt = 1 WHERE id = ? AND abgeholt = 0', (job['id'],)).rowcount
+    if not uebernommen:
+        # Eine parallele Statusabfrage übernimmt gerade
+        return job
+
+    try:
+        stand = app.load_mandant_stand(job['mandant'], f"jobs/{job['id']}_ergebnis", app.JOB_VERSION)
+        if stand is None:
+            app.update_job(job['id'], fehler="Ergebnisdatei des Jobs nicht gefunden")
+        elif stand['ergebnis']['ziel_sorted'] is None:
+            app.update_job(job['id'], text="Keine Daten zum Verarbeiten gefunden")
+        else:
+            app.update_job(job['id'], run_id=app.save_result_to_history(job['mandant'], stand['ergebnis']))
+    except Exception:
+        app.update_job(job['id'], abgeholt=0)
+        raise
+    app.entferne_job_datei(job['mandant'], job['id'], 'ergebnis')
+    return app.load_job(job['id'])
+
+@api.get('/process/status')
+def process_status(id: str, mandant: str = Depends(get_mandant)):
+    """Status eines Jobs; nach Abschluss mit Historie-Lauf und Export-Link"""
+    job = load_mandant_job(mandant, id)
+    if job['status'] == 'fertig' and not job['abgeholt']:
+        job = pick_up_job(job)
+
+    return {
+        'job_id': job['id'],
+        'status': job['status'],
+        'fortschritt': job['fortschritt'],
+        'text': job['text'],
+        'schritte': job['schritte'],
+        'warnungen': job['warnungen'],
+        'fehler': job['fehler'],
+        'erstellt': job['erstellt'],
+        'gestartet': job['gestartet'],
+        'beendet': job['beendet'],
+        'run_id': job['run_id'],
+        'export_url': f"/exports/{job['run_id']}" if job['run_id'] else None
+    }
+
+@api.post('/process/cancel')
+def process_cancel(id: str, mandant: str = Depends(get_mandant)):
+    """Bricht einen wartenden oder laufenden Job ab"""
+    load_mandant_job(mandant, id)
+    app.cancel_job(id)
+    return {'job_id': id, 'status': app.load_job(id)['status']}
+
+# === EXPORT, HISTORIE, SETTINGS ===
+
+@api.get('/exports/{run_id}')
+def export(run_id: int, mandant: str = Depends(get_mandant)):
+    """Excel-Datei eines Laufs (wird in Blöcken von der Platte gestreamt)"""
+    with app.db_verbindung() as conn:
+        row = conn.execute(
+            """SELECT a.pfad FROM run_artefakte a JOIN runs r ON r.id = a.run_id
+               WHERE a.run_id = ? AND a.typ = 'excel' AND r.mandant = ?""",
+            (run_id, mandant)
+        ).fetchone()
+    if row is None or not os.path.exists(row['pfad']):
+        raise HTTPException(404, f"Kein Excel-Export zu Lauf {run_id}")
+
+    dateiname = os.path.basename(row['pfad']).split('_', 2)[-1]
+    return FileResponse(row['pfad'], media_type=EXCEL_MEDIA_TYPE, filename=dateiname)
+
+@api.get('/history')
+def history(limit: int = Query(app.HISTORIE_SEITENGROESSE, ge=1, le=500), offset: int = Query(0, ge=0),
+            mandant: str = Depends(get_mandant)):
+    return {
+        'gesamt': app.count_history(mandant_key=mandant),
+        'eintraege': app.load_history(limit, offset, mandant_key=mandant)
+    }
+
+@api.get('/history/{run_id}')
+def history_entry(run_id: int, mandant: str = Depends(get_mandant)):
+    entry = app.load_history_entry(run_id)
+    if entry is None or entry['mandant'] != mandant:
+        raise HTTPException(404, f"Lauf {run_id} nicht gefunden")
+    return {**entry, 'export_url': f'/exports/{run_id}'}
+
+@api.get('/settings')
+def get_settings(mandant: str = Depends(get_mandant)):
+    return app.load_settings(mandant)
+
+@api.put('/settings')
+def put_settings(settings: Dict[str, Any], mandant: str = Depends(get_mandant)):
+    """Speichert die Settings des Mandanten (DB und JSON-Fallback) nach Prüfung aller Konfigurationen"""
+    for name, config in settings.items():
+        if name == 'current_config':
+            continue
+        try:
+            app.config_to_werte(config)
+        except (AttributeError, TypeError, ValueError) as e:
+            raise HTTPException(422, f"Ungültige Konfiguration '{name}': {e}")
+    if settings.get('current_config') not in (None, *settings):
+        raise HTTPException(422, f"current_config '{settings['current_config']}' ist keine gespeicherte Konfiguration")
+
+    app.save_settings(settings, mandant)
+    return settings
@@ -10,10 +10,29 @@ import re
 from typing import List, Dict, Optional, Tuple
 import json
 import os
+import sys
 import traceback
 import time
+import threading
+import uuid
+import subprocess
+import sqlite3
+import hashlib
+import glob
+import base64
+import pickle
+import shutil
+import tempfile
+from contextlib import contextmanager
+import xlsxwriter
 from streamlit_option_menu import option_menu
 from collections import defaultdict
+from itertools import groupby
+
+try:
+    import resource
+except ImportError:  # Windows: kein getrusage, Profiler misst dann ohne RSS
+    resource = None
 
 # Konfiguration
 st.set_page_config(
@@ -228,31 +247,401 @@ def show_login():
         
         st.stop()
 
+# === DATENBANK (SQLite) ===
+
+DB_DATEI = os.environ.get('BUERGCONTROL_DB', 'buergcontrol.db')
+ARTEFAKT_VERZEICHNIS = os.environ.get('BUERGCONTROL_ARTEFAKTE', 'artefakte')
+
+DB_SCHEMA = """
+CREATE TABLE IF NOT EXISTS settings (
+    mandant TEXT PRIMARY KEY,
+    settings_json TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    mandant TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    von_datum TEXT NOT NULL,
+    bis_datum TEXT NOT NULL,
+    zeilen INTEGER NOT NULL DEFAULT 0,
+    startbuergschaft REAL NOT NULL DEFAULT 0,
+    max_auslastung TEXT,
+    status TEXT NOT NULL DEFAULT 'fertig',
+    stats_json TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_runs_mandant_zeit ON runs (mandant, timestamp DESC);
+CREATE INDEX IF NOT EXISTS idx_runs_mandant_zeitraum ON runs (mandant, von_datum, bis_datum);
+
+CREATE TABLE IF NOT EXISTS processing_stats (
+    run_id INTEGER NOT NULL REFERENCES runs (id) ON DELETE CASCADE,
+    schluessel TEXT NOT NULL,
+    wert INTEGER NOT NULL,
+    PRIMARY KEY (run_id, schluessel)
+);
+
+CREATE TABLE IF NOT EXISTS run_parameter (
+    run_id INTEGER NOT NULL REFERENCES runs (id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    wert_json TEXT,
+    PRIMARY KEY (run_id, name)
+);
+
+CREATE TABLE IF NOT EXISTS run_artefakte (
+    run_id INTEGER NOT NULL REFERENCES runs (id) ON DELETE CASCADE,
+    typ TEXT NOT NULL,
+    pfad TEXT NOT NULL,
+    groesse INTEGER NOT NULL,
+    checksum TEXT NOT NULL,
+    PRIMARY KEY (run_id, typ)
+);
+
+CREATE TABLE IF NOT EXISTS run_profil (
+    run_id INTEGER NOT NULL REFERENCES runs (id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    stufe TEXT NOT NULL,
+    zeilen INTEGER,
+    wand_s REAL NOT NULL,
+    cpu_s REAL NOT NULL,
+    rss_delta_mb REAL,
+    aus_cache INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (run_id, position)
+);
+
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    mandant TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'wartend',
+    erstellt TEXT NOT NULL,
+    gestartet TEXT,
+    beendet TEXT,
+    aktualisiert TEXT,
+    worker TEXT,
+    zeilen INTEGER,
+    fortschritt REAL NOT NULL DEFAULT 0,
+    text TEXT,
+    schritte_json TEXT NOT NULL DEFAULT '[]',
+    warnungen_json TEXT NOT NULL DEFAULT '[]',
+    abbrechen INTEGER NOT NULL DEFAULT 0,
+    abgeholt INTEGER NOT NULL DEFAULT 0,
+    quelle TEXT NOT NULL DEFAULT 'ui',
+    run_id INTEGER,
+    fehler TEXT,
+    traceback TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, erstellt);
+CREATE INDEX IF NOT EXISTS idx_jobs_mandant ON jobs (mandant, erstellt DESC);
+
+CREATE TABLE IF NOT EXISTS job_worker (
+    name TEXT PRIMARY KEY,
+    aktualisiert TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS uploads (
+    id TEXT PRIMARY KEY,
+    mandant TEXT NOT NULL,
+    typ TEXT NOT NULL,
+    dateiname TEXT,
+    pfad TEXT NOT NULL,
+    groesse INTEGER NOT NULL,
+    zeilen INTEGER,
+    erstellt TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_uploads_mandant ON uploads (mandant, erstellt DESC);
+
+CREATE TABLE IF NOT EXISTS api_tokens (
+    token_hash TEXT PRIMARY KEY,
+    mandant TEXT NOT NULL,
+    kunde TEXT NOT NULL,
+    erstellt TEXT NOT NULL,
+    gueltig_bis TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS json_importe (
+    datei TEXT PRIMARY KEY,
+    mandant TEXT NOT NULL,
+    eintraege INTEGER NOT NULL,
+    importiert_am TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS match_tabelle (
+    mandant TEXT NOT NULL,
+    leit_key TEXT NOT NULL,
+    signatur TEXT NOT NULL,
+    anmeldeart TEXT NOT NULL,
+    methode TEXT NOT NULL,
+    erledigung_mit TEXT,
+    import_raenge_json TEXT NOT NULL,
+    anzahl_treffer INTEGER NOT NULL DEFAULT 0,
+    stats_json TEXT NOT NULL,
+    zuletzt_verwendet TEXT NOT NULL,
+    PRIMARY KEY (mandant, leit_key)
+);
+CREATE INDEX IF NOT EXISTS idx_match_tabelle_verwendet ON match_tabelle (mandant, zuletzt_verwendet);
+"""
+
+MATCH_TABELLE_AUFBEWAHRUNG_TAGE = 400
+
+_DB_INITIALISIERT = set()
+
+def get_db_connection(db_datei=None):
+    """Öffnet die SQLite-Datenbank im WAL-Modus und legt das Schema beim ersten Zugriff an"""
+    db_datei = db_datei or DB_DATEI
+    conn = sqlite3.connect(db_datei, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA foreign_keys = ON')
+    
+    if db_datei not in _DB_INITIALISIERT:
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('PRAGMA synchronous = NORMAL')
+        conn.executescript(DB_SCHEMA)
+        import_history_json_files(conn)
+        conn.commit()
+        _DB_INITIALISIERT.add(db_datei)
+    
+    return conn
+
+@contextmanager
+def db_verbindung(db_datei=None):
+    """Kurzlebige DB-Verbindung mit Commit/Rollback - eine Verbindung pro Zugriff (threadsicher)"""
+    conn = get_db_connection(db_datei)
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+def get_mandant_key():
+    """Bereinigter Mandanten-Schlüssel für Dateinamen und Datenbank"""
+    if 'mandant' not in st.session_state or not st.session_state['mandant']:
+        return None
+    return build_mandant_key(st.session_state['mandant'])
+
+def build_mandant_key(mandant):
+    return mandant.lower().replace(' ', '_')
+
+def german_to_iso_date(date_str):
+    """Wandelt TT.MM.JJJJ in JJJJ-MM-TT um (sortier- und indexierbar)"""
+    return datetime.strptime(date_str, '%d.%m.%Y').strftime('%Y-%m-%d')
+
+def iso_to_german_date(date_str):
+    """Wandelt JJJJ-MM-TT in TT.MM.JJJJ um"""
+    return datetime.strptime(date_str, '%Y-%m-%d').strftime('%d.%m.%Y')
+
+def save_history_artifact(conn, mandant_key, run_id, typ, data, dateiname):
+    """Legt ein Artefakt (z.B. Excel) im Dateisystem ab und speichert die Referenz in der DB"""
+    verzeichnis = os.path.join(ARTEFAKT_VERZEICHNIS, mandant_key)
+    os.makedirs(verzeichnis, exist_ok=True)
+    pfad = os.path.join(verzeichnis, f"run_{run_id:06d}_{dateiname}")
+    
+    with open(pfad, 'wb') as f:
+        f.write(data)
+    
+    conn.execute(
+        'INSERT OR REPLACE INTO run_artefakte (run_id, typ, pfad, groesse, checksum) VALUES (?, ?, ?, ?, ?)',
+        (run_id, typ, pfad, len(data), hashlib.sha256(data).hexdigest())
+    )
+    return pfad
+
+def load_history_artifact(run_id, typ='excel'):
+    """Lädt ein gespeichertes Artefakt eines Laufs (None wenn nicht vorhanden)"""
+    with db_verbindung() as conn:
+        row = conn.execute('SELECT pfad FROM run_artefakte WHERE run_id = ? AND typ = ?', (run_id, typ)).fetchone()
+    
+    if not row or not os.path.exists(row['pfad']):
+        return None
+    with open(row['pfad'], 'rb') as f:
+        return f.read()
+
+def insert_history_run(conn, mandant_key, entry, excel_bytes):
+    """Schreibt einen Historie-Eintrag inkl. Statistiken, Parametern und Excel-Artefakt"""
+    cursor = conn.execute(
+        """INSERT INTO runs (mandant, timestamp, von_datum, bis_datum, zeilen, startbuergschaft, max_auslastung, stats_json)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+        (
+            mandant_key,
+            entry['timestamp'],
+            german_to_iso_date(entry['von_datum']),
+            german_to_iso_date(entry['bis_datum']),
+            int(entry.get('zeilen', 0)),
+            float(entry.get('startbuergschaft', 0)),
+            entry.get('max_auslastung', 'N/A'),
+            json.dumps(entry.get('stats', {}), ensure_ascii=False)
+        )
+    )
+    run_id = cursor.lastrowid
+    
+    conn.executemany(
+        'INSERT INTO processing_stats (run_id, schluessel, wert) VALUES (?, ?, ?)',
+        [(run_id, key, int(value)) for key, value in entry.get('processing_stats', {}).items()]
+    )
+    conn.executemany(
+        'INSERT INTO run_parameter (run_id, name, wert_json) VALUES (?, ?, ?)',
+        [(run_id, name, json.dumps(value, ensure_ascii=False)) for name, value in entry.get('config', {}).items()]
+    )
+    
+    if excel_bytes:
+        von_dt = datetime.strptime(entry['von_datum'], '%d.%m.%Y')
+        bis_dt = datetime.strptime(entry['bis_datum'], '%d.%m.%Y')
+        save_history_artifact(
+            conn, mandant_key, run_id, 'excel', excel_bytes,
+            f"Verwahrliste_{von_dt.strftime('%m_%y')}#{bis_dt.strftime('%m_%y')}.xlsx"
+        )
+    
+    return run_id
+
+def save_run_profil(run_id, profiler):
+    """Speichert das Laufzeitprotokoll (Profiler-Stufen) zu einem Historie-Eintrag"""
+    try:
+        with db_verbindung() as conn:
+            conn.executemany(
+                """INSERT OR REPLACE INTO run_profil (run_id, position, stufe, zeilen, wand_s, cpu_s, rss_delta_mb, aus_cache)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                [
+                    (
+                        run_id, position, name, None if messung['zeilen'] is None else int(messung['zeilen']),
+                        messung['wand_s'], messung['cpu_s'], messung['rss_delta_mb'], int(messung['cache'])
+                    )
+                    for position, (name, messung) in enumerate(profiler.items())
+                ]
+            )
+    except sqlite3.Error as e:
+        st.warning(f"⚠️ Laufzeitprotokoll konnte nicht gespeichert werden: {e}")
+
+def load_match_table(mandant_key):
+    """Lädt die gespeicherte Match-Tabelle eines Mandanten (Leitdatei-Schlüssel -> Eintrag)"""
+    with db_verbindung() as conn:
+        rows = conn.execute(
+            """SELECT leit_key, signatur, anmeldeart, methode, erledigung_mit, import_raenge_json, anzahl_treffer, stats_json
+               FROM match_tabelle WHERE mandant = ?""",
+            (mandant_key,)
+        ).fetchall()
+    
+    return {
+        row['leit_key']: {
+            'signatur': row['signatur'],
+            'anmeldeart': row['anmeldeart'],
+            'methode': row['methode'],
+            'erledigung_mit': row['erledigung_mit'] or '',
+            'import_raenge': json.loads(row['import_raenge_json']),
+            'anzahl_treffer': row['anzahl_treffer'],
+            'stats': json.loads(row['stats_json'])
+        }
+        for row in rows
+    }
+
+def save_match_table(mandant_key, neue_eintraege, verwendete_keys):
+    """Speichert neu berechnete Matches, markiert wiederverwendete und entfernt veraltete Einträge"""
+    jetzt = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    grenze = (datetime.now() - timedelta(days=MATCH_TABELLE_AUFBEWAHRUNG_TAGE)).strftime('%Y-%m-%d %H:%M:%S')
+    
+    with db_verbindung() as conn:
+        conn.executemany(
+            """INSERT OR REPLACE INTO match_tabelle
+               (mandant, leit_key, signatur, anmeldeart, methode, erledigung_mit, import_raenge_json, anzahl_treffer, stats_json, zuletzt_verwendet)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            [
+                (
+                    mandant_key, leit_key, eintrag['signatur'], eintrag['anmeldeart'], eintrag['methode'],
+                    eintrag['erledigung_mit'], json.dumps(eintrag['import_raenge']), int(eintrag['anzahl_treffer']),
+                    json.dumps(eintrag['stats']), jetzt
+                )
+                for leit_key, eintrag in neue_eintraege.items()
+            ]
+        )
+        conn.executemany(
+            'UPDATE match_tabelle SET zuletzt_verwendet = ? WHERE mandant = ? AND leit_key = ?',
+            [(jetzt, mandant_key, leit_key) for leit_key in verwendete_keys if leit_key not in neue_eintraege]
+        )
+        conn.execute(
+            'DELETE FROM match_tabelle WHERE mandant = ? AND zuletzt_verwendet < ?',
+            (mandant_key, grenze)
+        )
+
+def import_history_json_files(conn):
+    """Einmaliger Import vorhandener historie_*.json Dateien in die Datenbank"""
+    bereits_importiert = {row['datei'] for row in conn.execute('SELECT datei FROM json_importe')}
+    
+    for history_file in sorted(glob.glob('historie_*.json')):
+        if history_file in bereits_importiert:
+            continue
+        
+        mandant_key = history_file[len('historie_'):-len('.json')]
+        try:
+            with open(history_file, 'r', encoding='utf-8') as f:
+                history = json.load(f)
+        except Exception:
+            continue
+        
+        # Ältester Eintrag zuerst, damit die Run-IDs chronologisch bleiben
+        for entry in reversed(history):
+            excel_bytes = base64.b64decode(entry['excel_data']) if entry.get('excel_data') else None
+            insert_history_run(conn, mandant_key, entry, excel_bytes)
+        
+        conn.execute(
+            'INSERT INTO json_importe (datei, mandant, eintraege, importiert_am) VALUES (?, ?, ?, ?)',
+            (history_file, mandant_key, len(history), datetime.now().isoformat())
+        )
+
 # === SETTINGS MANAGEMENT ===
 
-def load_settings():
-    """Lädt mandantenspezifische Settings"""
-    if 'mandant' not in st.session_state:
+def get_settings_file(mandant_key=None):
+    """Gibt den Pfad zur JSON-Settings-Datei (Fallback) zurück"""
+    mandant_key = mandant_key or get_mandant_key()
+    return f"settings_{mandant_key}.json" if mandant_key else None
+
+def load_settings(mandant_key=None):
+    """Lädt mandantenspezifische Settings - DB-first, JSON-Fallback"""
+    mandant_key = mandant_key or get_mandant_key()
+    if not mandant_key:
         return {}
     
-    settings_file = f"settings_{st.session_state['mandant'].lower().replace(' ', '_')}.json"
+    try:
+        with db_verbindung() as conn:
+            row = conn.execute('SELECT settings_json FROM settings WHERE mandant = ?', (mandant_key,)).fetchone()
+        if row:
+            return json.loads(row['settings_json'])
+    except (sqlite3.Error, json.JSONDecodeError):
+        pass
+    
+    settings_file = get_settings_file(mandant_key)
     
     if os.path.exists(settings_file):
         try:
             with open(settings_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
+                settings = json.load(f)
         except Exception:
             return {}
+        
+        # Übernahme der JSON-Settings in die DB beim ersten Lesen
+        try:
+            with db_verbindung() as conn:
+                conn.execute(
+                    'INSERT OR IGNORE INTO settings (mandant, settings_json, updated_at) VALUES (?, ?, ?)',
+                    (mandant_key, json.dumps(settings, ensure_ascii=False), datetime.now().isoformat())
+                )
+        except sqlite3.Error:
+            pass
+        return settings
     return {}
 
-def save_settings(settings):
-    """Speichert mandantenspezifische Settings"""
-    if 'mandant' not in st.session_state:
+def save_settings(settings, mandant_key=None):
+    """Speichert mandantenspezifische Settings in der DB und als JSON-Fallback (Dual-Write)"""
+    mandant_key = mandant_key or get_mandant_key()
+    if not mandant_key:
         return
     
-    settings_file = f"settings_{st.session_state['mandant'].lower().replace(' ', '_')}.json"
+    try:
+        with db_verbindung() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO settings (mandant, settings_json, updated_at) VALUES (?, ?, ?)',
+                (mandant_key, json.dumps(settings, ensure_ascii=False), datetime.now().isoformat())
+            )
+    except sqlite3.Error as e:
+        st.warning(f"⚠️ Settings konnten nicht in der Datenbank gespeichert werden: {e}")
     
-    with open(settings_file, 'w', encoding='utf-8') as f:
+    with open(get_settings_file(mandant_key), 'w', encoding='utf-8') as f:
         json.dump(settings, f, indent=2, ensure_ascii=False)
 
 def check_initial_setup():
@@ -644,6 +1033,10 @@ VERARBEITBARE_ARTEN = ['IMDC', 'WIDS', 'IPDC', 'NCDP']
 S_ANMELDEARTEN = ['SUSP', 'SUDC', 'SUCO', 'SUCF']
 PAUSCHALE_ARTEN = ['(leer)', 'APDC', 'AVDC', 'NCAR']
 
+# Fortschrittsanzeige: Meldung alle n Leitdatei-Zeilen, UI-Update höchstens alle x Sekunden
+ZEILEN_PRO_FORTSCHRITT = 200
+FORTSCHRITT_INTERVALL_S = 0.1
+
 EXAKTE_EZA_SPALTEN = [
     "Teilnehmer",
     "Verfahren", 
@@ -698,6 +1091,95 @@ ANMELDEART_CONFIG = {
     }
 }
 
+# Pflichtspalten der Eingangsdateien (je Gruppe reicht eine der Alternativen)
+LEIT_PFLICHTSPALTEN = [
+    ['Datum Überlassung - CUSTST'],
+    ['Weitere Registriernummer Folgeverfahren', 'Weitere Registriernummer'],
+    ['Registriernummer Folgeverfahren'],
+    ['Anmeldeart Folgeverfahren'],
+    ['Bezugsnummer/LRN SumA'],
+    ['Registriernummer/MRN SumA'],
+    ['Datum Ende - CUSFIN']
+]
+
+IMPORT_PFLICHTSPALTEN = {
+    'IMDC': [
+        ['Registriernummer/MRN', 'Registriernummer / MRN', 'MRN'],
+        ['PositionNo'],
+        ['Warentarifnummer'],
+        ['Zollwert'],
+        ['AbgabeZollsatz']
+    ],
+    'WIDS': [
+        ['Registriernummer/MRN', 'Registriernummer / MRN', 'MRN', 'Registrienummer/MRN'],
+        ['PositionNo'],
+        ['Warentarifnummer'],
+        ['Vorraussichtliche Zollabgabe', 'Voraussichtliche Zollabgabe'],
+        ['Vorraussichtliche Zollsatzabgabe', 'Voraussichtliche Zollsatzabgabe'],
+        ['DV1UmgerechnerterRechnungsbetrag']
+    ],
+    'NCDP': [
+        ['MRN'],
+        ['Sicherheit']
+    ]
+}
+
+NCAR_PFLICHTSPALTEN = ['Registriernr.-SumA', 'RegistriernNr./MRN', 'Anzahl Packstücke']
+
+# Spaltenschema je Eingangsdatei: kanonischer Name und Schreibweisen (die erste ist der kanonische Name).
+# 'pflicht' wie bei find_col; 'zeilenweise' = je Zeile gilt die erste nicht-leere Schreibweise
+SPALTEN_SCHEMA = {
+    'leit': [
+        {'spalte': 'Weitere Registriernummer Folgeverfahren', 'pflicht': True,
+         'schreibweisen': ['Weitere Registriernummer Folgeverfahren', 'Weitere Registriernummer']},
+        {'spalte': 'Registriernummer Folgeverfahren', 'pflicht': True,
+         'schreibweisen': ['Registriernummer Folgeverfahren']},
+        {'spalte': 'Anmeldeart Folgeverfahren', 'pflicht': True,
+         'schreibweisen': ['Anmeldeart Folgeverfahren']},
+        {'spalte': 'Datum Überlassung - CUSTST', 'pflicht': True,
+         'schreibweisen': ['Datum Überlassung - CUSTST']},
+        {'spalte': 'Position SumA', 'pflicht': False,
+         'schreibweisen': ['Position SumA', 'Pos. SumA', 'PositionNo SumA', 'Position', 'Pos', 'PositionNo']}
+    ],
+    'eza': [
+        {'spalte': 'Registriernummer/MRN', 'pflicht': True,
+         'schreibweisen': ['Registriernummer/MRN', 'Registriernummer / MRN', 'MRN']},
+        {'spalte': 'PositionNo', 'pflicht': True, 'schreibweisen': ['PositionNo']}
+    ],
+    'zl': [
+        {'spalte': 'Registriernummer/MRN', 'pflicht': True,
+         'schreibweisen': ['Registriernummer/MRN', 'Registriernummer / MRN', 'MRN', 'Registrienummer/MRN']},
+        {'spalte': 'PositionNo', 'pflicht': True, 'schreibweisen': ['PositionNo']},
+        {'spalte': 'Vorraussichtliche Zollabgabe', 'pflicht': False, 'zeilenweise': True,
+         'schreibweisen': ['Vorraussichtliche Zollabgabe', 'Voraussichtliche Zollabgabe']},
+        {'spalte': 'Vorraussichtliche Zollsatzabgabe', 'pflicht': False, 'zeilenweise': True,
+         'schreibweisen': ['Vorraussichtliche Zollsatzabgabe', 'Voraussichtliche Zollsatzabgabe']},
+        {'spalte': 'DV1UmgerechnerterRechnungsbetrag', 'pflicht': False, 'zeilenweise': True,
+         'schreibweisen': ['DV1UmgerechnerterRechnungsbetrag', 'DV1 Umgerechneter Rechnungsbetrag']}
+    ],
+    'ncts': [
+        {'spalte': 'MRN', 'pflicht': False, 'schreibweisen': ['MRN']}
+    ]
+}
+
+# Kanonische ZL-Betragsspalten für die WIDS-Verarbeitung
+ZL_ZOLLABGABE = 'Vorraussichtliche Zollabgabe'
+ZL_ZOLLSATZ = 'Vorraussichtliche Zollsatzabgabe'
+ZL_DV1 = 'DV1UmgerechnerterRechnungsbetrag'
+
+# Spalten einer Ergebniszeile in der Reihenfolge des Excel-Sheets
+ERGEBNIS_SPALTEN = [
+    'Referenznummer', 'MRN-Nummer Eingang', 'ATB-Nummer', 'SUMA-Position', 'Gestellungsdatum',
+    'Beendigung der Verwahrung', 'Verwahrungsfrist', 'Verwahrungsdauer', 'Erledigung mit', 'Pos', 'Codenummer',
+    'Menge', 'Zollwert (total)', 'Drittlandzollsatz', 'Zölle (total)', 'EUSt', 'Gesamtabgaben', 'Anmeldeart'
+]
+
+# Kompakte Spaltentypen des Ergebnisses - Export und Bewegungen setzen die Positionsspalten wieder zusammen
+ERGEBNIS_BETRAG_SPALTEN = ['Menge', 'Zollwert (total)', 'Drittlandzollsatz', 'Zölle (total)', 'EUSt', 'Gesamtabgaben']
+ERGEBNIS_DATUM_SPALTEN = ['Gestellungsdatum', 'Beendigung der Verwahrung', 'Verwahrungsfrist']
+ERGEBNIS_KATEGORIE_SPALTEN = ['Anmeldeart', 'Erledigung mit']
+ERGEBNIS_POSITIONS_SPALTEN = ['Pos', 'SUMA-Position', 'Codenummer']
+
 DEFAULT_VALUES = {
     'df_leit': None,
     'df_import_eza': None,
@@ -714,6 +1196,7 @@ DEFAULT_VALUES = {
     'datum_filter_confirmed': False,
     'eza_auto_reduce': True,
     'ncar_enabled': True,
+    'delta_modus': False,
     'atb_filtered_count': 0,
     'show_settings': False,
     'processing_active': False,
@@ -732,18 +1215,41 @@ def init_session_state():
 
 def apply_config_to_session(config: Dict):
     """NEUE HILFSFUNKTION: Lädt Konfigurationswerte sicher in den st.session_state."""
-    st.session_state['von_datum'] = datetime.strptime(config.get('von', '01.05.2024'), '%d.%m.%Y').date()
-    st.session_state['bis_datum'] = datetime.strptime(config.get('bis', '30.04.2025'), '%d.%m.%Y').date()
-    st.session_state['startbuergschaft'] = float(config.get('buergschaft', 0))
-    st.session_state['zollsatz_ersatz'] = float(config.get('ersatz_zollsatz', 12.0)) / 100
-    st.session_state['pauschalbetrag'] = float(config.get('pauschale', 10000))
-    st.session_state['buergschaft_erhöhung_aktiv'] = config.get('buergschaft_erhoehung_aktiv', False)
+    st.session_state.update(config_to_werte(config))
+
+def config_to_werte(config: Dict) -> Dict:
+    """Wandelt eine gespeicherte Konfiguration (Settings) in Session-Werte um"""
     erhoehung_datum_str = config.get('buergschaft_erhoehung_datum')
-    if erhoehung_datum_str:
-        st.session_state['buergschaft_erhöhung_datum'] = datetime.strptime(erhoehung_datum_str, '%d.%m.%Y').date()
-    else:
-        st.session_state['buergschaft_erhöhung_datum'] = date.today()
-    st.session_state['buergschaft_erhöhung_betrag'] = float(config.get('buergschaft_erhoehung_betrag', 0))
+    return {
+        'von_datum': datetime.strptime(config.get('von', '01.05.2024'), '%d.%m.%Y').date(),
+        'bis_datum': datetime.strptime(config.get('bis', '30.04.2025'), '%d.%m.%Y').date(),
+        'startbuergschaft': float(config.get('buergschaft', 0)),
+        'zollsatz_ersatz': float(config.get('ersatz_zollsatz', 12.0)) / 100,
+        'pauschalbetrag': float(config.get('pauschale', 10000)),
+        'buergschaft_erhöhung_aktiv': config.get('buergschaft_erhoehung_aktiv', False),
+        'buergschaft_erhöhung_datum': datetime.strptime(erhoehung_datum_str, '%d.%m.%Y').date() if erhoehung_datum_str else date.today(),
+        'buergschaft_erhöhung_betrag': float(config.get('buergschaft_erhoehung_betrag', 0))
+    }
+
+def get_processing_params(werte=None) -> Dict:
+    """Sammelt alle Berechnungsparameter aus dem Session State (oder übergebenen Werten) in einem Dictionary"""
+    werte = st.session_state if werte is None else werte
+    return {
+        'pauschalbetrag': float(werte.get('pauschalbetrag', 10000.0)),
+        'zollsatz_ersatz': float(werte.get('zollsatz_ersatz', 0.12)),
+        'zollsatz_null_ersetzen': bool(werte.get('zollsatz_null_ersetzen', True)),
+        'eust_satz': float(werte.get('eust_satz', 0.19)),
+        'verwahrungsfrist_tage': int(werte.get('verwahrungsfrist_tage', 90)),
+        'wids_aggregation': werte.get('wids_aggregation', 'Position mit höchstem Zollwert'),
+        'startbuergschaft': float(werte.get('startbuergschaft', 0)),
+        'buergschaft_erhöhung_aktiv': bool(werte.get('buergschaft_erhöhung_aktiv', False)),
+        'buergschaft_erhöhung_datum': werte.get('buergschaft_erhöhung_datum', date(2025, 2, 4)),
+        'buergschaft_erhöhung_betrag': float(werte.get('buergschaft_erhöhung_betrag', 1500000.0))
+    }
+
+def is_erhoehung_tag(datum, params) -> bool:
+    """Prüft ob an diesem Tag die Bürgschaftserhöhung wirksam wird"""
+    return params['buergschaft_erhöhung_aktiv'] and datum == params['buergschaft_erhöhung_datum']
 
 def show_status(message, status='info', icon=None):
     """Einheitliche Status-Meldungen mit Icons"""
@@ -799,36 +1305,81 @@ def process_suma_position(row_data, suma_pos_col):
         return pd.to_numeric(suma_value, errors='ignore') if pd.notna(suma_value) else ''
     return ''
 
-def prepare_dataframe_for_sorting(df):
-    """Bereitet DataFrame für Standard-Sortierung vor"""
-    df = df.copy()
-    df['_gestell_date'] = df['Gestellungsdatum'].apply(parse_german_date)
-    df['_suma_pos_numeric'] = pd.to_numeric(df['SUMA-Position'], errors='coerce').fillna(999999)
-    return df
-
-def sort_dataframe_standard(df):
-    """Führt Standard-Sortierung durch und entfernt temporäre Spalten"""
-    df_sorted = df.sort_values(
-        by=['_gestell_date', 'ATB-Nummer', '_suma_pos_numeric'],
-        ascending=[True, True, True]
-    )
-    columns_to_drop = ['_gestell_date', '_suma_pos_numeric']
-    columns_to_drop = [col for col in columns_to_drop if col in df_sorted.columns]
-    if columns_to_drop:
-        df_sorted = df_sorted.drop(columns=columns_to_drop)
-    return df_sorted
+def factorize_sortiert(werte):
+    """Rang-Codes (int32) in Sortierreihenfolge; fehlende Werte erhalten den höchsten Code (wie na_position='last')"""
+    codes, uniques = pd.factorize(werte, sort=True)
+    return np.where(codes < 0, len(uniques), codes).astype(np.int32), uniques
+
+def build_sortier_schluessel(df):
+    """Schlüssel der Standard-Sortierung (Gestellungstag, ATB-Nummer, SUMA-Position) einmal als kompakte Ganzzahl-Codes"""
+    tag, tag_werte = factorize_sortiert(df['Gestellungsdatum'].dt.normalize())
+    suma = pd.to_numeric(get_positions_werte(df, 'SUMA-Position'), errors='coerce').fillna(999999)
+    return {
+        'tag': tag,
+        'tag_werte': tag_werte,
+        'atb': factorize_sortiert(df['ATB-Nummer'])[0],
+        'suma': factorize_sortiert(suma)[0]
+    }
+
+def get_standard_reihenfolge(schluessel):
+    """Stabile Reihenfolge der Standard-Sortierung aus den Sortierschlüsseln"""
+    return np.lexsort((schluessel['suma'], schluessel['atb'], schluessel['tag']))
+
+def sort_dataframe_standard(df, schluessel=None):
+    """Führt die Standard-Sortierung über die vorberechneten Sortierschlüssel durch"""
+    if schluessel is None:
+        schluessel = build_sortier_schluessel(df)
+    return df.take(get_standard_reihenfolge(schluessel))
 
 def find_col(df: pd.DataFrame, candidates: List[str], required: bool = True) -> Optional[str]:
-    """OPTIMIERT: Findet die erste passende Spalte und stoppt bei kritischem Fehler."""
+    """OPTIMIERT: Findet die erste passende Spalte; fehlt eine Pflichtspalte, folgt ein ValueError mit den Spaltennamen."""
     for c in candidates:
         if c in df.columns:
             return c
     
+    # Kein st.stop() hier: in Worker-Prozessen und der API gibt es keinen Script-Kontext, der Aufrufer meldet den Fehler
     if required:
-        st.error(f"❌ Kritischer Fehler: Eine der folgenden Pflichtspalten wurde in einer Ihrer Dateien nicht gefunden: `{', '.join(candidates)}`. Bitte prüfen Sie die Datei und laden Sie sie erneut hoch.")
-        st.stop()
+        raise ValueError(f"Eine der folgenden Pflichtspalten wurde in einer Ihrer Dateien nicht gefunden: `{', '.join(candidates)}`. Bitte prüfen Sie die Datei und laden Sie sie erneut hoch.")
     return None
 
+# Zuordnung je Datei und Spaltensatz, damit wiederholte Läufe die Schreibweisen nicht erneut auflösen
+_spalten_schema_cache = {}
+
+def resolve_spalten_schema(df: pd.DataFrame, datei: str) -> Dict[str, List[str]]:
+    """Löst die Schreibweisen einer Datei einmal je Spaltensatz auf (kanonischer Name -> vorhandene Schreibweisen)"""
+    cache_key = (datei, tuple(str(col) for col in df.columns))
+    zuordnung = _spalten_schema_cache.get(cache_key)
+    if zuordnung is None:
+        zuordnung = {}
+        for feld in SPALTEN_SCHEMA[datei]:
+            if feld['pflicht']:
+                find_col(df, feld['schreibweisen'])
+            zuordnung[feld['spalte']] = [col for col in feld['schreibweisen'] if col in df.columns]
+        _spalten_schema_cache[cache_key] = zuordnung
+    return zuordnung
+
+def apply_spalten_schema(df: pd.DataFrame, datei: str) -> Tuple[pd.DataFrame, Dict[str, Optional[str]]]:
+    """Benennt die Spalten einer Eingangsdatei auf die kanonischen Namen um; liefert Frame und Zuordnung (None = fehlt)"""
+    zuordnung = resolve_spalten_schema(df, datei)
+    umbenennen = {}
+    spalten = {}
+    for feld in SPALTEN_SCHEMA[datei]:
+        vorhanden = zuordnung[feld['spalte']]
+        if not vorhanden:
+            spalten[feld['spalte']] = None
+            continue
+        if feld.get('zeilenweise') and len(vorhanden) > 1:
+            werte = df[vorhanden[0]]
+            for col in vorhanden[1:]:
+                werte = werte.where(werte.notna(), df[col])
+            df[feld['spalte']] = werte
+        elif vorhanden[0] != feld['spalte']:
+            umbenennen[vorhanden[0]] = feld['spalte']
+        spalten[feld['spalte']] = feld['spalte']
+    if umbenennen:
+        df = df.rename(columns=umbenennen)
+    return df, spalten
+
 def clean_mrn(mrn_value) -> str:
     """Bereinigt MRN-Werte für den Vergleich"""
     if pd.isna(mrn_value):
@@ -838,11 +1389,6 @@ def clean_mrn(mrn_value) -> str:
         cleaned = cleaned.split('.')[0]
     return cleaned
 
-def has_atb_in_weitere_folge(leit_row, field_mappings) -> bool:
-    """Prüft ob Weitere Registriernummer Folgeverfahren mit ATB beginnt"""
-    weitere_folge = leit_row.get(field_mappings['leit_col_weitere'], '')
-    return str(weitere_folge).strip().startswith('ATB')
-
 def parse_german_date(date_str):
     """Konvertiert deutsches Datum (DD.MM.YYYY) in Date-Objekt"""
     if pd.isna(date_str) or date_str == '' or date_str is None:
@@ -874,26 +1420,74 @@ def parse_german_date(date_str):
     
     return None
 
+def parse_datum_spalte(werte):
+    """Zeitstempel einer ganzen Spalte (NaT bei leer) und Maske der nicht auswertbaren Werte (None, Fehler)"""
+    if pd.api.types.is_datetime64_any_dtype(werte):
+        return werte, np.zeros(len(werte), dtype=bool)
+    
+    parsed = pd.to_datetime(werte, errors='coerce', format='mixed')
+    fehler = (werte.notna() & parsed.isna()).to_numpy()
+    
+    # Das Format leitet pandas aus dem ersten Wert ab - abweichende Schreibweisen einzeln wie bisher nachparsen
+    if fehler.any():
+        def parse(wert):
+            try:
+                return pd.to_datetime(wert)
+            except (ValueError, TypeError):
+                return None
+        
+        positionen = np.flatnonzero(fehler)
+        nachgeparst = [parse(wert) for wert in werte.iloc[positionen]]
+        ok = np.array([wert is not None for wert in nachgeparst], dtype=bool)
+        if ok.any():
+            parsed = parsed.copy()
+            parsed.iloc[positionen[ok]] = [wert for wert in nachgeparst if wert is not None]
+            fehler[positionen[ok]] = False
+    
+    # None gilt wie bisher als nicht auswertbar, NaN dagegen als leer
+    fehler |= werte.to_numpy(dtype=object) == None  # noqa: E711 - elementweiser Vergleich
+    return parsed.astype('datetime64[ns]'), fehler
+
+def to_date_werte(werte):
+    """safe_date_value für eine ganze Spalte (date-Objekte, None bei leeren oder ungültigen Werten)"""
+    if pd.api.types.is_datetime64_any_dtype(werte):
+        return werte.dt.date.astype(object).where(werte.notna(), None)
+    return werte.map(safe_date_value)
+
 def calculate_warehouse_dates(gestell, beendigung, frist_tage=90):
-    """Zentrale Datumberechnung für alle Anmeldearten"""
-    try:
-        dt1 = pd.to_datetime(gestell)
-        dt2 = pd.to_datetime(beendigung)
-        verfrist_date = (dt1 + timedelta(days=frist_tage)).date()
-        return {
-            'verwahrungsfrist': (dt1 + timedelta(days=frist_tage)).strftime('%d.%m.%Y'),
-            'verwahrungsfrist_date': verfrist_date,
-            'verwahrungsdauer': (dt2 - dt1).days + 1
-        }
-    except Exception:
-        return {'verwahrungsfrist': '', 'verwahrungsfrist_date': None, 'verwahrungsdauer': 0}
+    """Zentrale Datumberechnung für alle Anmeldearten, spaltenweise (Ersatzwerte None / 0 bei ungültigen Daten, NaN ohne Ende)"""
+    dt1, fehler1 = parse_datum_spalte(gestell)
+    dt2, fehler2 = parse_datum_spalte(beendigung)
+    frist = dt1 + pd.Timedelta(days=frist_tage)
+    
+    # Ohne Gestellungsdatum schlägt die Fristberechnung fehl, fehlendes Ende ergibt eine leere Dauer
+    ersatz = fehler1 | fehler2 | frist.isna().to_numpy()
+    return {
+        'verwahrungsfrist_date': frist.dt.date.astype(object).where(~ersatz, None).to_numpy(),
+        'verwahrungsdauer': ((dt2 - dt1).dt.days + 1).where(~ersatz, 0).to_numpy(dtype='float64')
+    }
+
+def build_warehouse_dates(df_leit, field_mappings, params):
+    """Verwahrungsfrist und -dauer aller Leitdatei-Zeilen, einmal je Lauf berechnet (Arrays nach Position)"""
+    return calculate_warehouse_dates(
+        df_leit[field_mappings['gestell_col']], df_leit['Datum Ende - CUSFIN'], params['verwahrungsfrist_tage']
+    )
+
+def get_warehouse_dates(warehouse_dates, positionen):
+    """Verwahrungsdaten einer Position oder Positionsliste - Dauer ganzzahlig, solange keine leere Dauer (NaN) dabei ist"""
+    dauer = warehouse_dates['verwahrungsdauer'][positionen]
+    return {
+        'verwahrungsfrist_date': warehouse_dates['verwahrungsfrist_date'][positionen],
+        'verwahrungsdauer': dauer if np.isnan(dauer).any() else dauer.astype('int64')
+    }
+
+def find_missing_columns(df: pd.DataFrame, required_cols: List[List[str]]) -> List[List[str]]:
+    """Liefert die Pflichtspalten-Gruppen, von denen keine Alternative vorhanden ist"""
+    return [col_candidates for col_candidates in required_cols if not any(c in df.columns for c in col_candidates)]
 
 def validate_dataframe(df: pd.DataFrame, required_cols: List[List[str]], df_name: str) -> bool:
     """Validiert, ob alle erforderlichen Spalten vorhanden sind."""
-    missing = []
-    for col_candidates in required_cols:
-        if not any(c in df.columns for c in col_candidates):
-            missing.append(col_candidates)
+    missing = find_missing_columns(df, required_cols)
     
     if missing:
         st.error(f"❌ Fehlende Spalten in {df_name}:")
@@ -914,36 +1508,120 @@ def validate_import_file(df, required_cols, file_name):
         return False
     return True
 
+def partition_anmeldearten(anmeldearten) -> Dict[str, np.ndarray]:
+    """Positionen je Anmeldeart in einem Durchlauf über die kategorische Spalte (fehlende Werte unter '(leer)')"""
+    kategorie = anmeldearten.astype('category')
+    codes = kategorie.cat.codes.to_numpy()
+    
+    # Stabile Sortierung der Codes: jede Gruppe behält die Leitdatei-Reihenfolge, Code -1 = fehlender Wert
+    reihenfolge = np.argsort(codes, kind='stable')
+    grenzen = np.flatnonzero(np.diff(codes[reihenfolge])) + 1
+    return {
+        ('(leer)' if codes[gruppe[0]] == -1 else kategorie.cat.categories[codes[gruppe[0]]]): gruppe
+        for gruppe in np.split(reihenfolge, grenzen) if len(gruppe)
+    }
+
+def build_leit_partition(df_leit, field_mappings):
+    """Einmalige Aufteilung der Leitdatei für alle Stufen: Positionen je Anmeldeart und ATB-in-Weitere-Folge-Maske"""
+    return {
+        'arten': partition_anmeldearten(df_leit[field_mappings['anmeldeart_col']]),
+        'atb': df_leit[field_mappings['leit_col_weitere']].astype(str).str.strip().str.startswith('ATB').to_numpy()
+    }
+
+def get_partition_positionen(partition, anmeldeart):
+    """Positionen einer Anmeldeart in Leitdatei-Reihenfolge ('(leer)' umfasst fehlende und leere Werte)"""
+    leer = np.array([], dtype=np.intp)
+    positionen = partition['arten'].get(anmeldeart, leer)
+    if anmeldeart == '(leer)':
+        positionen = np.sort(np.concatenate([positionen, partition['arten'].get('', leer)]))
+    return positionen
+
+def get_matching_arten(partition, data_sources, leit_stats):
+    """Anmeldearten, die das Matching verarbeitet (mit vorhandener Importquelle bzw. pauschal laut Leitdatei-Statistik)"""
+    arten = [
+        art for art in VERARBEITBARE_ARTEN
+        if len(get_partition_positionen(partition, art))
+        and ('import_source' not in ANMELDEART_CONFIG[art] or not data_sources[ANMELDEART_CONFIG[art]['import_source']].empty)
+    ]
+    return arten + [art for art in PAUSCHALE_ARTEN if leit_stats.get(art, 0) > 0]
+
+def build_atb_ausschluss(df_leit, partition, arten):
+    """Audit der Leitdatei-Zeilen, die wegen ATB in 'Weitere Registriernummer' nicht verarbeitet wurden"""
+    positionen = np.sort(np.concatenate(
+        [np.array([], dtype=np.intp)] + [get_partition_positionen(partition, art) for art in arten]
+    ))
+    return df_leit.iloc[positionen[partition['atb'][positionen]]].reset_index(drop=True)
+
+def select_leit_partition(partition, positionen):
+    """Aufteilung für einen Ausschnitt der Leitdatei (sortierte Positionen), z.B. die geänderten Zeilen im Delta-Modus"""
+    positionen = np.asarray(positionen, dtype=np.intp)
+    arten = {}
+    for art, art_positionen in partition['arten'].items():
+        enthalten = art_positionen[np.isin(art_positionen, positionen)]
+        if len(enthalten):
+            arten[art] = np.searchsorted(positionen, enthalten)
+    return {'arten': arten, 'atb': partition['atb'][positionen]}
+
 def calculate_statistics(df: pd.DataFrame, anmeldeart_col: str) -> Dict[str, int]:
     """Berechnet Statistiken für die Anzeige."""
     stats = {}
     if anmeldeart_col in df.columns:
         alle_anmeldearten = VERARBEITBARE_ARTEN + S_ANMELDEARTEN + ['APDC', 'AVDC', 'NCAR']
-        counts = df[anmeldeart_col].value_counts()
+        arten = partition_anmeldearten(df[anmeldeart_col])
         
         for art in alle_anmeldearten:
-            stats[f"{art}"] = int(counts.get(art, 0))
+            stats[f"{art}"] = len(arten.get(art, []))
         
-        stats["(leer)"] = int(df[anmeldeart_col].isna().sum())
+        # Nur fehlende Werte, leere Texte zählen hier nicht als (leer)
+        stats["(leer)"] = len(arten.get('(leer)', []))
         stats["Gesamt"] = len(df)
     return stats
 
-def apply_zoelle_rule(results):
-    """Wendet die Regel an: Mindestabgaben und Zölle = Gesamtabgaben"""
-    pauschalbetrag = st.session_state.get('pauschalbetrag', 10000.0)
-    
-    for row in results:
-        if row['Gesamtabgaben'] > 0 and row['Gesamtabgaben'] < 1.0:
-            row['Gesamtabgaben'] = 1.0
-        elif row['Gesamtabgaben'] == 0:
-            if row['Zollwert (total)'] > 0:
-                row['Gesamtabgaben'] = 1.0
+# Geschäftsregeln auf den Betragsspalten, in dieser Reihenfolge angewendet:
+# 'bedingung' liefert die betroffenen Zeilen (None = alle), 'wert' den neuen Wert der Spalte
+GESCHAEFTSREGELN = [
+    {
+        'name': 'Mindestabgabe 1 €',
+        'spalte': 'Gesamtabgaben',
+        'bedingung': lambda spalten, params: (spalten['Gesamtabgaben'] > 0) & (spalten['Gesamtabgaben'] < 1.0),
+        'wert': lambda spalten, params: 1.0
+    },
+    {
+        'name': 'Mindestabgabe bei 0 € mit Zollwert',
+        'spalte': 'Gesamtabgaben',
+        'bedingung': lambda spalten, params: (spalten['Gesamtabgaben'] == 0) & (spalten['Zollwert (total)'] > 0),
+        'wert': lambda spalten, params: 1.0
+    },
+    {
+        'name': 'Pauschale bei 0 €',
+        'spalte': 'Gesamtabgaben',
+        'bedingung': lambda spalten, params: spalten['Gesamtabgaben'] == 0,
+        'wert': lambda spalten, params: params['pauschalbetrag']
+    },
+    {
+        'name': 'Zölle = Gesamtabgaben',
+        'spalte': 'Zölle (total)',
+        'bedingung': None,
+        'wert': lambda spalten, params: spalten['Gesamtabgaben']
+    }
+]
+
+def apply_geschaeftsregeln(puffer, params, regeln=GESCHAEFTSREGELN, profiler=None):
+    """Wendet die Regeltabelle spaltenweise auf den Ergebnis-Puffer an (je Regel Laufzeit und betroffene Zeilen im Profiler)"""
+    anzahl = puffer['anzahl']
+    # Sichten auf den belegten Teil der Puffer - Zuweisungen schreiben direkt in die Arrays
+    spalten = {spalte: puffer['spalten'][spalte][:anzahl] for spalte in ERGEBNIS_BETRAG_SPALTEN}
+    
+    for regel in regeln:
+        with profil_span(profiler, f"Preise › Geschäftsregeln › {regel['name']}") as messung:
+            if regel['bedingung'] is None:
+                maske = np.ones(anzahl, dtype=bool)
             else:
-                row['Gesamtabgaben'] = pauschalbetrag
-        
-        row['Zölle (total)'] = row['Gesamtabgaben']
+                maske = regel['bedingung'](spalten, params)
+            spalten[regel['spalte']][:] = np.where(maske, regel['wert'](spalten, params), spalten[regel['spalte']])
+            messung['zeilen'] = int(maske.sum())
     
-    return results
+    return puffer
 
 def is_dataframe_valid(df):
     """Prüft ob DataFrame gültig und nicht leer ist"""
@@ -1008,25 +1686,38 @@ def show_file_status(filename, count, reload_key, session_key=None, additional_i
 
 # === GEMEINSAME VERARBEITUNGSFUNKTIONEN ===
 
-def create_common_data(leit_row, gestell_col, dates_info):
-    """Erstellt gemeinsame Daten für alle Anmeldearten"""
-    return {
-        'Referenznummer': str(leit_row.get('Bezugsnummer/LRN SumA', '')),
-        'MRN-Nummer Eingang': str(leit_row.get('Registriernummer/MRN SumA', '')),
-        'ATB-Nummer': str(leit_row.get('Registriernummer/MRN SumA', '')),
-        'SUMA-Position': '',
-        'Gestellungsdatum': safe_date_value(leit_row.get(gestell_col, '')),
-        'Beendigung der Verwahrung': safe_date_value(leit_row.get('Datum Ende - CUSFIN', '')),
-        'Verwahrungsfrist': dates_info.get('verwahrungsfrist_date', None),
-        'Verwahrungsdauer': dates_info.get('verwahrungsdauer', 0),
-        'Erledigung mit': ''
-    }
+def write_common_data(puffer, leit_row, gestell_col, dates_info, erledigung_mit=''):
+    """Schreibt die gemeinsamen Daten aller Anmeldearten in die nächste Zeile des Ergebnis-Puffers"""
+    i = puffer['anzahl']
+    spalten = puffer['spalten']
+    spalten['Referenznummer'][i] = str(leit_row.get('Bezugsnummer/LRN SumA', ''))
+    spalten['MRN-Nummer Eingang'][i] = str(leit_row.get('Registriernummer/MRN SumA', ''))
+    spalten['ATB-Nummer'][i] = str(leit_row.get('Registriernummer/MRN SumA', ''))
+    spalten['Gestellungsdatum'][i] = safe_date_value(leit_row.get(gestell_col, ''))
+    spalten['Beendigung der Verwahrung'][i] = safe_date_value(leit_row.get('Datum Ende - CUSFIN', ''))
+    spalten['Verwahrungsfrist'][i] = dates_info.get('verwahrungsfrist_date', None)
+    spalten['Verwahrungsdauer'][i] = dates_info.get('verwahrungsdauer', 0)
+    spalten['Erledigung mit'][i] = erledigung_mit
 
-def create_no_match_row(common_data, leit_row, anmeldeart, suma_pos_col):
+def write_ergebnis_zeile(puffer, suma_position, pos, codenummer, menge, zollwert, drittlandzollsatz, zoelle, eust, gesamtabgaben, anmeldeart):
+    """Schreibt die anmeldeartspezifischen Werte in die Pufferzeile und schließt sie ab"""
+    i = puffer['anzahl']
+    spalten = puffer['spalten']
+    spalten['SUMA-Position'][i] = suma_position
+    spalten['Pos'][i] = pos
+    spalten['Codenummer'][i] = codenummer
+    spalten['Menge'][i] = to_betrag(menge)
+    spalten['Zollwert (total)'][i] = to_betrag(zollwert)
+    spalten['Drittlandzollsatz'][i] = to_betrag(drittlandzollsatz)
+    spalten['Zölle (total)'][i] = to_betrag(zoelle)
+    spalten['EUSt'][i] = to_betrag(eust)
+    spalten['Gesamtabgaben'][i] = to_betrag(gesamtabgaben)
+    spalten['Anmeldeart'][i] = anmeldeart
+    puffer['anzahl'] = i + 1
+
+def write_no_match_row(puffer, leit_row, anmeldeart, suma_pos_col, params):
     """Einheitliche No-Match Zeile für alle Anmeldearten"""
-    common_data['SUMA-Position'] = process_suma_position(leit_row, suma_pos_col)
-    
-    pauschalbetrag = st.session_state.get('pauschalbetrag', 10000.0)
+    pauschalbetrag = params['pauschalbetrag']
     
     if anmeldeart == 'NCDP':
         menge = 0
@@ -1035,18 +1726,10 @@ def create_no_match_row(common_data, leit_row, anmeldeart, suma_pos_col):
     else:
         menge = 0
     
-    return {
-        **common_data,
-        'Pos': 'KEIN MATCH',
-        'Codenummer': '',
-        'Menge': menge,
-        'Zollwert (total)': 0.0,
-        'Drittlandzollsatz': 0.0,
-        'Zölle (total)': 0.0,
-        'EUSt': 0.0,
-        'Gesamtabgaben': pauschalbetrag,
-        'Anmeldeart': anmeldeart
-    }
+    write_ergebnis_zeile(
+        puffer, process_suma_position(leit_row, suma_pos_col), 'KEIN MATCH', '', menge,
+        0.0, 0.0, 0.0, 0.0, pauschalbetrag, anmeldeart
+    )
 
 def find_import_matches(unique_id, fallback_id, import_df, match_col):
     """Sucht Matches in Import-Datei mit Fallback"""
@@ -1066,22 +1749,21 @@ def safe_numeric(value, default=0):
 
 # === SPEZIFISCHE BERECHNUNGSFUNKTIONEN ===
 
-def process_imdc_row(import_row, common_data, leit_row, pos_field, suma_pos_col):
+def process_imdc_row(puffer, import_row, leit_row, pos_field, suma_pos_col, params):
     """Verarbeitet eine IMDC-Zeile"""
     zollwert = safe_numeric(import_row.get('Zollwert', 0))
     drittlandzollsatz = safe_numeric(import_row.get('AbgabeZollsatz', 0))
     
-    if st.session_state.get('zollsatz_null_ersetzen', True) and drittlandzollsatz == 0 and zollwert > 0:
-        drittlandzollsatz = st.session_state.get('zollsatz_ersatz', 0.12) * 100
+    if params['zollsatz_null_ersetzen'] and drittlandzollsatz == 0 and zollwert > 0:
+        drittlandzollsatz = params['zollsatz_ersatz'] * 100
     
     zoelle_total = round(zollwert * drittlandzollsatz / 100, 2)
-    eust = round((zollwert + zoelle_total) * st.session_state.get('eust_satz', 0.19), 2)
+    eust = round((zollwert + zoelle_total) * params['eust_satz'], 2)
     
-    pauschalbetrag = st.session_state.get('pauschalbetrag', 10000.0)
+    pauschalbetrag = params['pauschalbetrag']
     gesamtabgaben = zoelle_total if zollwert > 0 else pauschalbetrag
     
-    common_data['ATB-Nummer'] = leit_row['Registriernummer/MRN SumA']
-    common_data['SUMA-Position'] = process_suma_position(leit_row, suma_pos_col)
+    puffer['spalten']['ATB-Nummer'][puffer['anzahl']] = leit_row['Registriernummer/MRN SumA']
     
     menge_value = safe_numeric(import_row.get('Menge', 0))
     pos_value = import_row.get(pos_field, '')
@@ -1089,85 +1771,63 @@ def process_imdc_row(import_row, common_data, leit_row, pos_field, suma_pos_col)
     codenummer = import_row.get('Warentarifnummer', '')
     codenummer_numeric = pd.to_numeric(codenummer, errors='ignore') if codenummer else ''
     
-    return {
-        **common_data,
-        'Pos': pos_numeric,
-        'Codenummer': codenummer_numeric,
-        'Menge': menge_value,
-        'Zollwert (total)': zollwert,
-        'Drittlandzollsatz': drittlandzollsatz,
-        'Zölle (total)': zoelle_total,
-        'EUSt': eust,
-        'Gesamtabgaben': gesamtabgaben,
-        'Anmeldeart': 'IMDC'
-    }
+    write_ergebnis_zeile(
+        puffer, process_suma_position(leit_row, suma_pos_col), pos_numeric, codenummer_numeric, menge_value,
+        zollwert, drittlandzollsatz, zoelle_total, eust, gesamtabgaben, 'IMDC'
+    )
 
-def find_zl_value(row: pd.Series, field_type: str):
-    """Findet Werte in der ZL-Datei mit verschiedenen Schreibweisen."""
-    field_mapping = {
-        'zollabgabe': ['Vorraussichtliche Zollabgabe', 'Voraussichtliche Zollabgabe'],
-        'zollsatz': ['Vorraussichtliche Zollsatzabgabe', 'Voraussichtliche Zollsatzabgabe'],
-        'dv1': ['DV1UmgerechnerterRechnungsbetrag', 'DV1 Umgerechneter Rechnungsbetrag']
-    }
-    
-    candidates = field_mapping.get(field_type, [])
-    for col in candidates:
-        if col in row and pd.notna(row[col]):
-            return safe_numeric(row[col])
-    return 0.0
+def get_zl_wert(row: pd.Series, spalte: str) -> float:
+    """Liest einen Betrag aus einer kanonischen ZL-Spalte (0.0 wenn leer oder nicht vorhanden)"""
+    wert = row.get(spalte)
+    if wert is None or pd.isna(wert):
+        return 0.0
+    return safe_numeric(wert)
 
 def calculate_wids_zollwert(row):
     """Berechnet den Zollwert für eine WIDS-Position"""
-    zollabgabe = find_zl_value(row, 'zollabgabe')
-    zollsatz = find_zl_value(row, 'zollsatz')
-    dv1_betrag = find_zl_value(row, 'dv1')
+    zollabgabe = get_zl_wert(row, ZL_ZOLLABGABE)
+    zollsatz = get_zl_wert(row, ZL_ZOLLSATZ)
+    dv1_betrag = get_zl_wert(row, ZL_DV1)
     
     if zollsatz == 0:
         return dv1_betrag
     else:
         return round(zollabgabe / (zollsatz / 100), 2) if zollsatz > 0 else 0
 
-def process_wids_row(import_row, common_data, leit_row, pos_field, suma_pos_col):
-    """Verarbeitet eine WIDS-Zeile"""
-    zollabgabe = find_zl_value(import_row, 'zollabgabe')
-    zollsatz = find_zl_value(import_row, 'zollsatz')
-    dv1_betrag = find_zl_value(import_row, 'dv1')
+def process_wids_row(puffer, import_row, leit_row, pos_field, suma_pos_col, params, pos_zusatz=''):
+    """Verarbeitet eine WIDS-Zeile (pos_zusatz z.B. ' (max von 3)' wird an die Position angehängt)"""
+    zollabgabe = get_zl_wert(import_row, ZL_ZOLLABGABE)
+    zollsatz = get_zl_wert(import_row, ZL_ZOLLSATZ)
+    dv1_betrag = get_zl_wert(import_row, ZL_DV1)
     
     if zollsatz == 0:
         zollwert = dv1_betrag
     else:
         zollwert = round(zollabgabe / (zollsatz / 100), 2) if zollsatz > 0 else 0
     
-    if st.session_state.get('zollsatz_null_ersetzen', True) and zollsatz == 0 and zollwert > 0:
-        zollsatz = st.session_state.get('zollsatz_ersatz', 0.12) * 100
+    if params['zollsatz_null_ersetzen'] and zollsatz == 0 and zollwert > 0:
+        zollsatz = params['zollsatz_ersatz'] * 100
         zollabgabe = round(zollwert * zollsatz / 100, 2)
     
-    eust = round((zollwert + zollabgabe) * st.session_state.get('eust_satz', 0.19), 2)
+    eust = round((zollwert + zollabgabe) * params['eust_satz'], 2)
     
-    pauschalbetrag = st.session_state.get('pauschalbetrag', 10000.0)
+    pauschalbetrag = params['pauschalbetrag']
     gesamtabgaben = zollabgabe if zollwert > 0 else pauschalbetrag
     
-    common_data['SUMA-Position'] = process_suma_position(leit_row, suma_pos_col)
-    
     pos_value = import_row.get(pos_field, '')
     pos_numeric = pd.to_numeric(pos_value, errors='ignore') if pos_value else ''
     codenummer = import_row.get('Warentarifnummer', '')
     codenummer_numeric = pd.to_numeric(codenummer, errors='ignore') if codenummer else ''
     
-    return {
-        **common_data,
-        'Pos': pos_numeric,
-        'Codenummer': codenummer_numeric,
-        'Menge': '',
-        'Zollwert (total)': zollwert,
-        'Drittlandzollsatz': zollsatz,
-        'Zölle (total)': zollabgabe,
-        'EUSt': eust,
-        'Gesamtabgaben': gesamtabgaben,
-        'Anmeldeart': 'WIDS'
-    }
+    if pos_zusatz:
+        pos_numeric = f"{pos_numeric}{pos_zusatz}"
+    
+    write_ergebnis_zeile(
+        puffer, process_suma_position(leit_row, suma_pos_col), pos_numeric, codenummer_numeric, '',
+        zollwert, zollsatz, zollabgabe, eust, gesamtabgaben, 'WIDS'
+    )
 
-def process_ipdc_row(common_data, leit_row, suma_pos_col):
+def process_ipdc_row(puffer, leit_row, suma_pos_col, params):
     """Verarbeitet eine IPDC-Zeile"""
     zollwert_folge = safe_numeric(leit_row.get('Zollwert Folgeverfahren', 0))
     zollbetrag_folge = safe_numeric(leit_row.get('Zollbetrag Folgeverfahren', 0))
@@ -1177,71 +1837,69 @@ def process_ipdc_row(common_data, leit_row, suma_pos_col):
     else:
         drittlandzollsatz = 0.0
     
-    if st.session_state.get('zollsatz_null_ersetzen', True) and drittlandzollsatz == 0 and zollwert_folge > 0:
-        drittlandzollsatz = st.session_state.get('zollsatz_ersatz', 0.12) * 100
+    if params['zollsatz_null_ersetzen'] and drittlandzollsatz == 0 and zollwert_folge > 0:
+        drittlandzollsatz = params['zollsatz_ersatz'] * 100
         zollbetrag_folge = round(zollwert_folge * drittlandzollsatz / 100, 2)
     
-    eust = round((zollwert_folge + zollbetrag_folge) * st.session_state.get('eust_satz', 0.19), 2)
+    eust = round((zollwert_folge + zollbetrag_folge) * params['eust_satz'], 2)
     
-    pauschalbetrag = st.session_state.get('pauschalbetrag', 10000.0)
+    pauschalbetrag = params['pauschalbetrag']
     gesamtabgaben = zollbetrag_folge if zollwert_folge > 0 else pauschalbetrag
     
     if suma_pos_col and suma_pos_col in leit_row:
         suma_value = leit_row[suma_pos_col]
-        common_data['SUMA-Position'] = pd.to_numeric(suma_value, errors='ignore') if pd.notna(suma_value) else ''
+        suma_position = pd.to_numeric(suma_value, errors='ignore') if pd.notna(suma_value) else ''
     else:
-        common_data['SUMA-Position'] = ''
+        suma_position = ''
     
-    common_data['Erledigung mit'] = common_data['Erledigung mit'] or str(leit_row.get('Weitere Registriernummer Folgeverfahren', ''))
+    erledigung = puffer['spalten']['Erledigung mit']
+    i = puffer['anzahl']
+    erledigung[i] = erledigung[i] or str(leit_row.get('Weitere Registriernummer Folgeverfahren', ''))
     
-    return {
-        **common_data,
-        'Pos': '',
-        'Codenummer': '',
-        'Menge': '',
-        'Zollwert (total)': zollwert_folge,
-        'Drittlandzollsatz': drittlandzollsatz,
-        'Zölle (total)': zollbetrag_folge,
-        'EUSt': eust,
-        'Gesamtabgaben': gesamtabgaben,
-        'Anmeldeart': 'IPDC'
-    }
+    write_ergebnis_zeile(
+        puffer, suma_position, '', '', '',
+        zollwert_folge, drittlandzollsatz, zollbetrag_folge, eust, gesamtabgaben, 'IPDC'
+    )
 
-def extract_sicherheitsbetrag(sicherheit_data) -> float:
-    """Extrahiert den Sicherheitsbetrag aus den NCTS-Sicherheitsdaten."""
-    try:
-        if isinstance(sicherheit_data, dict) and 'Sicherheitsleistungen' in sicherheit_data:
-            leistungen = str(sicherheit_data['Sicherheitsleistungen'])
-            match = re.search(r'Sicherheit:\s*([\d.,]+)', leistungen)
-            if match:
-                return float(match.group(1).replace(',', '.'))
-        elif isinstance(sicherheit_data, str):
-            match = re.search(r'Sicherheit:\s*([\d.,]+)', sicherheit_data)
-            if match:
-                return float(match.group(1).replace(',', '.'))
-    except Exception as e:
-        st.warning(f"⚠️ Fehler beim Extrahieren des Sicherheitsbetrags: {e}")
-    return 0.0
+SICHERHEIT_MUSTER = re.compile(r'Sicherheit:\s*([\d.,]+)')
 
-def process_ncdp_row(common_data, leit_row, ncts_row, suma_pos_col):
-    """Verarbeitet eine NCDP-Zeile"""
-    sicherheitsbetrag = safe_numeric(extract_sicherheitsbetrag(ncts_row.get('Sicherheit', {})))
-    
-    common_data['SUMA-Position'] = process_suma_position(leit_row, suma_pos_col)
+def extract_sicherheitsbetraege(df_ncts) -> np.ndarray:
+    """Extrahiert die Sicherheitsbeträge der gesamten NCTS-Datei in einem Schritt (0.0 ohne Betrag)"""
+    if 'Sicherheit' not in df_ncts.columns:
+        return np.zeros(len(df_ncts))
+    
+    # Sicherheitsdaten als dict (Sicherheitsleistungen) oder als Text, alles andere ohne Betrag
+    texte = df_ncts['Sicherheit'].map(
+        lambda wert: str(wert['Sicherheitsleistungen'])
+        if isinstance(wert, dict) and 'Sicherheitsleistungen' in wert
+        else (wert if isinstance(wert, str) else None)
+    )
+    gefunden = texte.str.extract(SICHERHEIT_MUSTER, expand=False)
+    betraege = pd.to_numeric(gefunden.str.replace(',', '.', regex=False), errors='coerce')
     
+    ungueltig = int((gefunden.notna() & betraege.isna()).sum())
+    if ungueltig:
+        melde_warnung(f"⚠️ Fehler beim Extrahieren des Sicherheitsbetrags: {ungueltig} NCTS-Zeilen ohne gültigen Betrag")
+    return betraege.fillna(0.0).to_numpy(dtype='float64')
+
+def build_ncts_index(df_ncts, mrn_col):
+    """NCTS-Datei je bereinigter MRN: Position der ersten Zeile und Anzahl Zeilen"""
+    if df_ncts.empty or not mrn_col:
+        return {}
     return {
-        **common_data,
-        'Pos': '',
-        'Codenummer': '',
-        'Menge': 0,
-        'Zollwert (total)': 0.0,
-        'Drittlandzollsatz': 0.0,
-        'Zölle (total)': 0.0,
-        'EUSt': 0.0,
-        'Gesamtabgaben': round(sicherheitsbetrag, 2),
-        'Anmeldeart': 'NCDP'
+        mrn: (int(positionen[0]), len(positionen))
+        for mrn, positionen in df_ncts.groupby(mrn_col, sort=False).indices.items()
     }
 
+def process_ncdp_row(puffer, leit_row, sicherheitsbetrag, suma_pos_col):
+    """Verarbeitet eine NCDP-Zeile"""
+    sicherheitsbetrag = float(sicherheitsbetrag)
+    
+    write_ergebnis_zeile(
+        puffer, process_suma_position(leit_row, suma_pos_col), '', '', 0,
+        0.0, 0.0, 0.0, 0.0, round(sicherheitsbetrag, 2), 'NCDP'
+    )
+
 # === BE-ANTEIL VERARBEITUNG ===
 
 def process_eza_be_anteil(df_import_eza):
@@ -1291,47 +1949,204 @@ def process_eza_be_anteil(df_import_eza):
     
     return pd.DataFrame(processed_rows)
 
-# === GENERISCHE ANMELDEARTEN-VERARBEITUNG ===
+def prepare_eza_import(df_import, auto_reduce=True):
+    """EZA-Aufbereitung: 13 Kernspalten, Duplikate (MRN, Position) entfernen, BE-Anteil aufteilen"""
+    original_row_count = len(df_import)
+    
+    if auto_reduce and len(df_import.columns) > len(EXAKTE_EZA_SPALTEN):
+        found_columns = [col for col in EXAKTE_EZA_SPALTEN if col in df_import.columns]
+        if len(found_columns) >= 5:
+            df_import = df_import[found_columns].copy()
+    
+    if len(df_import.columns) >= 6:
+        col_E = df_import.columns[4]
+        col_F = df_import.columns[5]
+        df_import = df_import.drop_duplicates(subset=[col_E, col_F], keep='first')
+        removed_count = original_row_count - len(df_import)
+    else:
+        removed_count = 0
+    
+    unique_count = len(df_import)
+    
+    df_import = process_eza_be_anteil(df_import)
+    
+    df_import.attrs['removed_duplicates'] = removed_count
+    df_import.attrs['be_multiplied'] = len(df_import) - unique_count
+    return df_import
+
+# === GENERISCHE ANMELDEARTEN-VERARBEITUNG (MATCHING) ===
+
+def create_match_record(anmeldeart, leit_pos, methode, erledigung_mit='', import_pos=None, anzahl_treffer=0):
+    """Ein Eintrag der Match-Tabelle: welche Importzeile(n) zu welcher Leitdatei-Zeile gehören"""
+    return {
+        'anmeldeart': anmeldeart,
+        'leit_pos': leit_pos,
+        'methode': methode,
+        'erledigung_mit': erledigung_mit,
+        'import_pos': import_pos or [],
+        'anzahl_treffer': anzahl_treffer
+    }
+
+def build_import_gruppen(import_df, match_col):
+    """Je MRN einer Importquelle: Inhalts-Hash der zugehörigen Zeilen und deren Positionen"""
+    if import_df.empty or not match_col:
+        return {}
+    
+    gruppierung = import_df.groupby(match_col, sort=False)
+    zeilen_hash = pd.util.hash_pandas_object(import_df, index=False).to_numpy()
+    rang = gruppierung.cumcount().to_numpy().astype('uint64')
+    
+    # Reihenfolge innerhalb der MRN fließt ein, da Matches über die erste Trefferzeile gewählt werden
+    gemischt = zeilen_hash ^ (rang * np.uint64(0x9E3779B97F4A7C15))
+    gruppen_hash = pd.Series(gemischt).groupby(import_df[match_col].to_numpy(), sort=False).sum()
+    positionen = gruppierung.indices
+    
+    return {mrn: (int(gruppen_hash[mrn]), positionen[mrn]) for mrn in positionen}
+
+def build_match_schema(data_sources, field_mappings):
+    """Hash über Spaltenzuordnung und Spalten der Importquellen"""
+    schema = [repr(sorted(field_mappings.items()))]
+    for source in ['df_import_eza', 'df_import_zl', 'df_ncts']:
+        schema.append(repr(list(data_sources[source].columns)))
+    return hashlib.sha1('|'.join(schema).encode('utf-8')).hexdigest()
+
+def create_match_speicher(eintraege, data_sources, field_mappings, params):
+    """Arbeitsstand der persistenten Match-Tabelle für einen Verarbeitungslauf"""
+    return {
+        'eintraege': eintraege,
+        'gruppen': {},
+        'schema': build_match_schema(data_sources, field_mappings),
+        'wids_aggregation': params['wids_aggregation'],
+        'neue_eintraege': {},
+        'verwendete_keys': set(),
+        'wiederverwendet': 0,
+        'neu_berechnet': 0
+    }
+
+def build_match_key(anmeldeart, leit_row, field_mappings):
+    """Fachlicher Schlüssel einer Leitdatei-Zeile für die Match-Tabelle"""
+    pos_suma = str(leit_row.get(field_mappings['suma_pos_col'], '')) if field_mappings['suma_pos_col'] else ''
+    return '|'.join([
+        anmeldeart,
+        str(leit_row[field_mappings['leit_col_weitere']]),
+        str(leit_row[field_mappings['leit_col_reg']]),
+        str(leit_row.get('Registriernummer/MRN SumA', '')),
+        pos_suma
+    ])
+
+def build_match_signatur(anmeldeart, leit_key, leit_row, data_sources, field_mappings, match_speicher):
+    """Signatur aus Schlüssel und Inhalt aller Importzeilen, die für die Zeile in Frage kommen"""
+    config = ANMELDEART_CONFIG[anmeldeart]
+    source = config['import_source']
+    
+    if source not in match_speicher['gruppen']:
+        match_speicher['gruppen'][source] = build_import_gruppen(
+            data_sources[source], field_mappings[config['match_field']]
+        )
+    gruppen = match_speicher['gruppen'][source]
+    
+    teile = [leit_key, match_speicher['schema']]
+    for mrn in (leit_row[field_mappings['leit_col_weitere']], leit_row[field_mappings['leit_col_reg']]):
+        teile.append(str(gruppen[mrn][0]) if mrn in gruppen else '-')
+    if anmeldeart == 'WIDS':
+        teile.append(match_speicher['wids_aggregation'])
+    
+    return hashlib.sha1('|'.join(teile).encode('utf-8')).hexdigest(), gruppen
 
-def process_anmeldeart_generic(anmeldeart, df_leit, data_sources, field_mappings, stats):
-    """Generische Verarbeitung für alle Anmeldearten"""
+def process_anmeldeart_row_persistent(anmeldeart, uid, leit_pos, leit_row, data_sources, field_mappings, stats, params, match_speicher):
+    """Übernimmt das Match aus der gespeicherten Tabelle, wenn Schlüssel und Importdaten unverändert sind"""
+    leit_key = build_match_key(anmeldeart, leit_row, field_mappings)
+    signatur, gruppen = build_match_signatur(anmeldeart, leit_key, leit_row, data_sources, field_mappings, match_speicher)
+    match_speicher['verwendete_keys'].add(leit_key)
+    
+    eintrag = match_speicher['eintraege'].get(leit_key)
+    if eintrag and eintrag['signatur'] == signatur:
+        mrn = eintrag['erledigung_mit']
+        if not eintrag['import_raenge'] or mrn in gruppen:
+            import_pos = [int(gruppen[mrn][1][rang]) for rang in eintrag['import_raenge']]
+            for key, value in eintrag['stats'].items():
+                stats[key] += value
+            match_speicher['wiederverwendet'] += 1
+            return create_match_record(
+                anmeldeart, leit_pos, eintrag['methode'], mrn, import_pos, eintrag['anzahl_treffer']
+            )
+    
+    zeilen_stats = defaultdict(int)
+    record = process_anmeldeart_row(
+        anmeldeart, uid, leit_pos, leit_row, data_sources, field_mappings, zeilen_stats, params
+    )
+    for key, value in zeilen_stats.items():
+        stats[key] += value
+    
+    mrn = record['erledigung_mit']
+    import_raenge = [int(np.searchsorted(gruppen[mrn][1], pos)) for pos in record['import_pos']] if record['import_pos'] else []
+    eintrag = {
+        'signatur': signatur,
+        'anmeldeart': anmeldeart,
+        'methode': record['methode'],
+        'erledigung_mit': mrn,
+        'import_raenge': import_raenge,
+        'anzahl_treffer': int(record['anzahl_treffer']),
+        'stats': dict(zeilen_stats)
+    }
+    match_speicher['eintraege'][leit_key] = eintrag
+    match_speicher['neue_eintraege'][leit_key] = eintrag
+    match_speicher['neu_berechnet'] += 1
+    
+    return record
+
+def merge_zeilen_stats(stats, zeilen_stats, leit_pos, zeilen):
+    """Übernimmt die Statistik einer Zeile in die Gesamtstatistik und merkt sie pro Zeile vor"""
+    for key, value in zeilen.items():
+        stats[key] += value
+    zeilen_stats[leit_pos] = dict(zeilen)
+
+def process_anmeldeart_generic(anmeldeart, df_leit, partition, data_sources, field_mappings, stats, params, match_speicher=None, zeilen_stats=None, zeilen_callback=None):
+    """Generisches Matching für alle Anmeldearten - liefert Match-Records statt Ergebniszeilen"""
     config = ANMELDEART_CONFIG.get(anmeldeart, {})
-    results = []
+    records = []
     
-    anmeldeart_data = df_leit[df_leit[field_mappings['anmeldeart_col']] == anmeldeart]
+    positionen = get_partition_positionen(partition, anmeldeart)
+    atb = partition['atb'][positionen]
     
-    for idx, leit_row in anmeldeart_data.iterrows():
-        if has_atb_in_weitere_folge(leit_row, field_mappings):
-            stats['atb_skipped'] = stats.get('atb_skipped', 0) + 1
-            continue
+    # ATB-Zeilen werden vorab ausgeschlossen, gematcht wird nur der Rest
+    if atb.any():
+        stats['atb_skipped'] += int(atb.sum())
+        if zeilen_stats is not None:
+            zeilen_stats.update({leit_pos: {'atb_skipped': 1} for leit_pos in df_leit.index[positionen[atb]]})
+    
+    for nummer, (leit_pos, leit_row) in enumerate(df_leit.iloc[positionen[~atb]].iterrows()):
+        if zeilen_callback and nummer % ZEILEN_PRO_FORTSCHRITT == 0:
+            zeilen_callback(nummer)
         
+        zeilen = defaultdict(int) if zeilen_stats is not None else stats
         uid = leit_row[field_mappings[f'leit_col_{config["unique_field"]}']]
         
-        dates_info = calculate_warehouse_dates(
-            leit_row[field_mappings['gestell_col']], 
-            leit_row['Datum Ende - CUSFIN'],
-            st.session_state.get('verwahrungsfrist_tage', 90)
-        )
-        
-        common_data = create_common_data(leit_row, field_mappings['gestell_col'], dates_info)
+        if match_speicher is not None and 'import_source' in config:
+            records.append(process_anmeldeart_row_persistent(
+                anmeldeart, uid, leit_pos, leit_row, data_sources, field_mappings, zeilen, params, match_speicher
+            ))
+        else:
+            records.append(process_anmeldeart_row(
+                anmeldeart, uid, leit_pos, leit_row, data_sources, field_mappings, zeilen, params
+            ))
         
-        results.extend(process_anmeldeart_row(
-            anmeldeart, uid, leit_row, common_data, data_sources, field_mappings, stats
-        ))
+        zeilen[f'processed_{anmeldeart.lower()}'] += 1
         
-        stats[f'processed_{anmeldeart.lower()}'] += 1
+        if zeilen_stats is not None:
+            merge_zeilen_stats(stats, zeilen_stats, leit_pos, zeilen)
     
-    return results
+    return records
 
-def process_anmeldeart_row(anmeldeart, uid, leit_row, common_data, data_sources, field_mappings, stats):
-    """Verarbeitet eine einzelne Zeile basierend auf der Anmeldeart"""
+def process_anmeldeart_row(anmeldeart, uid, leit_pos, leit_row, data_sources, field_mappings, stats, params):
+    """Matcht eine einzelne Zeile basierend auf der Anmeldeart"""
     if anmeldeart == 'IMDC':
         return process_imdc_generic(
-            uid, leit_row, common_data, data_sources, field_mappings, stats
+            uid, leit_pos, leit_row, data_sources, field_mappings, stats
         )
     elif anmeldeart == 'WIDS':
         return process_wids_generic(
-            uid, leit_row, common_data, data_sources, field_mappings, stats
+            uid, leit_pos, leit_row, data_sources, field_mappings, stats, params
         )
     elif anmeldeart == 'IPDC':
         zollwert = pd.to_numeric(leit_row.get('Zollwert Folgeverfahren', 0), errors='coerce')
@@ -1339,18 +2154,16 @@ def process_anmeldeart_row(anmeldeart, uid, leit_row, common_data, data_sources,
             stats['ipdc_with_zollwert'] += 1
         else:
             stats['ipdc_without_zollwert'] += 1
-        return [process_ipdc_row(common_data, leit_row, field_mappings['suma_pos_col'])]
+        return create_match_record('IPDC', leit_pos, 'ohne_import')
     elif anmeldeart == 'NCDP':
         return process_ncdp_generic(
-            uid, leit_row, common_data, data_sources, field_mappings, stats
+            uid, leit_pos, leit_row, data_sources, field_mappings, stats
         )
     else:
-        return []
+        return None
 
-def process_imdc_generic(uid, leit_row, common_data, data_sources, field_mappings, stats):
-    """IMDC-spezifische Verarbeitung mit verbessertem 3-Kriterien-Matching"""
-    results = []
-    
+def process_imdc_generic(uid, leit_pos, leit_row, data_sources, field_mappings, stats):
+    """IMDC-spezifisches Matching mit verbessertem 3-Kriterien-Matching"""
     mrn_suma = leit_row.get('Registriernummer/MRN SumA', '')
     pos_suma = str(leit_row.get(field_mappings['suma_pos_col'], '')) if field_mappings['suma_pos_col'] else ''
     
@@ -1380,19 +2193,15 @@ def process_imdc_generic(uid, leit_row, common_data, data_sources, field_mapping
             used_mrn = mrn_reg
         
         if not precise_matches.empty:
-            common_data['Erledigung mit'] = used_mrn
             stats['imdc_match'] += 1
             stats['imdc_3criteria_match'] += 1
             if pd.notna(precise_matches.iloc[0].get('ATBnummer', '')):
                 stats['imdc_be_anteil_rows'] += 1
             
-            import_row = precise_matches.iloc[0]
-            results.append(process_imdc_row(
-                import_row, common_data, leit_row, 
-                field_mappings['pos_field_eza'], 
-                field_mappings['suma_pos_col']
-            ))
-            return results
+            return create_match_record(
+                'IMDC', leit_pos, '3kriterien', used_mrn,
+                [precise_matches.index[0]], len(precise_matches)
+            )
     
     fallback_id = leit_row[field_mappings['leit_col_reg']]
     fallback_matches, used_id = find_import_matches(
@@ -1400,7 +2209,6 @@ def process_imdc_generic(uid, leit_row, common_data, data_sources, field_mapping
     )
     
     if not fallback_matches.empty:
-        common_data['Erledigung mit'] = used_id
         stats['imdc_match'] += 1
         stats['imdc_fallback_match'] += 1
         
@@ -1410,20 +2218,16 @@ def process_imdc_generic(uid, leit_row, common_data, data_sources, field_mapping
         if has_be_anteil and pd.notna(import_row.get('ATBnummer', '')):
             stats['imdc_be_anteil_rows'] += 1
         
-        results.append(process_imdc_row(
-            import_row, common_data, leit_row, 
-            field_mappings['pos_field_eza'], 
-            field_mappings['suma_pos_col']
-        ))
-    else:
-        stats['imdc_no_match'] += 1
-        results.append(create_no_match_row(common_data, leit_row, 'IMDC', field_mappings['suma_pos_col']))
+        return create_match_record(
+            'IMDC', leit_pos, 'fallback', used_id,
+            [sorted_matches.index[0]], len(fallback_matches)
+        )
     
-    return results
+    stats['imdc_no_match'] += 1
+    return create_match_record('IMDC', leit_pos, 'kein_match')
 
-def process_wids_generic(uid, leit_row, common_data, data_sources, field_mappings, stats):
-    """WIDS-spezifische Verarbeitung mit konfigurierbarer Aggregation"""
-    results = []
+def process_wids_generic(uid, leit_pos, leit_row, data_sources, field_mappings, stats, params):
+    """WIDS-spezifisches Matching mit konfigurierbarer Aggregation"""
     fallback_id = leit_row[field_mappings['leit_col_reg']]
     
     import_matches, used_id = find_import_matches(
@@ -1432,266 +2236,1101 @@ def process_wids_generic(uid, leit_row, common_data, data_sources, field_mapping
         field_mappings['import_zl_col']
     )
     
-    common_data['Erledigung mit'] = used_id
-    
     if import_matches.empty:
         stats['wids_no_match'] += 1
-        results.append(create_no_match_row(common_data, leit_row, 'WIDS', field_mappings['suma_pos_col']))
-    else:
-        stats['wids_match'] += 1
-        
-        agg_mode = st.session_state.get('wids_aggregation', 'Position mit höchstem Zollwert')
-        
-        if len(import_matches) == 1:
-            results.append(process_wids_row(
-                import_matches.iloc[0], common_data, leit_row,
-                field_mappings['pos_field_zl'],
-                field_mappings['suma_pos_col']
-            ))
-        else:
-            if agg_mode == "Nur Position 1":
-                sorted_matches = import_matches.sort_values(by=field_mappings['pos_field_zl'])
-                selected_row = sorted_matches.iloc[0]
-                row_data = process_wids_row(
-                    selected_row, common_data, leit_row,
-                    field_mappings['pos_field_zl'],
-                    field_mappings['suma_pos_col']
-                )
-                pos_value = row_data['Pos']
-                row_data['Pos'] = f"{pos_value} (1 von {len(import_matches)})"
-                
-            elif agg_mode == "Position mit höchstem Zollwert":
-                import_matches['_calculated_zollwert'] = import_matches.apply(
-                    lambda row: calculate_wids_zollwert(row), axis=1
-                )
-                selected_row = import_matches.loc[import_matches['_calculated_zollwert'].idxmax()]
-                row_data = process_wids_row(
-                    selected_row, common_data, leit_row,
-                    field_mappings['pos_field_zl'],
-                    field_mappings['suma_pos_col']
-                )
-                pos_value = row_data['Pos']
-                row_data['Pos'] = f"{pos_value} (max von {len(import_matches)})"
-                
-            else:
-                total_zollabgabe = 0
-                total_zollwert = 0
-                max_zollsatz = 0
-                
-                for _, import_row in import_matches.iterrows():
-                    zollabgabe = find_zl_value(import_row, 'zollabgabe')
-                    zollsatz = find_zl_value(import_row, 'zollsatz')
-                    dv1_betrag = find_zl_value(import_row, 'dv1')
-                    
-                    if zollsatz == 0:
-                        zollwert = dv1_betrag
-                    else:
-                        zollwert = round(zollabgabe / (zollsatz / 100), 2) if zollsatz > 0 else 0
-                    
-                    total_zollabgabe += zollabgabe
-                    total_zollwert += zollwert
-                    max_zollsatz = max(max_zollsatz, zollsatz)
-                
-                avg_zollsatz = round(total_zollabgabe / total_zollwert * 100, 2) if total_zollwert > 0 else 0
-                
-                if st.session_state.get('zollsatz_null_ersetzen', True) and avg_zollsatz == 0 and total_zollwert > 0:
-                    avg_zollsatz = st.session_state.get('zollsatz_ersatz', 0.12) * 100
-                    total_zollabgabe = round(total_zollwert * avg_zollsatz / 100, 2)
-                
-                eust = round((total_zollwert + total_zollabgabe) * st.session_state.get('eust_satz', 0.19), 2)
-                
-                if field_mappings['suma_pos_col'] and field_mappings['suma_pos_col'] in leit_row:
-                    suma_value = leit_row[field_mappings['suma_pos_col']]
-                    common_data['SUMA-Position'] = pd.to_numeric(suma_value, errors='ignore') if pd.notna(suma_value) else ''
-                
-                pauschalbetrag = st.session_state.get('pauschalbetrag', 10000.0)
-                
-                row_data = common_data.copy()
-                row_data.update({
-                    'Pos': f'SUMME ({len(import_matches)} Pos.)',
-                    'Codenummer': '',
-                    'Menge': '',
-                    'Zollwert (total)': total_zollwert,
-                    'Drittlandzollsatz': avg_zollsatz,
-                    'Zölle (total)': total_zollabgabe,
-                    'EUSt': eust,
-                    'Gesamtabgaben': total_zollabgabe if total_zollwert > 0 else pauschalbetrag,
-                    'Anmeldeart': 'WIDS'
-                })
-            
-            results.append(row_data)
+        return create_match_record('WIDS', leit_pos, 'kein_match', used_id)
+    
+    stats['wids_match'] += 1
+    
+    agg_mode = params['wids_aggregation']
+    anzahl = len(import_matches)
+    
+    if anzahl == 1:
+        return create_match_record('WIDS', leit_pos, 'einzel', used_id, [import_matches.index[0]], 1)
+    
+    if agg_mode == "Nur Position 1":
+        sorted_matches = import_matches.sort_values(by=field_mappings['pos_field_zl'])
+        return create_match_record('WIDS', leit_pos, 'position_1', used_id, [sorted_matches.index[0]], anzahl)
+    
+    if agg_mode == "Position mit höchstem Zollwert":
+        calculated_zollwert = import_matches.apply(
+            lambda row: calculate_wids_zollwert(row), axis=1
+        )
+        return create_match_record('WIDS', leit_pos, 'max_zollwert', used_id, [calculated_zollwert.idxmax()], anzahl)
     
-    return results
+    return create_match_record('WIDS', leit_pos, 'summe', used_id, list(import_matches.index), anzahl)
 
-def process_ncdp_generic(uid, leit_row, common_data, data_sources, field_mappings, stats):
-    """NCDP-spezifische Verarbeitung"""
-    results = []
+def process_ncdp_generic(uid, leit_pos, leit_row, data_sources, field_mappings, stats):
+    """NCDP-spezifisches Matching über den MRN-Index der NCTS-Datei"""
     fallback_id = leit_row[field_mappings['leit_col_weitere']]
+    ncts_index = data_sources['ncts_index']
     
-    ncts_matches, used_id = find_import_matches(
-        uid, fallback_id,
-        data_sources['df_ncts'],
-        field_mappings['ncts_mrn_col']
+    used_id = uid
+    treffer = ncts_index.get(uid)
+    if treffer is None and fallback_id != uid:
+        used_id = fallback_id
+        treffer = ncts_index.get(fallback_id)
+    
+    if treffer is None:
+        stats['ncdp_no_match'] += 1
+        return create_match_record('NCDP', leit_pos, 'kein_match', used_id)
+    
+    stats['ncdp_match'] += 1
+    erste_pos, anzahl = treffer
+    return create_match_record('NCDP', leit_pos, 'match', used_id, [erste_pos], anzahl)
+
+def process_pauschale_anmeldearten(df_leit, partition, field_mappings, stats, anmeldeart_namen=PAUSCHALE_ARTEN, zeilen_stats=None):
+    """Erfasst pauschale Anmeldearten (leer, APDC, AVDC, NCAR) spaltenweise in einem Durchlauf für die Match-Tabelle"""
+    records = []
+    
+    for anmeldeart_name in anmeldeart_namen:
+        positionen = get_partition_positionen(partition, anmeldeart_name)
+        atb = partition['atb'][positionen]
+        stat_key = f'{anmeldeart_name.lower()}_processed'
+        anzahl_atb = int(atb.sum())
+        anzahl_pauschale = len(positionen) - anzahl_atb
+        
+        if anzahl_atb:
+            stats['atb_skipped'] += anzahl_atb
+        if anzahl_pauschale:
+            stats[stat_key] += anzahl_pauschale
+        if zeilen_stats is not None:
+            for leit_pos, ist_atb in zip(df_leit.index[positionen], atb):
+                zeilen_stats[leit_pos] = {'atb_skipped': 1} if ist_atb else {stat_key: 1}
+        
+        records.extend(
+            create_match_record(anmeldeart_name, leit_pos, 'pauschale')
+            for leit_pos in df_leit.index[positionen[~atb]]
+        )
+    
+    return records
+
+def create_match_table(df_leit, partition, data_sources, field_mappings, leit_stats, params, progress_callback=None, step_callback=None, match_speicher=None, zeilen_stats=None, profiler=None):
+    """Stufe MATCH: ordnet jeder Leitdatei-Zeile ihre Importzeile(n) zu (unabhängig von Preis-Parametern)"""
+    stats = defaultdict(int)
+    match_table = []
+    
+    # Fortschritt nach verarbeiteten Leitdatei-Zeilen (S-Anmeldearten werden nicht verarbeitet)
+    art_zeilen = {art: len(get_partition_positionen(partition, art)) for art in VERARBEITBARE_ARTEN + PAUSCHALE_ARTEN}
+    matching_arten = get_matching_arten(partition, data_sources, leit_stats)
+    zeilen_gesamt = sum(art_zeilen.values())
+    zeilen_fertig = 0
+    
+    def melde_zeilen(anmeldeart, count):
+        if not progress_callback:
+            return None
+        return lambda erledigt: progress_callback(
+            zeilen_fertig + erledigt, zeilen_gesamt, "Verarbeite", f"{anmeldeart}-Anmeldearten ({erledigt}/{count} Zeilen)"
+        )
+    
+    for anmeldeart in VERARBEITBARE_ARTEN:
+        count = art_zeilen[anmeldeart]
+        
+        if count > 0:
+            if progress_callback:
+                progress_callback(zeilen_fertig, zeilen_gesamt, "Verarbeite", f"{anmeldeart}-Anmeldearten ({count} Zeilen)")
+            
+            if anmeldeart not in matching_arten:
+                continue
+            
+            with profil_span(profiler, f'Matching › {anmeldeart}', count):
+                match_table.extend(process_anmeldeart_generic(
+                    anmeldeart, df_leit, partition, data_sources, field_mappings, stats, params, match_speicher, zeilen_stats,
+                    melde_zeilen(anmeldeart, count)
+                ))
+            zeilen_fertig += count
+            if step_callback:
+                step_callback(f"✅ {anmeldeart}-Anmeldearten verarbeitet ({count} Zeilen)")
+        elif progress_callback:
+            progress_callback(zeilen_fertig, zeilen_gesamt, "", f"Keine {anmeldeart}-Anmeldearten vorhanden")
+    
+    # Pauschale Anmeldearten in einem gemeinsamen Durchlauf
+    pauschale_arten = [art for art in PAUSCHALE_ARTEN if art in matching_arten]
+    if pauschale_arten:
+        count = sum(leit_stats[art] for art in pauschale_arten)
+        if progress_callback:
+            progress_callback(zeilen_fertig, zeilen_gesamt, "Verarbeite", f"Pauschale Anmeldearten ({count} Zeilen)")
+        with profil_span(profiler, 'Matching › Pauschale', count):
+            match_table.extend(process_pauschale_anmeldearten(
+                df_leit, partition, field_mappings, stats, pauschale_arten, zeilen_stats
+            ))
+        zeilen_fertig += sum(art_zeilen[art] for art in pauschale_arten)
+    
+    for anmeldeart_name in PAUSCHALE_ARTEN:
+        if anmeldeart_name in pauschale_arten:
+            if step_callback:
+                step_callback(f"✅ {anmeldeart_name}-Anmeldearten verarbeitet ({leit_stats[anmeldeart_name]} Zeilen)")
+        elif progress_callback:
+            progress_callback(zeilen_fertig, zeilen_gesamt, "", f"Keine {anmeldeart_name}-Anmeldearten vorhanden")
+    
+    if progress_callback:
+        progress_callback(zeilen_gesamt, zeilen_gesamt, "Matching abgeschlossen", f"({zeilen_gesamt} Zeilen)")
+    
+    return match_table, dict(stats)
+
+def run_match_stage(df_leit, data_sources, field_mappings, leit_stats, params, mandant_key, progress_callback=None, step_callback=None, zeilen_stats=None, profiler=None, partition=None):
+    """Stufe MATCH mit persistenter Match-Tabelle je Mandant: nur neue oder geänderte Zeilen werden gematcht"""
+    if partition is None:
+        partition = data_sources['leit_partition']
+    
+    match_speicher = None
+    if mandant_key:
+        try:
+            match_speicher = create_match_speicher(load_match_table(mandant_key), data_sources, field_mappings, params)
+        except sqlite3.Error as e:
+            melde_warnung(f"⚠️ Gespeicherte Match-Tabelle nicht lesbar, es wird vollständig gematcht: {e}")
+    
+    match_table, stats = create_match_table(
+        df_leit, partition, data_sources, field_mappings, leit_stats, params,
+        progress_callback=progress_callback, step_callback=step_callback,
+        match_speicher=match_speicher, zeilen_stats=zeilen_stats, profiler=profiler
     )
     
-    common_data['Erledigung mit'] = used_id
+    if match_speicher is not None:
+        try:
+            save_match_table(mandant_key, match_speicher['neue_eintraege'], match_speicher['verwendete_keys'])
+        except sqlite3.Error as e:
+            melde_warnung(f"⚠️ Match-Tabelle konnte nicht gespeichert werden: {e}")
+        
+        if step_callback:
+            step_callback(
+                f"✅ Match-Tabelle: {match_speicher['wiederverwendet']} Zeilen übernommen, "
+                f"{match_speicher['neu_berechnet']} neu gematcht"
+            )
     
-    if ncts_matches.empty:
-        stats['ncdp_no_match'] += 1
-        results.append(create_no_match_row(common_data, leit_row, 'NCDP', field_mappings['suma_pos_col']))
-    else:
-        stats['ncdp_match'] += 1
-        ncts_row = ncts_matches.iloc[0]
-        results.append(process_ncdp_row(common_data, leit_row, ncts_row, field_mappings['suma_pos_col']))
+    return match_table, stats
+
+# === PREISBERECHNUNG AUF DER MATCH-TABELLE ===
+
+def write_pauschale_row(puffer, pos_data, field_mappings, dates_info, anmeldeart_name, params):
+    """Ergebniszeile für pauschale Anmeldearten (leer, APDC, AVDC, NCAR)"""
+    pos_value = ''
+    if field_mappings['suma_pos_col'] and field_mappings['suma_pos_col'] in pos_data:
+        pos_raw = pos_data[field_mappings['suma_pos_col']]
+        pos_value = pd.to_numeric(pos_raw, errors='ignore') if pd.notna(pos_raw) else ''
+    
+    write_common_data(puffer, pos_data, field_mappings['gestell_col'], dates_info)
+    write_ergebnis_zeile(
+        puffer, pos_value, pos_value if pos_value else 'Pauschale', '', 0,
+        0.0, 0.0, 0.0, 0.0, params['pauschalbetrag'], anmeldeart_name
+    )
+
+def price_wids_match(record, puffer, leit_row, data_sources, field_mappings, params):
+    """Berechnet die WIDS-Ergebniszeile aus den gematchten ZL-Positionen"""
+    import_df = data_sources['df_import_zl']
+    
+    if record['methode'] != 'summe':
+        pos_zusatz = ''
+        if record['methode'] == 'position_1':
+            pos_zusatz = f" (1 von {record['anzahl_treffer']})"
+        elif record['methode'] == 'max_zollwert':
+            pos_zusatz = f" (max von {record['anzahl_treffer']})"
+        process_wids_row(
+            puffer, import_df.iloc[record['import_pos'][0]], leit_row,
+            field_mappings['pos_field_zl'],
+            field_mappings['suma_pos_col'],
+            params, pos_zusatz
+        )
+        return
+    
+    total_zollabgabe = 0
+    total_zollwert = 0
+    max_zollsatz = 0
+    
+    for _, import_row in import_df.iloc[record['import_pos']].iterrows():
+        zollabgabe = get_zl_wert(import_row, ZL_ZOLLABGABE)
+        zollsatz = get_zl_wert(import_row, ZL_ZOLLSATZ)
+        dv1_betrag = get_zl_wert(import_row, ZL_DV1)
+        
+        if zollsatz == 0:
+            zollwert = dv1_betrag
+        else:
+            zollwert = round(zollabgabe / (zollsatz / 100), 2) if zollsatz > 0 else 0
+        
+        total_zollabgabe += zollabgabe
+        total_zollwert += zollwert
+        max_zollsatz = max(max_zollsatz, zollsatz)
+    
+    avg_zollsatz = round(total_zollabgabe / total_zollwert * 100, 2) if total_zollwert > 0 else 0
+    
+    if params['zollsatz_null_ersetzen'] and avg_zollsatz == 0 and total_zollwert > 0:
+        avg_zollsatz = params['zollsatz_ersatz'] * 100
+        total_zollabgabe = round(total_zollwert * avg_zollsatz / 100, 2)
     
-    return results
+    eust = round((total_zollwert + total_zollabgabe) * params['eust_satz'], 2)
+    
+    suma_position = ''
+    if field_mappings['suma_pos_col'] and field_mappings['suma_pos_col'] in leit_row:
+        suma_value = leit_row[field_mappings['suma_pos_col']]
+        suma_position = pd.to_numeric(suma_value, errors='ignore') if pd.notna(suma_value) else ''
+    
+    write_ergebnis_zeile(
+        puffer, suma_position, f'SUMME ({record["anzahl_treffer"]} Pos.)', '', '',
+        total_zollwert, avg_zollsatz, total_zollabgabe, eust,
+        total_zollabgabe if total_zollwert > 0 else params['pauschalbetrag'], 'WIDS'
+    )
 
-def process_pauschale_anmeldeart(df_leit, field_mappings, stats, anmeldeart_filter=None, anmeldeart_name='(leer)'):
-    """Verarbeitet pauschale Anmeldearten (leer, APDC, AVDC, NCAR)"""
-    results = []
+def price_match_record(record, leit_row, data_sources, field_mappings, params, dates_info, puffer):
+    """Schreibt die Ergebniszeile für einen Match-Record mit den aktuellen Preis-Parametern in den Puffer"""
+    anmeldeart = record['anmeldeart']
+    suma_pos_col = field_mappings['suma_pos_col']
+    
+    if record['methode'] == 'pauschale':
+        write_pauschale_row(puffer, leit_row, field_mappings, dates_info, anmeldeart, params)
+        return
     
-    if anmeldeart_filter is None:
-        anmeldeart_data = df_leit[df_leit[field_mappings['anmeldeart_col']].isna() | (df_leit[field_mappings['anmeldeart_col']] == '')]
+    # Unbekannte Anmeldearten schließen die Zeile nicht ab - die nächste Zeile überschreibt sie
+    write_common_data(puffer, leit_row, field_mappings['gestell_col'], dates_info, record['erledigung_mit'])
+    
+    if record['methode'] == 'kein_match':
+        write_no_match_row(puffer, leit_row, anmeldeart, suma_pos_col, params)
+    elif anmeldeart == 'IMDC':
+        process_imdc_row(
+            puffer, data_sources['df_import_eza'].iloc[record['import_pos'][0]], leit_row,
+            field_mappings['pos_field_eza'], suma_pos_col, params
+        )
+    elif anmeldeart == 'WIDS':
+        price_wids_match(record, puffer, leit_row, data_sources, field_mappings, params)
+    elif anmeldeart == 'IPDC':
+        process_ipdc_row(puffer, leit_row, suma_pos_col, params)
+    elif anmeldeart == 'NCDP':
+        process_ncdp_row(puffer, leit_row, data_sources['ncts_sicherheit'][record['import_pos'][0]], suma_pos_col)
+
+def price_pauschale_records(records, df_leit, field_mappings, params, warehouse_dates):
+    """Ergebniszeilen pauschaler Match-Records (leer, APDC, AVDC, NCAR) spaltenweise als ein DataFrame"""
+    positionen = [record['leit_pos'] for record in records]
+    leit = df_leit.iloc[positionen]
+    dates_info = get_warehouse_dates(warehouse_dates, positionen)
+    
+    def text(spalte):
+        return leit[spalte].map(str) if spalte in leit.columns else ''
+    
+    suma_pos_col = field_mappings['suma_pos_col']
+    if suma_pos_col and suma_pos_col in leit.columns:
+        pos_raw = leit[suma_pos_col]
+        pos_value = pos_raw.astype(object) if pos_raw.dtype.kind in 'iuf' else pos_raw.map(lambda wert: pd.to_numeric(wert, errors='ignore'))
+        pos_value = pos_value.where(pos_raw.notna(), '')
     else:
-        anmeldeart_data = df_leit[df_leit[field_mappings['anmeldeart_col']] == anmeldeart_filter]
+        pos_value = pd.Series('', index=leit.index, dtype=object)
+    
+    return pd.DataFrame({
+        'Referenznummer': text('Bezugsnummer/LRN SumA'),
+        'MRN-Nummer Eingang': text('Registriernummer/MRN SumA'),
+        'ATB-Nummer': text('Registriernummer/MRN SumA'),
+        'SUMA-Position': pos_value,
+        'Gestellungsdatum': to_date_werte(leit[field_mappings['gestell_col']]),
+        'Beendigung der Verwahrung': to_date_werte(leit['Datum Ende - CUSFIN']),
+        'Verwahrungsfrist': dates_info['verwahrungsfrist_date'],
+        'Verwahrungsdauer': dates_info['verwahrungsdauer'],
+        'Erledigung mit': '',
+        'Pos': pos_value.where(pos_value.map(bool), 'Pauschale'),
+        'Codenummer': '',
+        'Menge': 0,
+        'Zollwert (total)': 0.0,
+        'Drittlandzollsatz': 0.0,
+        'Zölle (total)': 0.0,
+        'EUSt': 0.0,
+        'Gesamtabgaben': params['pauschalbetrag'],
+        'Anmeldeart': [record['anmeldeart'] for record in records]
+    }, index=leit.index)
+
+def price_match_table(match_table, df_leit, data_sources, field_mappings, params, puffer):
+    """Schreibt die Ergebnisse (vor Mindestabgaben-Regel) in Reihenfolge der Match-Tabelle in den Puffer: Einzelzeilen direkt, pauschale Abschnitte als Block.
+    Liefert je Record die Pufferzeile (-1 ohne Ergebnis)"""
+    warehouse_dates = build_warehouse_dates(df_leit, field_mappings, params)
+    zeilen = np.full(len(match_table), -1)
+    
+    nr = 0
+    for pauschal, records in groupby(match_table, key=lambda record: record['methode'] == 'pauschale'):
+        records = list(records)
+        if pauschal:
+            von = puffer['anzahl']
+            append_ergebnis_block(puffer, price_pauschale_records(records, df_leit, field_mappings, params, warehouse_dates))
+            zeilen[nr:nr + len(records)] = np.arange(von, puffer['anzahl'])
+        else:
+            for offset, record in enumerate(records):
+                von = puffer['anzahl']
+                price_match_record(
+                    record, df_leit.iloc[record['leit_pos']], data_sources, field_mappings, params,
+                    get_warehouse_dates(warehouse_dates, record['leit_pos']), puffer
+                )
+                if puffer['anzahl'] > von:
+                    zeilen[nr + offset] = von
+        nr += len(records)
+    return zeilen
+
+def calculate_results(match_table, df_leit, data_sources, field_mappings, params, profiler=None):
+    """Stufe PREIS: berechnet alle Ergebniszeilen aus der Match-Tabelle und sortiert sie"""
+    with profil_span(profiler, 'Preise › Bepreisung', len(match_table)):
+        puffer = create_ergebnis_puffer(len(match_table))
+        price_match_table(match_table, df_leit, data_sources, field_mappings, params, puffer)
+    return build_ergebnis(puffer, params, profiler)
+
+def build_ergebnis(puffer, params, profiler=None):
+    """Wendet die Mindestabgaben-Regel an und erstellt das sortierte Ergebnis-DataFrame"""
+    with profil_span(profiler, 'Preise › Geschäftsregeln', puffer['anzahl']):
+        puffer = apply_geschaeftsregeln(puffer, params, profiler=profiler)
     
-    pauschalbetrag = st.session_state.get('pauschalbetrag', 10000.0)
+    if not puffer['anzahl']:
+        return None
     
-    for idx, pos_data in anmeldeart_data.iterrows():
-        if has_atb_in_weitere_folge(pos_data, field_mappings):
-            stats['atb_skipped'] = stats.get('atb_skipped', 0) + 1
+    with profil_span(profiler, 'Preise › Sortierung', puffer['anzahl']):
+        return sort_dataframe_standard(build_ergebnis_frame(puffer)).reset_index(drop=True)
+
+# === ERGEBNIS-PUFFER ===
+
+def create_ergebnis_puffer(anzahl):
+    """Vorab angelegte Spaltenpuffer für höchstens anzahl Zeilen: float64-Arrays für Beträge, Listen für den Rest"""
+    return {
+        'anzahl': 0,
+        'spalten': {
+            spalte: np.full(anzahl, np.nan) if spalte in ERGEBNIS_BETRAG_SPALTEN else [None] * anzahl
+            for spalte in ERGEBNIS_SPALTEN
+        }
+    }
+
+def to_betrag(wert):
+    """Betrag für einen float64-Puffer ('' und nicht numerische Werte werden NaN)"""
+    try:
+        return float(wert)
+    except (TypeError, ValueError):
+        return np.nan
+
+def read_ergebnis_zeile(puffer, i):
+    """Werte einer Pufferzeile in Spaltenreihenfolge (ERGEBNIS_SPALTEN), z.B. für den Delta-Stand"""
+    return tuple(werte[i] for werte in puffer['spalten'].values())
+
+def append_ergebnis_zeile(puffer, zeile):
+    """Schreibt eine mit read_ergebnis_zeile gelesene Zeile in den Puffer"""
+    i = puffer['anzahl']
+    for werte, wert in zip(puffer['spalten'].values(), zeile):
+        werte[i] = wert
+    puffer['anzahl'] = i + 1
+
+def append_ergebnis_block(puffer, block):
+    """Schreibt einen Block von Ergebniszeilen (DataFrame mit den Ergebnisspalten) in den Puffer"""
+    von = puffer['anzahl']
+    bis = von + len(block)
+    for spalte, werte in puffer['spalten'].items():
+        if spalte in ERGEBNIS_BETRAG_SPALTEN:
+            werte[von:bis] = pd.to_numeric(block[spalte], errors='coerce').to_numpy(dtype='float64')
+        else:
+            werte[von:bis] = block[spalte].tolist()
+    puffer['anzahl'] = bis
+
+# === ERGEBNIS-DATENTYPEN ===
+
+def get_positions_text_spalte(spalte):
+    return f'{spalte} Text'
+
+def split_positions_spalte(werte):
+    """Ganzzahlige Positionen als Int64, alle übrigen Werte (z.B. 'KEIN MATCH', '3 (1 von 4)') als Kategorie"""
+    ist_zahl = werte.map(lambda x: isinstance(x, (int, float, np.number)) and not isinstance(x, bool))
+    zahlen = pd.to_numeric(werte.where(ist_zahl), errors='coerce')
+    ganzzahlig = zahlen.notna() & (zahlen % 1 == 0)
+    
+    texte = werte.where(~ganzzahlig & werte.notna() & (werte != ''))
+    return zahlen.where(ganzzahlig).astype('Int64'), texte.astype('category') if texte.notna().any() else None
+
+def get_positions_werte(df, spalte):
+    """Ursprüngliche Werte einer Positionsspalte (Zahl, Text oder '') aus Int64- und Text-Spalte"""
+    werte = df[spalte].astype(object).where(df[spalte].notna(), '')
+    text_spalte = get_positions_text_spalte(spalte)
+    if text_spalte in df.columns:
+        werte = werte.where(df[text_spalte].isna(), df[text_spalte].astype(object))
+    return werte
+
+def build_ergebnis_frame(puffer):
+    """Ergebnis-DataFrame aus dem Puffer mit kompakten Typen: Kategorien, float64-Beträge, datetime64-Daten, Int64-Positionen"""
+    anzahl = puffer['anzahl']
+    ziel = pd.DataFrame({spalte: werte[:anzahl] for spalte, werte in puffer['spalten'].items()})
+    
+    for spalte in ERGEBNIS_DATUM_SPALTEN:
+        ziel[spalte] = pd.to_datetime(ziel[spalte], errors='coerce')
+    for spalte in ERGEBNIS_KATEGORIE_SPALTEN:
+        ziel[spalte] = ziel[spalte].astype('category')
+    for spalte in ERGEBNIS_POSITIONS_SPALTEN:
+        ziel[spalte], texte = split_positions_spalte(ziel[spalte])
+        if texte is not None:
+            ziel[get_positions_text_spalte(spalte)] = texte
+    
+    return ziel
+
+def build_ergebnis_export(df):
+    """Ergebnis für Excel-Sheet und Anzeige: Positionsspalten zusammengesetzt, Text-Spalten entfernt"""
+    df = df.copy()
+    for spalte in ERGEBNIS_POSITIONS_SPALTEN:
+        if spalte in df.columns:
+            df[spalte] = get_positions_werte(df, spalte)
+    return df.drop(columns=[
+        get_positions_text_spalte(spalte) for spalte in ERGEBNIS_POSITIONS_SPALTEN
+        if get_positions_text_spalte(spalte) in df.columns
+    ])
+
+# === DELTA-VERARBEITUNG ===
+
+DELTA_VERSION = 2
+DELTA_SCHLUESSEL_SPALTEN = ['Bezugsnummer/LRN SumA', 'Registriernummer/MRN SumA']
+
+def get_stand_file(mandant_key, name):
+    """Pfad eines gespeicherten Verarbeitungsstands (z.B. delta_stand, saldo_stand) eines Mandanten"""
+    return os.path.join(ARTEFAKT_VERZEICHNIS, mandant_key, f'{name}.pkl')
+
+def load_mandant_stand(mandant_key, name, version):
+    """Lädt den Stand des letzten Laufs (None wenn nicht vorhanden oder veraltet)"""
+    pfad = get_stand_file(mandant_key, name)
+    if not os.path.exists(pfad):
+        return None
+    
+    try:
+        with open(pfad, 'rb') as f:
+            stand = pickle.load(f)
+    except Exception:
+        return None
+    
+    return stand if stand.get('version') == version else None
+
+def save_mandant_stand(mandant_key, name, stand):
+    """Speichert einen Stand atomar (temporäre Datei, dann umbenennen)"""
+    pfad = get_stand_file(mandant_key, name)
+    os.makedirs(os.path.dirname(pfad), exist_ok=True)
+    
+    with open(pfad + '.tmp', 'wb') as f:
+        pickle.dump(stand, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(pfad + '.tmp', pfad)
+
+def build_leit_fingerprints(df_leit, data_sources, field_mappings):
+    """Schlüssel (LRN, MRN SumA, SumA-Position) und Fingerprint (Zeileninhalt plus Importzeilen) je Leitdatei-Zeile"""
+    leer = pd.Series('', index=df_leit.index)
+    teile = [df_leit[col].astype(str) if col in df_leit.columns else leer for col in DELTA_SCHLUESSEL_SPALTEN]
+    teile.append(df_leit[field_mappings['suma_pos_col']].astype(str) if field_mappings['suma_pos_col'] else leer)
+    
+    basis = teile[0] + '|' + teile[1] + '|' + teile[2]
+    # Mehrfach vorkommende Schlüssel werden über ihr Vorkommen unterschieden
+    schluessel = (basis + '#' + basis.groupby(basis, sort=False).cumcount().astype(str)).tolist()
+    
+    fingerprint = pd.util.hash_pandas_object(df_leit, index=False).to_numpy().copy()
+    
+    for art, config in ANMELDEART_CONFIG.items():
+        maske = np.zeros(len(df_leit), dtype=bool)
+        maske[get_partition_positionen(data_sources['leit_partition'], art)] = True
+        if 'import_source' not in config or not maske.any():
             continue
         
-        stats[f'{anmeldeart_name.lower()}_processed'] += 1
+        gruppen = build_import_gruppen(data_sources[config['import_source']], field_mappings[config['match_field']])
+        mrns = pd.Index(list(gruppen.keys()))
+        gruppen_hash = np.array([wert[0] for wert in gruppen.values()] + [0], dtype='uint64')
         
-        dates_info = calculate_warehouse_dates(
-            pos_data[field_mappings['gestell_col']],
-            pos_data['Datum Ende - CUSFIN'],
-            st.session_state.get('verwahrungsfrist_tage', 90)
+        for faktor, col in ((0x9E3779B97F4A7C15, 'leit_col_weitere'), (0xC2B2AE3D27D4EB4F, 'leit_col_reg')):
+            # -1 (MRN ohne Importzeilen) zeigt auf den angehängten Hash 0
+            h = gruppen_hash[mrns.get_indexer(df_leit[field_mappings[col]])]
+            fingerprint[maske] ^= h[maske] * np.uint64(faktor)
+    
+    return schluessel, fingerprint
+
+def compare_leit_fingerprints(stand, schluessel, fingerprint):
+    """Vergleicht die Leitdatei mit dem letzten Lauf: neue, geänderte, entfernte und unveränderte Zeilen"""
+    alt = stand['zeilen'] if stand else {}
+    delta = {'eingefuegt': [], 'geaendert': [], 'unveraendert': []}
+    
+    for pos, (key, fp) in enumerate(zip(schluessel, fingerprint)):
+        eintrag = alt.get(key)
+        if eintrag is None:
+            delta['eingefuegt'].append(pos)
+        elif eintrag['fingerprint'] != fp:
+            delta['geaendert'].append(pos)
+        else:
+            delta['unveraendert'].append(pos)
+    
+    delta['entfernt'] = list(set(alt) - set(schluessel))
+    return delta
+
+def get_bewegungs_datum(zeile):
+    """Frühestes Bewegungsdatum (Eingang oder Ausgang) einer Ergebniszeile"""
+    if zeile is None:
+        return None
+    daten = [
+        parse_german_date(zeile[ERGEBNIS_SPALTEN.index('Gestellungsdatum')]),
+        parse_german_date(zeile[ERGEBNIS_SPALTEN.index('Beendigung der Verwahrung')])
+    ]
+    daten = [d for d in daten if d]
+    return min(daten) if daten else None
+
+def build_anmeldeart_rang(partition, anzahl):
+    """Verarbeitungsreihenfolge der Anmeldearten wie in create_match_table (leer = '(leer)')"""
+    reihenfolge = VERARBEITBARE_ARTEN + PAUSCHALE_ARTEN
+    rang = np.full(anzahl, len(reihenfolge))
+    for i, art in enumerate(reihenfolge):
+        rang[get_partition_positionen(partition, art)] = i
+    return rang
+
+def run_delta_stage(df_leit, data_sources, field_mappings, leit_stats, params, mandant_key, progress_callback=None, step_callback=None, profiler=None):
+    """Delta-Modus: matcht und bepreist nur neue oder geänderte Leitdatei-Zeilen, der Rest kommt aus dem letzten Lauf"""
+    param_hash = build_stage_key(
+        DELTA_VERSION, build_match_schema(data_sources, field_mappings),
+        {name: params[name] for name in MATCH_PARAMETER + PREIS_PARAMETER}
+    )
+    
+    stand = load_mandant_stand(mandant_key, 'delta_stand', DELTA_VERSION)
+    if stand is not None and stand['param_hash'] != param_hash:
+        if step_callback:
+            step_callback("ℹ️ Parameter oder Spalten geändert - Delta-Stand wird neu aufgebaut")
+        stand = None
+    
+    schluessel, fingerprint = build_leit_fingerprints(df_leit, data_sources, field_mappings)
+    delta = compare_leit_fingerprints(stand, schluessel, fingerprint)
+    positionen = sorted(delta['eingefuegt'] + delta['geaendert'])
+    
+    zeilen_stats = {}
+    match_table, _ = run_match_stage(
+        df_leit.iloc[positionen], data_sources, field_mappings, leit_stats, params, mandant_key,
+        progress_callback=progress_callback, step_callback=step_callback, zeilen_stats=zeilen_stats, profiler=profiler,
+        partition=select_leit_partition(data_sources['leit_partition'], positionen)
+    )
+    with profil_span(profiler, 'Preise › Bepreisung', len(match_table)):
+        neu = create_ergebnis_puffer(len(match_table))
+        neue_zeilen = {
+            record['leit_pos']: read_ergebnis_zeile(neu, zeile) if zeile >= 0 else None
+            for record, zeile in zip(match_table, price_match_table(match_table, df_leit, data_sources, field_mappings, params, neu))
+        }
+    
+    alt = stand['zeilen'] if stand else {}
+    betroffene_daten = [get_bewegungs_datum(alt[key]['zeile']) for key in delta['entfernt']]
+    betroffene_daten += [get_bewegungs_datum(alt[schluessel[pos]]['zeile']) for pos in delta['geaendert']]
+    betroffene_daten += [get_bewegungs_datum(zeile) for zeile in neue_zeilen.values()]
+    betroffene_daten = [d for d in betroffene_daten if d]
+    
+    zeilen = {key: alt[key] for key in (schluessel[pos] for pos in delta['unveraendert'])}
+    for pos in positionen:
+        zeilen[schluessel[pos]] = {
+            'fingerprint': int(fingerprint[pos]),
+            'zeile': neue_zeilen.get(pos),
+            'stats': zeilen_stats.get(pos, {})
+        }
+    
+    # Reihenfolge wie bei vollständiger Verarbeitung: Anmeldeart, dann Position in der Leitdatei
+    rang = build_anmeldeart_rang(data_sources['leit_partition'], len(df_leit))
+    stats = defaultdict(int)
+    puffer = create_ergebnis_puffer(len(df_leit))
+    for pos in np.lexsort((np.arange(len(df_leit)), rang)):
+        eintrag = zeilen[schluessel[pos]]
+        for key, value in eintrag['stats'].items():
+            stats[key] += value
+        if eintrag['zeile'] is not None:
+            append_ergebnis_zeile(puffer, eintrag['zeile'])
+    
+    save_mandant_stand(mandant_key, 'delta_stand', {'version': DELTA_VERSION, 'param_hash': param_hash, 'zeilen': zeilen})
+    
+    delta_info = {
+        'eingefuegt': len(delta['eingefuegt']),
+        'geaendert': len(delta['geaendert']),
+        'entfernt': len(delta['entfernt']),
+        'unveraendert': len(delta['unveraendert']),
+        'vollstaendig': stand is None,
+        'erstes_datum': None if stand is None or not betroffene_daten else min(betroffene_daten)
+    }
+    
+    if step_callback:
+        erstes = delta_info['erstes_datum'].strftime('%d.%m.%Y') if delta_info['erstes_datum'] else '—'
+        step_callback(
+            f"✅ Delta: {delta_info['eingefuegt']} neu, {delta_info['geaendert']} geändert, "
+            f"{delta_info['entfernt']} entfernt, {delta_info['unveraendert']} übernommen - erster betroffener Tag: {erstes}"
         )
-        
-        pos_value = ''
-        if field_mappings['suma_pos_col'] and field_mappings['suma_pos_col'] in pos_data:
-            pos_raw = pos_data[field_mappings['suma_pos_col']]
-            pos_value = pd.to_numeric(pos_raw, errors='ignore') if pd.notna(pos_raw) else ''
-        
-        results.append({
-            'Referenznummer': str(pos_data.get('Bezugsnummer/LRN SumA', '')),
-            'MRN-Nummer Eingang': str(pos_data.get('Registriernummer/MRN SumA', '')),
-            'ATB-Nummer': str(pos_data.get('Registriernummer/MRN SumA', '')),
-            'SUMA-Position': pos_value,
-            'Gestellungsdatum': safe_date_value(pos_data[field_mappings['gestell_col']]),
-            'Beendigung der Verwahrung': safe_date_value(pos_data['Datum Ende - CUSFIN']),
-            'Verwahrungsfrist': dates_info.get('verwahrungsfrist_date', None),
-            'Verwahrungsdauer': dates_info.get('verwahrungsdauer', 0),
-            'Erledigung mit': '',
-            'Pos': pos_value if pos_value else 'Pauschale',
-            'Codenummer': '',
-            'Menge': 0,
-            'Zollwert (total)': 0.0,
-            'Drittlandzollsatz': 0.0,
-            'Zölle (total)': 0.0,
-            'EUSt': 0.0,
-            'Gesamtabgaben': pauschalbetrag,
-            'Anmeldeart': anmeldeart_name
-        })
     
-    return results
+    return build_ergebnis(puffer, params, profiler), dict(stats), delta_info
 
 # === BÜRGSCHAFTSSALDO FUNKTIONEN ===
 
-def create_bewegungstabelle(df_ziel):
+def get_suma_sortwert(wert):
+    """SUMA-Position als Sortierwert der Bewegungen (Zahlen und Ziffern-Texte, sonst 999999)"""
+    if isinstance(wert, (int, float)) or (isinstance(wert, str) and wert.replace('.', '').isdigit()):
+        return float(wert)
+    return 999999
+
+def get_datum_ordinale(werte):
+    """Datumsspalte als Tages-Ordinale (wie date.toordinal), -1 für fehlende Daten"""
+    werte = pd.to_datetime(werte, errors='coerce')
+    ordinale = werte.to_numpy(dtype='datetime64[D]').astype(np.int64) + EPOCHE_ORDINAL
+    return np.where(werte.isna().to_numpy(), -1, ordinale)
+
+def get_bewegungs_sortier_codes(df_ziel, schluessel=None):
+    """Sortier-Codes je Zieldatei-Zeile (Index für die Tabellenreihenfolge, ATB-Nummer für die Saldo-Sortierung)"""
+    if schluessel is None:
+        schluessel = build_sortier_schluessel(df_ziel)
+    return {'index': factorize_sortiert(df_ziel.index)[0], 'atb': schluessel['atb']}
+
+def encode_woerterbuch(werte, woerterbuch):
+    """int32-Codes der Werte in einem fortlaufend erweiterten Wörterbuch {Wert: Code}"""
+    codes, eindeutige = pd.factorize(np.asarray(werte, dtype=object), use_na_sentinel=False)
+    lokale_codes = np.array([woerterbuch.setdefault(wert, len(woerterbuch)) for wert in eindeutige], dtype=np.int32)
+    return lokale_codes[codes]
+
+def decode_woerterbuecher(woerterbuecher):
+    """Wörterbücher {Wert: Code} als Wert-Arrays (Code = Position)"""
+    ergebnis = {}
+    for spalte, woerterbuch in woerterbuecher.items():
+        ergebnis[spalte] = np.empty(len(woerterbuch), dtype=object)
+        ergebnis[spalte][:] = list(woerterbuch)
+    return ergebnis
+
+def build_bewegungs_spalten(df_ziel, sortier_codes, woerterbuecher, von=0, bis=None):
+    """Bewegungen der Zieldatei-Zeilen von..bis als Spalten-Arrays, Schlüssel als Wörterbuch-Codes; Zeilen ohne Datum erzeugen keine Bewegung"""
+    teil = df_ziel.iloc[von:bis]
+    werte = {
+        'ATB-Nummer': teil['ATB-Nummer'],
+        'Referenznummer': teil['Referenznummer'],
+        'Pos': get_positions_werte(teil, 'Pos'),
+        'SUMA-Position': get_positions_werte(teil, 'SUMA-Position'),
+        'Anmeldeart': teil['Anmeldeart']
+    }
+    codes = {spalte: encode_woerterbuch(werte[spalte], woerterbuecher[spalte]) for spalte in BEWEGUNGS_WOERTERBUCH_SPALTEN}
+    suma_sortwert = np.array([get_suma_sortwert(wert) for wert in werte['SUMA-Position']], dtype=np.float64)
+    betrag = pd.to_numeric(teil['Gesamtabgaben'], errors='coerce').fillna(0).to_numpy(dtype=np.float64)
+    
+    zeilen, arten, daten = [], [], []
+    for art, spalte in enumerate(['Gestellungsdatum', 'Beendigung der Verwahrung']):
+        ordinale = get_datum_ordinale(teil[spalte])
+        gueltig = np.flatnonzero(ordinale >= 0)
+        zeilen.append(gueltig)
+        arten.append(np.full(len(gueltig), art, dtype=np.int8))
+        daten.append(ordinale[gueltig])
+    zeilen = np.concatenate(zeilen)
+    
+    return {
+        'datum': np.concatenate(daten).astype(np.int32),
+        'art': np.concatenate(arten),
+        'index_code': sortier_codes['index'][von + zeilen],
+        'atb_code': sortier_codes['atb'][von + zeilen],
+        'suma_sortwert': suma_sortwert[zeilen],
+        'betrag': betrag[zeilen],
+        **{spalte: codes[spalte][zeilen] for spalte in BEWEGUNGS_WOERTERBUCH_SPALTEN}
+    }
+
+def get_tabellen_reihenfolge(spalten):
+    """Tabellenreihenfolge der Bewegungen: Tag, Eingänge vor Ausgängen, Zeile der Zieldatei"""
+    return np.lexsort((spalten['index_code'], spalten['art'], spalten['datum']))
+
+def build_bewegungs_block(spalten, woerterbuecher):
+    """Bewegungstabelle aus Spalten-Arrays in Tabellenreihenfolge (z.B. Ausschnitte des Bewegungs-Speichers), mit Rang der Saldo-Sortierung"""
+    daten = np.asarray(spalten['datum'])
+    
+    # Rang der Saldo-Sortierung (Tag, Eingänge vor Ausgängen, ATB-Nummer, SUMA-Position) - einmal für alle Teilmengen
+    saldo_reihenfolge = np.lexsort((spalten['suma_sortwert'], spalten['atb_code'], spalten['art'], daten))
+    rang = np.empty(len(daten), dtype=np.int64)
+    rang[saldo_reihenfolge] = np.arange(len(daten))
+    
+    ordinale, position = np.unique(daten, return_inverse=True)
+    eingang = np.asarray(spalten['art']) == 0
+    betrag = np.asarray(spalten['betrag'])
+    return pd.DataFrame({
+        'Datum': np.array([date.fromordinal(int(ordinal)) for ordinal in ordinale], dtype=object)[position],
+        'Bewegungsart': np.where(eingang, 'Eingang', 'Ausgang').astype(object),
+        'ATB-Nummer': woerterbuecher['ATB-Nummer'][spalten['ATB-Nummer']],
+        'Referenznummer': woerterbuecher['Referenznummer'][spalten['Referenznummer']],
+        'Pos': woerterbuecher['Pos'][spalten['Pos']],
+        'SUMA-Position': woerterbuecher['SUMA-Position'][spalten['SUMA-Position']],
+        'Belastung': np.where(eingang, betrag, 0.0),
+        'Entlastung': np.where(eingang, 0.0, betrag),
+        'Anmeldeart': woerterbuecher['Anmeldeart'][spalten['Anmeldeart']],
+        '_saldo_rang': rang
+    })
+
+def create_bewegungstabelle(df_ziel, schluessel=None):
     """Erstellt eine Memory-Tabelle mit allen Bewegungen (Ein- und Ausgänge)"""
-    bewegungen = []
-    
-    for idx, row in df_ziel.iterrows():
-        gestell_date = parse_german_date(row['Gestellungsdatum'])
-        if gestell_date:
-            bewegungen.append({
-                'Datum': gestell_date,
-                'Datum_str': safe_strftime(row['Gestellungsdatum']),
-                'Bewegungsart': 'Eingang',
-                'ATB-Nummer': row['ATB-Nummer'],
-                'Referenznummer': row['Referenznummer'],
-                'Pos': row['Pos'],
-                'SUMA-Position': row.get('SUMA-Position', ''),
-                'Belastung': row['Gesamtabgaben'],
-                'Entlastung': 0,
-                'Anmeldeart': row['Anmeldeart'],
-                '_original_idx': idx
-            })
-        
-        beend_date = parse_german_date(row['Beendigung der Verwahrung'])
-        if beend_date:
-            bewegungen.append({
-                'Datum': beend_date,
-                'Datum_str': safe_strftime(row['Beendigung der Verwahrung']),
-                'Bewegungsart': 'Ausgang',
-                'ATB-Nummer': row['ATB-Nummer'],
-                'Referenznummer': row['Referenznummer'],
-                'Pos': row['Pos'],
-                'SUMA-Position': row.get('SUMA-Position', ''),
-                'Belastung': 0,
-                'Entlastung': row['Gesamtabgaben'],
-                'Anmeldeart': row['Anmeldeart'],
-                '_original_idx': idx
-            })
+    woerterbuecher = {spalte: {} for spalte in BEWEGUNGS_WOERTERBUCH_SPALTEN}
+    spalten = build_bewegungs_spalten(df_ziel, get_bewegungs_sortier_codes(df_ziel, schluessel), woerterbuecher)
+    reihenfolge = get_tabellen_reihenfolge(spalten)
+    return build_bewegungs_block({spalte: werte[reihenfolge] for spalte, werte in spalten.items()}, decode_woerterbuecher(woerterbuecher))
+
+# === BEWEGUNGS-SPEICHER ===
+
+# Ab dieser Anzahl Bewegungen schreibt die Saldo-Engine die Bewegungen in einen Spaltenspeicher und liest ihn blockweise
+BEWEGUNGEN_SPEICHERABBILD_AB = int(os.environ.get('BUERGCONTROL_SPEICHERABBILD_AB', 2000000))
+BEWEGUNGEN_BLOCK_ZEILEN = 250000
+# Spalten des Bewegungs-Speichers je Bewegung (.npy, eingeblendet per mmap); Schlüssel als int32-Codes plus Wörterbuch
+BEWEGUNGS_SPEICHER_SPALTEN = {
+    'datum': np.int32,
+    'art': np.int8,
+    'index_code': np.int32,
+    'atb_code': np.int32,
+    'suma_sortwert': np.float64,
+    'betrag': np.float64,
+    'ATB-Nummer': np.int32,
+    'Referenznummer': np.int32,
+    'Pos': np.int32,
+    'SUMA-Position': np.int32,
+    'Anmeldeart': np.int32
+}
+BEWEGUNGS_WOERTERBUCH_SPALTEN = ['ATB-Nummer', 'Referenznummer', 'Pos', 'SUMA-Position', 'Anmeldeart']
+EPOCHE_ORDINAL = date(1970, 1, 1).toordinal()
+
+def get_bewegungs_monat(ordinale):
+    """Monatsnummer (seit 1970) zu Tages-Ordinalen - Partition beim Schreiben des Bewegungs-Speichers"""
+    tage = np.asarray(ordinale, dtype=np.int64) - EPOCHE_ORDINAL
+    return tage.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+
+def count_bewegungen(df_ziel):
+    """Anzahl der Bewegungen (Zeilen mit Gestellungs- bzw. Beendigungsdatum) ohne sie zu erzeugen"""
+    return int(sum(pd.to_datetime(df_ziel[spalte], errors='coerce').notna().sum() for spalte in ['Gestellungsdatum', 'Beendigung der Verwahrung']))
+
+def write_bewegungs_speicher(df_ziel, schluessel, verzeichnis):
+    """Schreibt die Bewegungen in Blöcken von BEWEGUNGEN_BLOCK_ZEILEN Zieldatei-Zeilen in den Bewegungs-Speicher - ohne Gesamttabelle.
+    Die Blöcke werden zuerst je Monat angehängt, dann Monat für Monat sortiert in die .npy-Spalten übertragen"""
+    os.makedirs(verzeichnis, exist_ok=True)
+    sortier_codes = get_bewegungs_sortier_codes(df_ziel, schluessel)
+    woerterbuecher = {spalte: {} for spalte in BEWEGUNGS_WOERTERBUCH_SPALTEN}
+    monate = defaultdict(int)
+    
+    def monats_datei(nummer, nr):
+        return os.path.join(verzeichnis, f'monat_{nummer}_{nr:02d}.bin')
+    
+    for von in range(0, len(df_ziel), BEWEGUNGEN_BLOCK_ZEILEN):
+        spalten = build_bewegungs_spalten(df_ziel, sortier_codes, woerterbuecher, von, von + BEWEGUNGEN_BLOCK_ZEILEN)
+        monat = get_bewegungs_monat(spalten['datum'])
+        reihenfolge = np.argsort(monat, kind='stable')
+        for teil in np.split(reihenfolge, np.flatnonzero(np.diff(monat[reihenfolge])) + 1) if len(reihenfolge) else []:
+            nummer = int(monat[teil[0]])
+            for nr, (spalte, dtype) in enumerate(BEWEGUNGS_SPEICHER_SPALTEN.items()):
+                with open(monats_datei(nummer, nr), 'ab') as f:
+                    spalten[spalte][teil].astype(dtype).tofile(f)
+            monate[nummer] += len(teil)
+    
+    # Monate nacheinander in Tabellenreihenfolge an die Spalten anhängen - es liegt höchstens ein Monat im Speicher
+    anzahl = sum(monate.values())
+    dateien = {spalte: f'spalte_{nr:02d}.npy' for nr, spalte in enumerate(BEWEGUNGS_SPEICHER_SPALTEN)}
+    ziele = {
+        spalte: np.lib.format.open_memmap(os.path.join(verzeichnis, dateien[spalte]), mode='w+', dtype=dtype, shape=(anzahl,))
+        for spalte, dtype in BEWEGUNGS_SPEICHER_SPALTEN.items()
+    }
+    start = 0
+    for nummer, zeilen in sorted(monate.items()):
+        werte = {}
+        for nr, (spalte, dtype) in enumerate(BEWEGUNGS_SPEICHER_SPALTEN.items()):
+            werte[spalte] = np.fromfile(monats_datei(nummer, nr), dtype=dtype)
+            os.remove(monats_datei(nummer, nr))
+        reihenfolge = get_tabellen_reihenfolge(werte)
+        for spalte in BEWEGUNGS_SPEICHER_SPALTEN:
+            ziele[spalte][start:start + zeilen] = werte[spalte][reihenfolge]
+        start += zeilen
+    for ziel in ziele.values():
+        ziel.flush()
+    del ziele
+    
+    with open(os.path.join(verzeichnis, 'speicher.pkl'), 'wb') as f:
+        pickle.dump({'anzahl': anzahl, 'dateien': dateien, 'woerterbuecher': decode_woerterbuecher(woerterbuecher)}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    return load_bewegungs_speicher(verzeichnis)
+
+def load_bewegungs_speicher(verzeichnis):
+    """Öffnet den Bewegungs-Speicher; die Spalten werden nur eingeblendet (mmap), nicht geladen"""
+    with open(os.path.join(verzeichnis, 'speicher.pkl'), 'rb') as f:
+        speicher = pickle.load(f)
+    speicher['spalten'] = {
+        # Leere Dateien lassen sich nicht einblenden
+        spalte: np.load(os.path.join(verzeichnis, datei), mmap_mode='r') if speicher['anzahl'] else np.zeros(0, dtype=BEWEGUNGS_SPEICHER_SPALTEN[spalte])
+        for spalte, datei in speicher['dateien'].items()
+    }
+    return speicher
+
+def iter_bewegungs_ausschnitte(speicher, ab_datum=None):
+    """Ausschnitte ganzer Tage des Bewegungs-Speichers ab ab_datum (Spalten als mmap-Ansichten)"""
+    # Der Speicher ist nach Tag sortiert - Blockgrenzen per Binärsuche, ohne die Spalte zu laden
+    datum = speicher['spalten']['datum']
+    anzahl = speicher['anzahl']
+    start = int(np.searchsorted(datum, ab_datum.toordinal(), side='left')) if ab_datum else 0
+    while start < anzahl:
+        ende = min(start + BEWEGUNGEN_BLOCK_ZEILEN, anzahl)
+        ende = int(np.searchsorted(datum, datum[ende - 1], side='right'))
+        yield {spalte: werte[start:ende] for spalte, werte in speicher['spalten'].items()}
+        start = ende
+
+def iter_bewegungs_bloecke(bewegungen, ab_datum=None):
+    """Bewegungen in Blöcken ganzer Tage: eine Tabelle als ein Block, der Bewegungs-Speicher ab ab_datum in Blöcken"""
+    if isinstance(bewegungen, pd.DataFrame):
+        yield bewegungen
+        return
     
-    for bewegung in bewegungen:
-        suma_pos = bewegung.get('SUMA-Position', '')
-        try:
-            bewegung['_suma_pos_numeric'] = float(suma_pos) if suma_pos != '' else 999999
-        except Exception:
-            bewegung['_suma_pos_numeric'] = 999999
+    for spalten in iter_bewegungs_ausschnitte(bewegungen, ab_datum):
+        yield build_bewegungs_block(spalten, bewegungen['woerterbuecher'])
+
+# === BEWEGUNGSDETAILS-BLÖCKE ===
+
+def get_details_verzeichnis(mandant_key):
+    """Verzeichnis der gespeicherten Bewegungsdetails-Blöcke eines Mandanten"""
+    return os.path.join(ARTEFAKT_VERZEICHNIS, mandant_key, 'saldo_details')
+
+def save_details_block(verzeichnis, details_df):
+    """Legt einen Block Bewegungsdetails ab (ohne Verzeichnis bleibt er im Speicher) und liefert seinen Eintrag für den Stand"""
+    if verzeichnis is None:
+        return {'df': details_df, 'zeilen': len(details_df)}
+    
+    os.makedirs(verzeichnis, exist_ok=True)
+    datei = f'{uuid.uuid4().hex}.pkl'
+    details_df.to_pickle(os.path.join(verzeichnis, datei))
+    return {'datei': datei, 'zeilen': len(details_df)}
+
+def load_details_block(verzeichnis, block):
+    """Lädt einen Block Bewegungsdetails"""
+    if 'df' in block:
+        return block['df']
+    return pd.read_pickle(os.path.join(verzeichnis, block['datei']))
+
+def is_details_vorhanden(verzeichnis, bloecke):
+    """Prüft, ob alle Blöcke der Bewegungsdetails noch vorliegen"""
+    return all('df' in block or (verzeichnis is not None and os.path.exists(os.path.join(verzeichnis, block['datei']))) for block in bloecke)
+
+def take_details_bloecke(verzeichnis, bloecke, zeilen):
+    """Die ersten zeilen Zeilen der Bewegungsdetails: ganze Blöcke werden übernommen, der angeschnittene Block gekürzt neu abgelegt"""
+    ergebnis = []
+    for block in bloecke:
+        if zeilen <= 0:
+            break
+        if block['zeilen'] <= zeilen:
+            ergebnis.append(block)
+        else:
+            ergebnis.append(save_details_block(verzeichnis, load_details_block(verzeichnis, block).iloc[:zeilen]))
+        zeilen -= block['zeilen']
+    return ergebnis
+
+def bereinige_details_bloecke(verzeichnis, bloecke):
+    """Entfernt Blöcke früherer Läufe, die der aktuelle Stand nicht mehr verwendet"""
+    if not os.path.isdir(verzeichnis):
+        return
+    verwendet = {block['datei'] for block in bloecke if 'datei' in block}
+    for datei in os.listdir(verzeichnis):
+        if datei not in verwendet:
+            try:
+                os.remove(os.path.join(verzeichnis, datei))
+            except OSError:
+                pass
+
+def iter_bewegungsdetails(saldo):
+    """Bewegungsdetails blockweise: die Tabelle des Laufs oder die abgelegten Blöcke (Bewegungs-Speicher)"""
+    if saldo.get('bewegungsdetails_df') is not None:
+        yield saldo['bewegungsdetails_df']
+        return
     
-    bewegungen.sort(key=lambda x: (x['Datum'], 0 if x['Bewegungsart'] == 'Eingang' else 1, x['_original_idx'], x['_suma_pos_numeric']))
+    details = saldo['bewegungsdetails']
+    for block in details['bloecke']:
+        yield load_details_block(details['verzeichnis'], block)
+
+SALDO_VERSION = 3
+BEWEGUNGS_HASH_SPALTEN = ['Datum', 'Bewegungsart', 'ATB-Nummer', 'Referenznummer', 'Pos', 'SUMA-Position', 'Belastung', 'Entlastung', 'Anmeldeart']
+
+def build_tages_hashes(bewegungen_df):
+    """Inhalts-Hash aller Bewegungen je Tag (sortiert nach Datum)"""
+    if bewegungen_df.empty:
+        return {}
     
-    for bewegung in bewegungen:
-        bewegung.pop('_suma_pos_numeric', None)
+    spalten = [col for col in BEWEGUNGS_HASH_SPALTEN if col in bewegungen_df.columns]
+    zeilen_hash = pd.util.hash_pandas_object(bewegungen_df[spalten], index=False).to_numpy()
+    rang = bewegungen_df.groupby('Datum', sort=False).cumcount().to_numpy().astype('uint64')
+    gemischt = zeilen_hash ^ (rang * np.uint64(0x9E3779B97F4A7C15))
     
-    df_bewegungen = pd.DataFrame(bewegungen)
-    if '_original_idx' in df_bewegungen.columns:
-        df_bewegungen = df_bewegungen.drop(columns=['_original_idx'])
+    tages_hash = pd.Series(gemischt).groupby(bewegungen_df['Datum'].to_numpy()).sum()
+    return {datum: int(wert) for datum, wert in tages_hash.items()}
+
+def sort_bewegungen(bewegungen_df):
+    """Sortierung für Bewegungsdetails und Tageszusammenfassung (Eingänge vor Ausgängen) über den vorberechneten Rang"""
+    reihenfolge = np.argsort(bewegungen_df['_saldo_rang'].to_numpy(), kind='stable')
+    return bewegungen_df.iloc[reihenfolge].drop(columns=['_saldo_rang'])
+
+def kumuliere_stand(start, belastung, entlastung, vorher, nachher):
+    """Laufender Stand je Bewegung in fester Reihenfolge: Stand + vorher - Belastung + Entlastung + nachher (Spalten 0..3)"""
+    schritte = np.zeros((len(belastung), 4))
+    schritte[:, 0] = vorher
+    schritte[:, 1] = -belastung
+    schritte[:, 2] = entlastung
+    schritte[:, 3] = nachher
+    # add.accumulate rechnet streng sequentiell - gleiche Rundung wie die schrittweise Fortschreibung
+    return np.cumsum(np.concatenate([[start], schritte.ravel()]))[1:].reshape(-1, 4)
+
+def build_saldo_ledger(bewegungen_df, params, tag_stand, bewegung_stand, details_stand):
+    """Ledger der Saldo-Engine: Bewegungen einmal in Saldo-Reihenfolge mit Tagesgrenzen, laufenden Ständen und Tageswerten"""
+    sortiert = sort_bewegungen(bewegungen_df)
+    anzahl = len(sortiert)
+    daten = sortiert['Datum'].to_numpy()
+    starts = np.flatnonzero(np.concatenate([[anzahl > 0], daten[1:] != daten[:-1]]))
+    grenzen = np.append(starts, anzahl)
+    tage = daten[starts].tolist()
+    
+    belastung = sortiert['Belastung'].to_numpy(dtype=float)
+    entlastung = sortiert['Entlastung'].to_numpy(dtype=float)
+    erhoehung = np.array([params['buergschaft_erhöhung_betrag'] if is_erhoehung_tag(datum, params) else 0.0 for datum in tage])
+    tag_nr = np.repeat(np.arange(len(tage)), np.diff(grenzen))
+    erster = np.zeros(anzahl, dtype=bool)
+    erster[starts] = True
+    letzter = np.zeros(anzahl, dtype=bool)
+    letzter[grenzen[1:] - 1] = True
+    erhoehung_je_bewegung = erhoehung[tag_nr] if anzahl else np.zeros(0)
+    
+    # Bewegungsdetails: Erhöhung vor der ersten Bewegung des Tages; Höchst-/Tiefststände: Erhöhung nach dem Tagesende
+    details = kumuliere_stand(details_stand, belastung, entlastung, np.where(erster, erhoehung_je_bewegung, 0.0), 0.0)
+    verlauf = kumuliere_stand(bewegung_stand, belastung, entlastung, 0.0, np.where(letzter, erhoehung_je_bewegung, 0.0))
+    
+    tages_werte = []
+    if anzahl:
+        eroeffnung = np.concatenate([[bewegung_stand], verlauf[grenzen[1:-1] - 1, 3]])
+        tiefst = np.minimum(eroeffnung, np.minimum.reduceat(verlauf[:, 2], starts)).tolist()
+        hoechst = np.maximum(np.maximum(eroeffnung, np.maximum.reduceat(verlauf[:, 2], starts)), verlauf[grenzen[1:] - 1, 3]).tolist()
+        schluss = verlauf[grenzen[1:] - 1, 3].tolist()
+        
+        # Tagessummen in Tabellenreihenfolge (die Bewegungstabelle ist nach Tag gruppiert)
+        for nr, datum in enumerate(tage):
+            tages_data = bewegungen_df.iloc[grenzen[nr]:grenzen[nr + 1]]
+            belastung_summe = float(tages_data['Belastung'].sum())
+            entlastung_summe = float(tages_data['Entlastung'].sum())
+            if erhoehung[nr]:
+                entlastung_summe += params['buergschaft_erhöhung_betrag']
+            
+            tag_stand = tag_stand - round(belastung_summe, 2) + round(entlastung_summe, 2)
+            tages_werte.append({
+                'Belastung': round(belastung_summe, 2),
+                'Entlastung': round(entlastung_summe, 2),
+                'Netto': round(entlastung_summe - belastung_summe, 2),
+                'Bürgschaftsstand': round(tag_stand, 2),
+                '_stand': tag_stand,
+                'Tiefststand': tiefst[nr],
+                'Höchststand': hoechst[nr],
+                '_bewegung_stand': schluss[nr]
+            })
     
-    return df_bewegungen
+    return {
+        'bewegungen': sortiert,
+        'tage': tage,
+        'grenzen': grenzen.tolist(),
+        'tages_werte': tages_werte,
+        'belastung': belastung.tolist(),
+        'entlastung': entlastung.tolist(),
+        'stand': details[:, 2].tolist(),
+        'stand_erhoehung': details[starts, 0].tolist() if anzahl else []
+    }
 
-def calculate_daily_summary(bewegungen_df, startbuergschaft):
-    """Berechnet Tagessummen und fortlaufenden Bürgschaftsstand"""
+def calculate_saldo(bewegungen, startbuergschaft, params, stand=None, profiler=None, details_verzeichnis=None):
+    """Saldo-Engine mit Tages-Checkpoints: Tage vor der ersten Änderung werden aus dem letzten Stand übernommen.
+    bewegungen ist die Bewegungstabelle oder der Bewegungs-Speicher (write_bewegungs_speicher), der blockweise gelesen wird.
+    Die Bewegungsdetails liegen als Blöcke in details_verzeichnis; der Stand enthält nur Tages-Checkpoints und Blockverweise"""
     startbuergschaft = float(startbuergschaft)
-    daily_summary = {}
-    
-    bewegungen_df['Belastung'] = pd.to_numeric(bewegungen_df['Belastung'], errors='coerce').fillna(0)
-    bewegungen_df['Entlastung'] = pd.to_numeric(bewegungen_df['Entlastung'], errors='coerce').fillna(0)
+    im_speicher = isinstance(bewegungen, pd.DataFrame)
+    
+    if im_speicher:
+        bewegungen['Belastung'] = pd.to_numeric(bewegungen['Belastung'], errors='coerce').fillna(0)
+        bewegungen['Entlastung'] = pd.to_numeric(bewegungen['Entlastung'], errors='coerce').fillna(0)
+    
+    param_hash = build_stage_key(SALDO_VERSION, {name: params[name] for name in SALDO_PARAMETER})
+    tages_hashes = {}
+    for block in iter_bewegungs_bloecke(bewegungen):
+        tages_hashes.update(build_tages_hashes(block))
+    alle_tage = list(tages_hashes)
+    
+    gueltig = stand and stand.get('param_hash') == param_hash and is_details_vorhanden(details_verzeichnis, stand['details'])
+    alt = stand['tage'] if gueltig else {}
+    geaendert = [datum for datum in alle_tage if datum not in alt or alt[datum]['hash'] != tages_hashes[datum]]
+    geaendert += [datum for datum in alt if datum not in tages_hashes]
+    ab_datum = min(geaendert) if geaendert else None
+    
+    # Checkpoints aller Tage vor der ersten Änderung bleiben gültig
+    tage = {datum: alt[datum] for datum in alle_tage if ab_datum is None or datum < ab_datum}
+    neue_tage = [datum for datum in alle_tage if datum not in tage]
+    letzter = tage[next(reversed(tage))] if tage else None
+    
+    if letzter:
+        letzter_tag = [datum for datum in tage if datum < ab_datum][-1] if ab_datum else alle_tage[-1]
+        details_bloecke = take_details_bloecke(details_verzeichnis, stand['details'], letzter['_details_ende'])
+        details_zeilen = []
+        tag_stand, bewegung_stand, details_stand = letzter['_stand'], letzter['_bewegung_stand'], float(letzter['_details_stand'])
+    else:
+        letzter_tag = None
+        details_bloecke = []
+        details_zeilen = [{
+            'Datum': None,
+            'ATB-Nummer': 'START',
+            'Referenznummer': '',
+            'SUMA-Position': '',
+            'Pos': '',
+            'Belastung': 0,
+            'Entlastung': 0,
+            'Netto-Belastung': 0,
+            'Bürgschaftsstand': startbuergschaft
+        }]
+        tag_stand = bewegung_stand = details_stand = startbuergschaft
+    bloecke_zeilen = sum(block['zeilen'] for block in details_bloecke)
+    daily_summary = {
+        datum: {key: tag[key] for key in ['Belastung', 'Entlastung', 'Netto', 'Bürgschaftsstand']}
+        for datum, tag in tage.items()
+    }
     
-    unique_dates = sorted(bewegungen_df['Datum'].unique())
+    anzahl_neu = 0
+    with profil_span(profiler, 'Saldo › Ledger und Bewegungsdetails') as messung:
+        # Blöcke ganzer Tage: Ledger und Detailzeilen je Block, Stände und letzter Tag werden weitergereicht
+        for block in (iter_bewegungs_bloecke(bewegungen, min(neue_tage)) if neue_tage else []):
+            neu_df = block[block['Datum'].isin(neue_tage)] if letzter else block
+            if neu_df.empty:
+                continue
+            anzahl_neu += len(neu_df)
+            
+            ledger = build_saldo_ledger(neu_df, params, tag_stand, bewegung_stand, details_stand)
+            for datum, werte in zip(ledger['tage'], ledger['tages_werte']):
+                tage[datum] = {'hash': tages_hashes[datum], **werte}
+                daily_summary[datum] = {key: werte[key] for key in ['Belastung', 'Entlastung', 'Netto', 'Bürgschaftsstand']}
+            
+            details_zeilen += create_bewegungsdetails_rows(
+                ledger, daily_summary, tage, params, bloecke_zeilen + len(details_zeilen), letzter_tag
+            )
+            letzter_tag = ledger['tage'][-1]
+            tag_letzt = tage[letzter_tag]
+            tag_stand, bewegung_stand, details_stand = tag_letzt['_stand'], tag_letzt['_bewegung_stand'], tag_letzt['_details_stand']
+            
+            if not im_speicher:
+                # Bewegungs-Speicher: Detailzeilen je Block sofort ablegen, damit nur ein Block als Zeilenliste vorliegt
+                details_bloecke.append(save_details_block(details_verzeichnis, pd.DataFrame(details_zeilen)))
+                bloecke_zeilen += len(details_zeilen)
+                details_zeilen = []
+        messung['zeilen'] = anzahl_neu
+    
+    with profil_span(profiler, 'Saldo › Sheet Bewegungsdetails', anzahl_neu):
+        if letzter_tag is not None and letzter_tag in daily_summary:
+            details_zeilen.append(build_tagessumme_zeile(letzter_tag, daily_summary[letzter_tag]))
+        neu_df = pd.DataFrame(details_zeilen)
+        if details_zeilen:
+            details_bloecke.append(save_details_block(details_verzeichnis, neu_df))
+        
+        # Tabelle im Speicher: Sheet vollständig für den Export; Bewegungs-Speicher: der Export liest die Blöcke
+        bewegungsdetails_df = None
+        if im_speicher:
+            teile = [load_details_block(details_verzeichnis, block) for block in details_bloecke[:-1 if details_zeilen else None]]
+            teile += [neu_df] if details_zeilen else []
+            bewegungsdetails_df = teile[0] if len(teile) == 1 else pd.concat(teile, ignore_index=True)
+    
+    with profil_span(profiler, 'Saldo › Sheet Tageszusammenfassung', len(tage)):
+        tageszusammenfassung_df = create_tageszusammenfassung_df_mit_extrema(tage, startbuergschaft, params)
     
-    for datum in unique_dates:
-        tages_data = bewegungen_df[bewegungen_df['Datum'] == datum]
-        
-        belastung_summe = float(tages_data['Belastung'].sum())
-        entlastung_summe = float(tages_data['Entlastung'].sum())
-        
-        if (st.session_state.get('buergschaft_erhöhung_aktiv', False) and 
-            datum == st.session_state.get('buergschaft_erhöhung_datum', date(2025, 2, 4))):
-            entlastung_summe += st.session_state.get('buergschaft_erhöhung_betrag', 1500000.0)
-        
-        daily_summary[datum] = {
-            'Belastung': round(belastung_summe, 2),
-            'Entlastung': round(entlastung_summe, 2),
-            'Netto': round(entlastung_summe - belastung_summe, 2)
+    return {
+        'daily_summary': daily_summary,
+        'bewegungsdetails_df': bewegungsdetails_df,
+        'bewegungsdetails': {
+            'verzeichnis': details_verzeichnis,
+            'bloecke': details_bloecke,
+            'zeilen': sum(block['zeilen'] for block in details_bloecke)
+        },
+        'tageszusammenfassung_df': tageszusammenfassung_df,
+        'ab_datum': ab_datum,
+        'tage_uebernommen': len(alle_tage) - len(neue_tage),
+        'tage_gesamt': len(alle_tage),
+        'stand': {
+            'version': SALDO_VERSION,
+            'param_hash': param_hash,
+            'tage': tage,
+            'details': details_bloecke
         }
-    
-    laufender_stand = startbuergschaft
-    for datum in unique_dates:
-        laufender_stand = laufender_stand - daily_summary[datum]['Belastung'] + daily_summary[datum]['Entlastung']
-        daily_summary[datum]['Bürgschaftsstand'] = round(laufender_stand, 2)
-    
-    return daily_summary
+    }
+
 
-def add_tagessummen_to_ziel(df_ziel, daily_summary):
+def add_tagessummen_to_ziel(df_ziel, daily_summary, params, schluessel=None):
     """Fügt Tagessummen zur Zieldatei hinzu - in der letzten Zeile des Tages"""
-    df_ziel = prepare_dataframe_for_sorting(df_ziel)
-    df_sorted = df_ziel.sort_values(['_gestell_date', 'ATB-Nummer', '_suma_pos_numeric']).copy()
+    if schluessel is None:
+        schluessel = build_sortier_schluessel(df_ziel)
+    reihenfolge = get_standard_reihenfolge(schluessel)
+    df_sorted = df_ziel.take(reihenfolge)
     
     df_sorted[''] = ''
     df_sorted['Belastung'] = ''
@@ -1699,16 +3338,20 @@ def add_tagessummen_to_ziel(df_ziel, daily_summary):
     df_sorted['Netto-Belastung'] = ''
     df_sorted['Bürgschaftsstand'] = ''
     
+    # Letzte Zeile je Gestellungstag (Zeilen ohne Datum haben den höchsten Code und stehen am Ende)
+    tage = schluessel['tag'][reihenfolge]
+    letzte = np.flatnonzero(np.append(tage[1:] != tage[:-1], True)) if len(tage) else []
+    letzte_zeile = {
+        schluessel['tag_werte'][tage[pos]]: df_sorted.index[pos]
+        for pos in letzte if tage[pos] < len(schluessel['tag_werte'])
+    }
+    
     for datum in daily_summary.keys():
-        mask = df_sorted['_gestell_date'] == datum
-        tag_indices = df_sorted[mask].index
+        last_idx = letzte_zeile.get(pd.Timestamp(datum))
         
-        if len(tag_indices) > 0:
-            last_idx = tag_indices[-1]
-            
-            if (st.session_state.get('buergschaft_erhöhung_aktiv', False) and 
-                datum == st.session_state.get('buergschaft_erhöhung_datum', date(2025, 2, 4))):
-                betrag = st.session_state.get('buergschaft_erhöhung_betrag', 1500000.0)
+        if last_idx is not None:
+            if is_erhoehung_tag(datum, params):
+                betrag = params['buergschaft_erhöhung_betrag']
                 df_sorted.loc[last_idx, ''] = f'TAGESSALDO {datum.strftime("%d.%m.%Y")} (Bürgschaft +{betrag/1000000:.1f} Mio)'
             else:
                 df_sorted.loc[last_idx, ''] = f'TAGESSALDO {datum.strftime("%d.%m.%Y")}'
@@ -1718,49 +3361,34 @@ def add_tagessummen_to_ziel(df_ziel, daily_summary):
             df_sorted.loc[last_idx, 'Netto-Belastung'] = daily_summary[datum]['Netto']
             df_sorted.loc[last_idx, 'Bürgschaftsstand'] = daily_summary[datum]['Bürgschaftsstand']
     
-    columns_to_drop = ['_gestell_date', '_suma_pos_numeric']
-    columns_to_drop = [col for col in columns_to_drop if col in df_sorted.columns]
-    if columns_to_drop:
-        df_sorted = df_sorted.drop(columns=columns_to_drop)
-    
     return df_sorted
 
-def create_bewegungsdetails_df(bewegungen_df, daily_summary, startbuergschaft):
-    """Erstellt die Bewegungsdetails-Tabelle mit Tagessummen"""
-    bewegungen_df['_suma_pos_numeric'] = bewegungen_df['SUMA-Position'].apply(
-        lambda x: float(x) if isinstance(x, (int, float)) or (isinstance(x, str) and x.replace('.','').isdigit()) else 999999
-    )
-    
-    bewegungen_sorted = bewegungen_df.sort_values(['Datum', 'Bewegungsart', 'ATB-Nummer', '_suma_pos_numeric'], 
-                                                  ascending=[True, False, True, True]).copy()
-    bewegungen_sorted = bewegungen_sorted.drop(columns=['_suma_pos_numeric'])
-    
-    result_rows = []
-    
-    result_rows.append({
-        'Datum': None,
-        'ATB-Nummer': 'START',
+def build_tagessumme_zeile(datum, tag):
+    """TAGESSUMME-Zeile der Bewegungsdetails"""
+    return {
+        'Datum': datum,
+        'ATB-Nummer': 'TAGESSUMME',
         'Referenznummer': '',
         'SUMA-Position': '',
         'Pos': '',
-        'Belastung': 0,
-        'Entlastung': 0,
-        'Netto-Belastung': 0,
-        'Bürgschaftsstand': startbuergschaft
-    })
-    
-    laufender_stand = float(startbuergschaft)
-    current_date = None
-    
-    for idx, row in bewegungen_sorted.iterrows():
-        datum_obj = row['Datum']
-        
-        if (current_date != datum_obj and 
-            datum_obj == st.session_state.get('buergschaft_erhöhung_datum', date(2025, 2, 4)) and
-            st.session_state.get('buergschaft_erhöhung_aktiv', False)):
-            
-            laufender_stand += st.session_state.get('buergschaft_erhöhung_betrag', 1500000.0)
-            
+        'Belastung': tag['Belastung'],
+        'Entlastung': tag['Entlastung'],
+        'Netto-Belastung': tag['Belastung'] - tag['Entlastung'],
+        'Bürgschaftsstand': tag['Bürgschaftsstand']
+    }
+
+def create_bewegungsdetails_rows(ledger, daily_summary, tage, params, zeilen_offset, current_date):
+    """Zeilen der Bewegungsdetails aus dem Ledger ab einem Checkpoint (Tag der letzten übernommenen Bewegung), ohne Schluss-TAGESSUMME"""
+    result_rows = []
+    bewegungen = ledger['bewegungen']
+    atb_nummern = bewegungen['ATB-Nummer'].tolist()
+    referenzen = bewegungen['Referenznummer'].tolist()
+    suma_positionen = bewegungen['SUMA-Position'].tolist() if 'SUMA-Position' in bewegungen.columns else [''] * len(bewegungen)
+    positionen = bewegungen['Pos'].tolist()
+    grenzen = ledger['grenzen']
+    
+    for nr, datum_obj in enumerate(ledger['tage']):
+        if current_date != datum_obj and is_erhoehung_tag(datum_obj, params):
             result_rows.append({
                 'Datum': datum_obj,
                 'ATB-Nummer': 'BÜRGSCHAFTSERHÖHUNG',
@@ -1768,72 +3396,47 @@ def create_bewegungsdetails_df(bewegungen_df, daily_summary, startbuergschaft):
                 'SUMA-Position': '',
                 'Pos': '',
                 'Belastung': '',
-                'Entlastung': st.session_state.get('buergschaft_erhöhung_betrag', 1500000.0),
+                'Entlastung': params['buergschaft_erhöhung_betrag'],
                 'Netto-Belastung': '',
-                'Bürgschaftsstand': round(laufender_stand, 2)
+                'Bürgschaftsstand': round(ledger['stand_erhoehung'][nr], 2)
             })
         
-        if current_date is not None and datum_obj != current_date:
-            if current_date in daily_summary:
-                result_rows.append({
-                    'Datum': current_date,
-                    'ATB-Nummer': 'TAGESSUMME',
-                    'Referenznummer': '',
-                    'SUMA-Position': '',
-                    'Pos': '',
-                    'Belastung': daily_summary[current_date]['Belastung'],
-                    'Entlastung': daily_summary[current_date]['Entlastung'],
-                    'Netto-Belastung': daily_summary[current_date]['Belastung'] - daily_summary[current_date]['Entlastung'],
-                    'Bürgschaftsstand': daily_summary[current_date]['Bürgschaftsstand']
-                })
-                
-                result_rows.append({
-                    'Datum': None,
-                    'ATB-Nummer': '',
-                    'Referenznummer': '',
-                    'SUMA-Position': '',
-                    'Pos': '',
-                    'Belastung': '',
-                    'Entlastung': '',
-                    'Netto-Belastung': '',
-                    'Bürgschaftsstand': ''
-                })
-        
-        belastung_wert = float(row['Belastung'])
-        entlastung_wert = float(row['Entlastung'])
-        
-        laufender_stand = laufender_stand - belastung_wert + entlastung_wert
+        if current_date is not None and datum_obj != current_date and current_date in daily_summary:
+            result_rows.append(build_tagessumme_zeile(current_date, daily_summary[current_date]))
+            result_rows.append({
+                'Datum': None,
+                'ATB-Nummer': '',
+                'Referenznummer': '',
+                'SUMA-Position': '',
+                'Pos': '',
+                'Belastung': '',
+                'Entlastung': '',
+                'Netto-Belastung': '',
+                'Bürgschaftsstand': ''
+            })
         
-        result_rows.append({
-            'Datum': datum_obj,
-            'ATB-Nummer': row['ATB-Nummer'],
-            'Referenznummer': row['Referenznummer'],
-            'SUMA-Position': row.get('SUMA-Position', ''),
-            'Pos': row['Pos'] if pd.notna(row['Pos']) else '',
-            'Belastung': belastung_wert if belastung_wert > 0 else '',
-            'Entlastung': entlastung_wert if entlastung_wert > 0 else '',
-            'Netto-Belastung': '',
-            'Bürgschaftsstand': round(laufender_stand, 2)
-        })
+        for i in range(grenzen[nr], grenzen[nr + 1]):
+            belastung_wert = ledger['belastung'][i]
+            entlastung_wert = ledger['entlastung'][i]
+            result_rows.append({
+                'Datum': datum_obj,
+                'ATB-Nummer': atb_nummern[i],
+                'Referenznummer': referenzen[i],
+                'SUMA-Position': suma_positionen[i],
+                'Pos': positionen[i] if pd.notna(positionen[i]) else '',
+                'Belastung': belastung_wert if belastung_wert > 0 else '',
+                'Entlastung': entlastung_wert if entlastung_wert > 0 else '',
+                'Netto-Belastung': '',
+                'Bürgschaftsstand': round(ledger['stand'][i], 2)
+            })
         
         current_date = datum_obj
+        tage[datum_obj]['_details_stand'] = ledger['stand'][grenzen[nr + 1] - 1]
+        tage[datum_obj]['_details_ende'] = zeilen_offset + len(result_rows)
     
-    if current_date is not None and current_date in daily_summary:
-        result_rows.append({
-            'Datum': current_date,
-            'ATB-Nummer': 'TAGESSUMME',
-            'Referenznummer': '',
-            'SUMA-Position': '',
-            'Pos': '',
-            'Belastung': daily_summary[current_date]['Belastung'],
-            'Entlastung': daily_summary[current_date]['Entlastung'],
-            'Netto-Belastung': daily_summary[current_date]['Belastung'] - daily_summary[current_date]['Entlastung'],
-            'Bürgschaftsstand': daily_summary[current_date]['Bürgschaftsstand']
-        })
-    
-    return pd.DataFrame(result_rows)
+    return result_rows
 
-def create_tageszusammenfassung_df_mit_extrema(bewegungen_df, daily_summary, startbuergschaft):
+def create_tageszusammenfassung_df_mit_extrema(tage, startbuergschaft, params):
     """Erstellt eine kompakte Tagesübersicht mit Tagessummen und Höchst-/Tiefstständen"""
     result_rows = []
     
@@ -1849,41 +3452,19 @@ def create_tageszusammenfassung_df_mit_extrema(bewegungen_df, daily_summary, sta
         'Hinweis': ''
     })
     
-    bewegungen_df['_suma_pos_numeric'] = bewegungen_df['SUMA-Position'].apply(
-        lambda x: float(x) if isinstance(x, (int, float)) or (isinstance(x, str) and x.replace('.','').isdigit()) else 999999
-    )
-    
-    bewegungen_sorted = bewegungen_df.sort_values(['Datum', 'Bewegungsart', 'ATB-Nummer', '_suma_pos_numeric'], 
-                                                  ascending=[True, False, True, True]).copy()
-    bewegungen_sorted = bewegungen_sorted.drop(columns=['_suma_pos_numeric'])
-    
-    laufender_stand = float(startbuergschaft)
-    sorted_dates = sorted(daily_summary.keys())
+    # Tiefst-/Höchststände kommen aus den Tages-Checkpoints der Saldo-Engine
+    sorted_dates = list(tage.keys())
     
     for datum in sorted_dates:
-        tages_bewegungen = bewegungen_sorted[bewegungen_sorted['Datum'] == datum]
-        tages_data = daily_summary[datum]
-        
-        tagesstart_stand = laufender_stand
-        tiefststand = tagesstart_stand
-        hoechststand = tagesstart_stand
-        
-        for _, bewegung in tages_bewegungen.iterrows():
-            laufender_stand = laufender_stand - float(bewegung['Belastung']) + float(bewegung['Entlastung'])
-            tiefststand = min(tiefststand, laufender_stand)
-            hoechststand = max(hoechststand, laufender_stand)
-        
-        if (st.session_state.get('buergschaft_erhöhung_aktiv', False) and 
-            datum == st.session_state.get('buergschaft_erhöhung_datum', date(2025, 2, 4))):
-            laufender_stand += st.session_state.get('buergschaft_erhöhung_betrag', 1500000.0)
-            hoechststand = max(hoechststand, laufender_stand)
+        tages_data = tage[datum]
+        tiefststand = tages_data['Tiefststand']
+        hoechststand = tages_data['Höchststand']
         
         max_auslastung = 0 if startbuergschaft == 0 else ((startbuergschaft - tiefststand) / startbuergschaft * 100)
         
         hinweis = ''
-        if (st.session_state.get('buergschaft_erhöhung_aktiv', False) and 
-            datum == st.session_state.get('buergschaft_erhöhung_datum', date(2025, 2, 4))):
-            betrag = st.session_state.get('buergschaft_erhöhung_betrag', 1500000.0)
+        if is_erhoehung_tag(datum, params):
+            betrag = params['buergschaft_erhöhung_betrag']
             hinweis = f'Bürgschaftserhöhung +{betrag:,.0f} €'
         
         result_rows.append({
@@ -1898,10 +3479,10 @@ def create_tageszusammenfassung_df_mit_extrema(bewegungen_df, daily_summary, sta
             'Hinweis': hinweis
         })
     
-    if len(daily_summary) > 0:
-        total_belastung = sum(daily_summary[d]['Belastung'] for d in daily_summary)
-        total_entlastung = sum(daily_summary[d]['Entlastung'] for d in daily_summary)
-        final_stand = daily_summary[sorted_dates[-1]]['Bürgschaftsstand']
+    if len(tage) > 0:
+        total_belastung = sum(tage[d]['Belastung'] for d in tage)
+        total_entlastung = sum(tage[d]['Entlastung'] for d in tage)
+        final_stand = tage[sorted_dates[-1]]['Bürgschaftsstand']
         
         alle_tiefstwerte = [row['Tiefststand'] for row in result_rows[1:] if isinstance(row['Tiefststand'], (int, float))]
         alle_hoechstwerte = [row['Höchststand'] for row in result_rows[1:] if isinstance(row['Höchststand'], (int, float))]
@@ -1938,23 +3519,44 @@ def create_tageszusammenfassung_df_mit_extrema(bewegungen_df, daily_summary, sta
 
 # === NCAR-ENHANCEMENT FUNKTIONEN ===
 
-def enhance_ziel_with_ncar(ziel_df, ncar_df):
-    """Erweitert Zieldatei um NCAR-Daten - vereinfachte Logik"""
-    ziel_df['_atb_clean'] = ziel_df['ATB-Nummer'].astype(str).str.strip()
-    ncar_df['_atb_clean'] = ncar_df['Registriernr.-SumA'].astype(str).str.strip()
-    
-    enhanced = ziel_df.merge(
-        ncar_df[['_atb_clean', 'RegistriernNr./MRN', 'Anzahl Packstücke']],
-        on='_atb_clean',
-        how='left'
-    )
-    
-    enhanced['MRN-Nummer Eingang'] = enhanced['RegistriernNr./MRN'].fillna(enhanced['MRN-Nummer Eingang'])
-    enhanced['Menge'] = enhanced['Anzahl Packstücke'].fillna(enhanced['Menge'])
-    
-    enhanced = enhanced.drop(columns=['_atb_clean', 'RegistriernNr./MRN', 'Anzahl Packstücke'])
+NCAR_SCHLUESSEL = 'Registriernr.-SumA'
+
+def build_ncar_index(ncar_df):
+    """Schlüsselindex der NCAR-Datei nach ATB (bereinigt); bei doppelter ATB gilt die erste Zeile der Datei"""
+    schluessel = ncar_df[NCAR_SCHLUESSEL].astype(str).str.strip()
+    doppelt = schluessel.duplicated(keep='first').to_numpy()
+    erste = ~doppelt
+    return {
+        'schluessel': pd.Index(schluessel.to_numpy()[erste]),
+        'mrn': ncar_df['RegistriernNr./MRN'][erste].reset_index(drop=True),
+        'packstuecke': ncar_df['Anzahl Packstücke'][erste].reset_index(drop=True),
+        # Zeilen je ATB, um vermiedene Vervielfachungen im Protokoll auszuweisen
+        'anzahl': schluessel.value_counts(sort=False).reindex(schluessel.to_numpy()[erste]).to_numpy(),
+        'zeilen': len(ncar_df),
+        'duplikate': int(doppelt.sum()),
+        'duplikat_atbs': int(schluessel[doppelt].nunique())
+    }
+
+def enhance_ziel_with_ncar(ziel_df, ncar_index):
+    """Erweitert Zieldatei um NCAR-Daten über den ATB-Index - je Zielzeile höchstens ein NCAR-Treffer, Eingaben bleiben unverändert"""
+    atb = ziel_df['ATB-Nummer'].astype(str).str.strip()
+    positionen = ncar_index['schluessel'].get_indexer(atb)
+    treffer = positionen >= 0
+    
+    # Positionen ohne Treffer (-1) liefern beim reindex NaN - wie ein Left-Join ohne Partner
+    enhanced = ziel_df.reset_index(drop=True)
+    mrn = ncar_index['mrn'].reindex(positionen).reset_index(drop=True)
+    packstuecke = ncar_index['packstuecke'].reindex(positionen).reset_index(drop=True)
+    enhanced = enhanced.assign(**{
+        'MRN-Nummer Eingang': mrn.fillna(enhanced['MRN-Nummer Eingang']),
+        'Menge': packstuecke.fillna(enhanced['Menge'])
+    })
     
-    return enhanced
+    bericht = {
+        'treffer': int(treffer.sum()),
+        'vervielfachung_vermieden': int((ncar_index['anzahl'][positionen[treffer]] - 1).sum())
+    }
+    return enhanced, bericht
 
 def process_ncar_file(ncar_file):
     """Verarbeitet NCAR-Datei und validiert Struktur"""
@@ -2124,6 +3726,99 @@ def create_personalized_documentation():
         st.error(f"Fehler bei Dokumentenerstellung: {e}")
         return None
 
+# === PROFILING ===
+
+def get_max_rss_mb():
+    """Höchster Arbeitsspeicher (RSS) des Prozesses bisher in MB - None wenn nicht verfügbar"""
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux meldet KB, macOS Bytes
+    return max_rss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+@contextmanager
+def profil_span(profiler, name, zeilen=None):
+    """Misst Wand- und CPU-Zeit, Zeilen und RSS-Zuwachs einer Stufe und legt sie unter name im Profiler ab"""
+    messung = {'zeilen': zeilen, 'cache': False, 'wand_s': 0.0, 'cpu_s': 0.0, 'rss_delta_mb': None}
+    if profiler is None:
+        yield messung
+        return
+    
+    # Eintrag beim Start anlegen, damit Stufen vor ihren Teilschritten stehen
+    profiler[name] = messung
+    rss_vorher = get_max_rss_mb()
+    wand_start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        yield messung
+    finally:
+        rss_nachher = get_max_rss_mb()
+        messung.update({
+            'wand_s': time.perf_counter() - wand_start,
+            'cpu_s': time.process_time() - cpu_start,
+            'rss_delta_mb': None if rss_vorher is None else rss_nachher - rss_vorher
+        })
+
+def create_profil_df(profiler):
+    """Laufzeitprotokoll als Tabelle für UI und Historie"""
+    profil_df = pd.DataFrame([
+        {
+            'Stufe': name,
+            'Zeilen': messung['zeilen'],
+            'Wandzeit (s)': round(messung['wand_s'], 3),
+            'CPU-Zeit (s)': round(messung['cpu_s'], 3),
+            'RSS-Zuwachs (MB)': None if messung['rss_delta_mb'] is None else round(messung['rss_delta_mb'], 1),
+            'Quelle': 'Cache' if messung['cache'] else 'berechnet'
+        }
+        for name, messung in profiler.items()
+    ])
+    profil_df['Zeilen'] = profil_df['Zeilen'].astype('Int64')
+    return profil_df
+
+def display_laufzeitprotokoll(profiler):
+    """Zeigt die gemessenen Stufen-Laufzeiten im Verarbeitungsprotokoll"""
+    if not profiler:
+        return
+    
+    st.markdown("**⏱️ Laufzeiten je Stufe**")
+    st.dataframe(create_profil_df(profiler), hide_index=True, use_container_width=True)
+    gesamt = sum(messung['wand_s'] for name, messung in profiler.items() if '›' not in name and not name.startswith('Ingest'))
+    st.caption(f"Verarbeitung gesamt: {gesamt:.2f} s - Teilschritte (›) sind in ihrer Stufe enthalten, Ingest = Einlesen beim Upload")
+
+# === STUFEN-CACHE ===
+
+MATCH_PARAMETER = ['wids_aggregation']
+PREIS_PARAMETER = ['pauschalbetrag', 'zollsatz_ersatz', 'zollsatz_null_ersetzen', 'eust_satz', 'verwahrungsfrist_tage']
+SALDO_PARAMETER = ['startbuergschaft', 'buergschaft_erhöhung_aktiv', 'buergschaft_erhöhung_datum', 'buergschaft_erhöhung_betrag']
+
+def dataframe_fingerprint(df, columns=None) -> str:
+    """Inhalts-Fingerprint eines DataFrames (Spalten + Werte) als Cache-Schlüssel"""
+    if df is None or (isinstance(df, pd.DataFrame) and df.empty):
+        return 'leer'
+    if columns is not None:
+        df = df[[col for col in columns if col in df.columns]]
+    
+    fingerprint = hashlib.sha256()
+    fingerprint.update(json.dumps([str(col) for col in df.columns]).encode('utf-8'))
+    fingerprint.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+    return fingerprint.hexdigest()
+
+def build_stage_key(*parts) -> str:
+    """Erzeugt den Schlüssel einer Verarbeitungsstufe aus Vorgänger-Schlüssel, Fingerprints und Parametern"""
+    return hashlib.sha256(
+        json.dumps(parts, sort_keys=True, default=str).encode('utf-8')
+    ).hexdigest()
+
+def run_cached_stage(cache, stage, key, berechnung):
+    """Liefert das Ergebnis einer Stufe aus dem Cache oder berechnet es neu (ein Eintrag je Stufe)"""
+    if cache is not None and stage in cache and cache[stage][0] == key:
+        return cache[stage][1], True
+    
+    ergebnis = berechnung()
+    if cache is not None:
+        cache[stage] = (key, ergebnis)
+    return ergebnis, False
+
 # === HAUPTVERARBEITUNG ===
 
 def update_progress(progress_bar, current, total, prefix="", suffix=""):
@@ -2140,154 +3835,261 @@ def update_progress(progress_bar, current, total, prefix="", suffix=""):
     
     progress_bar.progress(percentage, text=text)
 
+def create_fortschritt(progress_bar, von, bis):
+    """Fortschritts-Callback für einen Abschnitt (von-bis Prozent) mit gedrosselten UI-Updates"""
+    letztes_update = [0.0]
+    
+    def fortschritt(current, total, prefix="", suffix=""):
+        jetzt = time.perf_counter()
+        if current < total and jetzt - letztes_update[0] < FORTSCHRITT_INTERVALL_S:
+            return
+        letztes_update[0] = jetzt
+        anteil = current / total if total else 1
+        update_progress(progress_bar, von + (bis - von) * anteil, 100, prefix, suffix)
+    
+    return fortschritt
+
+def normalize_inputs(df_leit, df_import_eza, df_import_zl, df_ncts):
+    """Stufe NORMALISIERUNG: Spaltenzuordnung ermitteln und MRN-Werte bereinigen"""
+    df_leit = df_leit.copy().reset_index(drop=True)
+    
+    # Schreibweisen einmal je Datei auflösen und auf kanonische Namen umbenennen
+    df_leit, leit_spalten = apply_spalten_schema(df_leit, 'leit')
+    
+    # Positionsindex (0..n-1), damit die Match-Tabelle Zeilen über iloc referenzieren kann
+    data_sources = {
+        'df_leit': df_leit,
+        'df_import_eza': df_import_eza.copy().reset_index(drop=True) if df_import_eza is not None else pd.DataFrame(),
+        'df_import_zl': df_import_zl.copy().reset_index(drop=True) if df_import_zl is not None else pd.DataFrame(),
+        'df_ncts': df_ncts.copy().reset_index(drop=True) if is_dataframe_valid(df_ncts) else pd.DataFrame()
+    }
+    
+    import_spalten = {}
+    for source, datei in [('df_import_eza', 'eza'), ('df_import_zl', 'zl'), ('df_ncts', 'ncts')]:
+        if data_sources[source].empty:
+            import_spalten[datei] = {feld['spalte']: None for feld in SPALTEN_SCHEMA[datei]}
+        else:
+            data_sources[source], import_spalten[datei] = apply_spalten_schema(data_sources[source], datei)
+    
+    field_mappings = {
+        'leit_col_weitere': leit_spalten['Weitere Registriernummer Folgeverfahren'],
+        'leit_col_reg': leit_spalten['Registriernummer Folgeverfahren'],
+        'anmeldeart_col': leit_spalten['Anmeldeart Folgeverfahren'],
+        'gestell_col': leit_spalten['Datum Überlassung - CUSTST'],
+        'import_eza_col': import_spalten['eza']['Registriernummer/MRN'],
+        'import_zl_col': import_spalten['zl']['Registriernummer/MRN'],
+        'pos_field_eza': import_spalten['eza']['PositionNo'],
+        'pos_field_zl': import_spalten['zl']['PositionNo'],
+        'ncts_mrn_col': import_spalten['ncts']['MRN'],
+        'suma_pos_col': leit_spalten['Position SumA']
+    }
+    
+    if not field_mappings['suma_pos_col']:
+        melde_warnung("⚠️ SUMA-Position-Spalte nicht gefunden. Verwende leeres Feld.")
+    
+    df_leit[field_mappings['leit_col_weitere']] = df_leit[field_mappings['leit_col_weitere']].apply(clean_mrn)
+    df_leit[field_mappings['leit_col_reg']] = df_leit[field_mappings['leit_col_reg']].apply(clean_mrn)
+    
+    for source, col in [('df_import_eza', 'import_eza_col'), ('df_import_zl', 'import_zl_col'), ('df_ncts', 'ncts_mrn_col')]:
+        if field_mappings[col] and not data_sources[source].empty:
+            data_sources[source][field_mappings[col]] = data_sources[source][field_mappings[col]].apply(clean_mrn)
+    
+    # Aufteilung nach Anmeldeart und ATB-Maske für alle Stufen (nach der MRN-Bereinigung)
+    data_sources['leit_partition'] = build_leit_partition(df_leit, field_mappings)
+    
+    # NCTS einmal vorbereiten: MRN-Index für das Matching, Sicherheitsbeträge für die Bepreisung
+    data_sources['ncts_index'] = build_ncts_index(data_sources['df_ncts'], field_mappings['ncts_mrn_col'])
+    data_sources['ncts_sicherheit'] = extract_sicherheitsbetraege(data_sources['df_ncts'])
+    
+    return df_leit, data_sources, field_mappings
+
+def collect_processing_inputs():
+    """Snapshot aller Eingaben eines Laufs aus der Session - der Lauf selbst greift nicht mehr auf st.session_state zu"""
+    df_ncar = None
+    if st.session_state.get('ncar_enabled', True) and st.session_state.get('df_ncar') is not None:
+        df_ncar = st.session_state['df_ncar']
+    
+    return {
+        'df_leit': st.session_state.df_leit,
+        'df_import_eza': st.session_state.df_import_eza,
+        'df_import_zl': st.session_state.df_import_zl,
+        'df_ncts': st.session_state.df_ncts if is_dataframe_valid(st.session_state.get('df_ncts')) else None,
+        'df_ncar': df_ncar,
+        'leit_stats': dict(st.session_state.stats),
+        'params': get_processing_params(),
+        'mandant_key': get_mandant_key(),
+        'delta_modus': st.session_state.get('delta_modus', False),
+        'cache': st.session_state.setdefault('pipeline_cache', {}),
+        'historie_basis': get_history_basis(),
+        # Laufzeitprotokoll: Einlesen beim Upload + alle Stufen dieses Laufs
+        'profiler': dict(st.session_state.get('ingest_profil', {}))
+    }
+
+def run_pipeline(eingaben, progress_callback=None, step_callback=None):
+    """Führt alle Stufen von der Normalisierung bis zum Excel-Export ohne UI aus (Vordergrund oder Hintergrund-Job)"""
+    fortschritt = progress_callback or (lambda current, total, prefix="", suffix="": None)
+    melde_schritt = step_callback or (lambda text: None)
+    
+    params = eingaben['params']
+    cache = eingaben['cache']
+    profiler = eingaben['profiler']
+    mandant_key = eingaben['mandant_key']
+    leit_stats = eingaben['leit_stats']
+    
+    fortschritt(0, 100, "📊 Initialisiere Datenverarbeitung...")
+    melde_schritt("✅ Datenverarbeitung initialisiert")
+    
+    # Stufe 1: Normalisierung - Schlüssel sind die Inhalte der Eingangsdateien
+    normalize_key = build_stage_key(
+        'normalize',
+        dataframe_fingerprint(eingaben['df_leit']),
+        dataframe_fingerprint(eingaben['df_import_eza']),
+        dataframe_fingerprint(eingaben['df_import_zl']),
+        dataframe_fingerprint(eingaben['df_ncts'])
+    )
+    with profil_span(profiler, 'Normalisierung', len(eingaben['df_leit'])) as messung:
+        (df_leit, data_sources, field_mappings), aus_cache = run_cached_stage(
+            cache, 'normalize', normalize_key,
+            lambda: normalize_inputs(
+                eingaben['df_leit'], eingaben['df_import_eza'], eingaben['df_import_zl'], eingaben['df_ncts']
+            )
+        )
+        messung['cache'] = aus_cache
+    
+    fortschritt(5, 100, "Bereite Daten vor")
+    melde_schritt("✅ Daten vorbereitet und MRN-Werte bereinigt" + (" (unverändert, aus Cache)" if aus_cache else ""))
+    
+    # Stufe 2: Matching - unabhängig von Pauschale, Zollsätzen und Bürgschaftsparametern
+    match_key = build_stage_key(normalize_key, leit_stats, {name: params[name] for name in MATCH_PARAMETER})
+    preis_key = build_stage_key(match_key, {name: params[name] for name in PREIS_PARAMETER})
+    match_fortschritt = lambda current, total, prefix="", suffix="": fortschritt(
+        5 + 80 * (current / total if total else 1), 100, prefix, suffix
+    )
+    delta_info = None
+    
+    if eingaben['delta_modus'] and mandant_key:
+        # Delta-Modus: Matching und Preise nur für neue/geänderte Zeilen gegenüber dem letzten Lauf
+        with profil_span(profiler, 'Delta', len(df_leit)) as messung:
+            (ziel_sorted, stats, delta_info), messung['cache'] = run_cached_stage(
+                cache, 'delta', preis_key,
+                lambda: run_delta_stage(
+                    df_leit, data_sources, field_mappings, leit_stats, params, mandant_key,
+                    progress_callback=match_fortschritt, step_callback=melde_schritt, profiler=profiler
+                )
+            )
+        fortschritt(88, 100, "Wende Geschäftsregeln an")
+    else:
+        with profil_span(profiler, 'Matching', len(df_leit)) as messung:
+            (match_table, stats), aus_cache = run_cached_stage(
+                cache, 'match', match_key,
+                lambda: run_match_stage(
+                    df_leit, data_sources, field_mappings, leit_stats, params, mandant_key,
+                    progress_callback=match_fortschritt, step_callback=melde_schritt, profiler=profiler
+                )
+            )
+            messung['cache'] = aus_cache
+        
+        if aus_cache:
+            melde_schritt(f"✅ Match-Tabelle aus Cache übernommen ({len(match_table)} Zeilen) - nur Preise und Saldo werden neu berechnet")
+        
+        fortschritt(88, 100, "Wende Geschäftsregeln an")
+        
+        # Stufe 3: Preise - Geschäftsregeln werden auf die Match-Tabelle angewendet
+        with profil_span(profiler, 'Preise', len(match_table)) as messung:
+            ziel_sorted, messung['cache'] = run_cached_stage(
+                cache, 'preis', preis_key,
+                lambda: calculate_results(match_table, df_leit, data_sources, field_mappings, params, profiler)
+            )
+    
+    melde_schritt("✅ Geschäftsregeln angewendet (Mindestabgaben, Pauschalen)")
+    
+    atb_ausschluss = build_atb_ausschluss(
+        df_leit, data_sources['leit_partition'], get_matching_arten(data_sources['leit_partition'], data_sources, leit_stats)
+    )
+    if not atb_ausschluss.empty:
+        melde_schritt(f"ℹ️ {len(atb_ausschluss)} Zeilen mit ATB in 'Weitere Registriernummer' ausgeschlossen (Reiter 'ATB-Ausschluss')")
+    
+    ergebnis = {
+        'ziel_sorted': ziel_sorted,
+        'stats': dict(stats),
+        'atb_ausschluss': atb_ausschluss,
+        'delta_info': delta_info,
+        'params': params,
+        'saldo': None,
+        'excel_file': None,
+        'profiler': profiler,
+        'historie_basis': eingaben['historie_basis']
+    }
+    
+    if ziel_sorted is not None:
+        melde_schritt(f"✅ Ergebnis erstellt: {len(ziel_sorted)} Zeilen")
+        
+        # Stufe 4 und 5: Bürgschaftssaldo und Excel-Export
+        fortschritt(92, 100, "💰 Bürgschaftssaldo wird berechnet...")
+        ergebnis['saldo'], ergebnis['excel_file'] = run_saldo_stage(
+            ziel_sorted, params, preis_key, eingaben['df_ncar'], mandant_key, cache, profiler, atb_ausschluss
+        )
+        melde_schritt("✅ Bürgschaftssaldo berechnet und Excel-Datei erstellt")
+    
+    fortschritt(100, 100, "✅ Verarbeitung abgeschlossen")
+    return ergebnis
+
+def apply_processing_result(ergebnis):
+    """Übernimmt ein fertiges Verarbeitungsergebnis in die Session und speichert es in der Historie"""
+    saldo = ergebnis['saldo']
+    
+    st.session_state['delta_info'] = ergebnis['delta_info']
+    st.session_state['atb_filtered_count'] = ergebnis['stats'].get('atb_skipped', 0)
+    st.session_state['atb_ausschluss'] = ergebnis.get('atb_ausschluss')
+    st.session_state['laufzeit_profil'] = ergebnis['profiler']
+    st.session_state['ziel_sorted'] = ergebnis['ziel_sorted']
+    st.session_state['processing_stats'] = ergebnis['stats']
+    st.session_state['results_available'] = True
+    
+    if saldo['max_auslastung'] is not None:
+        st.session_state['max_auslastung_str'] = f"{saldo['max_auslastung']:.2f} %".replace('.', ',')
+        st.session_state['tiefststand_str'] = format_currency(saldo['tiefststand'])
+        st.session_state['max_auslastung'] = f"{saldo['max_auslastung']:.1f}%"
+    
+    st.session_state['excel_file'] = ergebnis['excel_file']
+    
+    # HISTORIE-HOOK: Nach erfolgreicher Verarbeitung speichern
+    with profil_span(ergebnis['profiler'], 'Historie speichern'):
+        run_id = save_to_history(ergebnis['historie_basis'])
+    if run_id:
+        save_run_profil(run_id, ergebnis['profiler'])
+
+def show_processing_result(ergebnis):
+    """Übernimmt und zeigt das Ergebnis eines Laufs (Ergebnisse, Protokoll, Bürgschaftssaldo)"""
+    ziel_sorted = ergebnis['ziel_sorted']
+    if ziel_sorted is None:
+        st.warning("⚠️ Keine Daten zum Verarbeiten gefunden.")
+        return
+    
+    apply_processing_result(ergebnis)
+    
+    st.success(f"✅ Verarbeitung erfolgreich abgeschlossen! {len(ziel_sorted)} Zeilen erstellt.")
+    display_results(ziel_sorted, ergebnis['stats'], ergebnis['profiler'])
+    display_buergschaft(ergebnis['saldo'], ergebnis['params'], ergebnis.get('atb_ausschluss'))
+
 def process_data():
-    """Hauptverarbeitungsfunktion mit ATB-Filter und Error Handling"""
+    """Verarbeitung im Vordergrund (Script-Thread) mit ATB-Filter und Error Handling"""
     st.session_state['processing_active'] = True
     st.session_state['processing_error'] = None
     
     with st.expander("📋 Verarbeitungsdetails anzeigen", expanded=False):
         schritte_container = st.container()
     
-    with st.spinner("🔄 Verarbeitung wird vorbereitet..."):
-        time.sleep(0.5)
+    def melde_schritt(text):
+        with schritte_container:
+            st.success(text)
     
     try:
-        df_leit = st.session_state.df_leit.copy()
-        
-        data_sources = {
-            'df_leit': df_leit,
-            'df_import_eza': st.session_state.df_import_eza.copy() if st.session_state.df_import_eza is not None else pd.DataFrame(),
-            'df_import_zl': st.session_state.df_import_zl.copy() if st.session_state.df_import_zl is not None else pd.DataFrame(),
-            'df_ncts': st.session_state.df_ncts.copy() if is_dataframe_valid(st.session_state.get('df_ncts')) else pd.DataFrame()
-        }
-        
         progress_bar = st.progress(0, text="📊 Initialisiere Datenverarbeitung...")
+        ergebnis = run_pipeline(collect_processing_inputs(), create_fortschritt(progress_bar, 0, 100), melde_schritt)
         
-        with schritte_container:
-            st.success("✅ Datenverarbeitung initialisiert")
-        
-        # OPTIMIERUNG: Der try-except-Block wird durch die verbesserte find_col Funktion überflüssig.
-        field_mappings = {
-            'leit_col_weitere': find_col(df_leit, ['Weitere Registriernummer Folgeverfahren', 'Weitere Registriernummer']),
-            'leit_col_reg': find_col(df_leit, ['Registriernummer Folgeverfahren']),
-            'anmeldeart_col': find_col(df_leit, ['Anmeldeart Folgeverfahren']),
-            'gestell_col': find_col(df_leit, ['Datum Überlassung - CUSTST']),
-            'import_eza_col': find_col(data_sources['df_import_eza'], ['Registriernummer/MRN', 'Registriernummer / MRN', 'MRN'], required=not data_sources['df_import_eza'].empty) if not data_sources['df_import_eza'].empty else None,
-            'import_zl_col': find_col(data_sources['df_import_zl'], ['Registriernummer/MRN', 'Registriernummer / MRN', 'MRN', 'Registrienummer/MRN'], required=not data_sources['df_import_zl'].empty) if not data_sources['df_import_zl'].empty else None,
-            'pos_field_eza': find_col(data_sources['df_import_eza'], ['PositionNo'], required=not data_sources['df_import_eza'].empty) if not data_sources['df_import_eza'].empty else None,
-            'pos_field_zl': find_col(data_sources['df_import_zl'], ['PositionNo'], required=not data_sources['df_import_zl'].empty) if not data_sources['df_import_zl'].empty else None,
-            'ncts_mrn_col': 'MRN' if not data_sources['df_ncts'].empty and 'MRN' in data_sources['df_ncts'].columns else None,
-            'suma_pos_col': None
-        }
-        
-        suma_pos_candidates = ['Position SumA', 'Pos. SumA', 'PositionNo SumA', 'Position', 'Pos', 'PositionNo']
-        for candidate in suma_pos_candidates:
-            if candidate in df_leit.columns:
-                field_mappings['suma_pos_col'] = candidate
-                break
-        
-        if not field_mappings['suma_pos_col']:
-            st.warning("⚠️ SUMA-Position-Spalte nicht gefunden. Verwende leeres Feld.")
-        
-        update_progress(progress_bar, 5, 100, "Bereite Daten vor")
-        
-        with schritte_container:
-            st.success("✅ Daten vorbereitet und MRN-Werte bereinigt")
-        
-        df_leit[field_mappings['leit_col_weitere']] = df_leit[field_mappings['leit_col_weitere']].apply(clean_mrn)
-        df_leit[field_mappings['leit_col_reg']] = df_leit[field_mappings['leit_col_reg']].apply(clean_mrn)
-        
-        for source, col in [('df_import_eza', 'import_eza_col'), ('df_import_zl', 'import_zl_col'), ('df_ncts', 'ncts_mrn_col')]:
-            if field_mappings[col] and not data_sources[source].empty:
-                data_sources[source][field_mappings[col]] = data_sources[source][field_mappings[col]].apply(clean_mrn)
-        
-        stats = defaultdict(int)
-        
-        results = []
-        
-        total_steps = len(VERARBEITBARE_ARTEN) + len(PAUSCHALE_ARTEN)
-        
-        for i, anmeldeart in enumerate(VERARBEITBARE_ARTEN):
-            count = df_leit[field_mappings['anmeldeart_col']].eq(anmeldeart).sum()
-            
-            if count > 0:
-                update_progress(progress_bar, i + 1, total_steps, "Verarbeite", f"{anmeldeart}-Anmeldearten ({count} Zeilen)")
-                
-                if anmeldeart in ['IMDC', 'WIDS']:
-                    import_source = 'df_import_eza' if anmeldeart == 'IMDC' else 'df_import_zl'
-                    if not data_sources[import_source].empty:
-                        results.extend(process_anmeldeart_generic(
-                            anmeldeart, df_leit, data_sources, field_mappings, stats
-                        ))
-                        with schritte_container:
-                            st.success(f"✅ {anmeldeart}-Anmeldearten verarbeitet ({count} Zeilen)")
-                elif anmeldeart == 'IPDC':
-                    results.extend(process_anmeldeart_generic(
-                        anmeldeart, df_leit, data_sources, field_mappings, stats
-                    ))
-                    with schritte_container:
-                        st.success(f"✅ {anmeldeart}-Anmeldearten verarbeitet ({count} Zeilen)")
-                elif anmeldeart == 'NCDP' and not data_sources['df_ncts'].empty:
-                    results.extend(process_anmeldeart_generic(
-                        anmeldeart, df_leit, data_sources, field_mappings, stats
-                    ))
-                    with schritte_container:
-                        st.success(f"✅ {anmeldeart}-Anmeldearten verarbeitet ({count} Zeilen)")
-            else:
-                update_progress(progress_bar, i + 1, total_steps, "", f"Keine {anmeldeart}-Anmeldearten vorhanden")
-        
-        pauschale_map = {
-            '(leer)': None,
-            'APDC': 'APDC',
-            'AVDC': 'AVDC',
-            'NCAR': 'NCAR'
-        }
-        
-        for j, (anmeldeart_name, anmeldeart_filter) in enumerate(pauschale_map.items()):
-            count = st.session_state.stats.get(anmeldeart_name, 0)
-            if count > 0:
-                update_progress(progress_bar, len(VERARBEITBARE_ARTEN) + j + 1, total_steps, 
-                               "Verarbeite", f"{anmeldeart_name}-Anmeldearten ({count} Zeilen)")
-                results.extend(process_pauschale_anmeldeart(
-                    df_leit, field_mappings, stats, anmeldeart_filter, anmeldeart_name
-                ))
-                with schritte_container:
-                    st.success(f"✅ {anmeldeart_name}-Anmeldearten verarbeitet ({count} Zeilen)")
-            else:
-                update_progress(progress_bar, len(VERARBEITBARE_ARTEN) + j + 1, total_steps, 
-                               "", f"Keine {anmeldeart_name}-Anmeldearten vorhanden")
-        
-        update_progress(progress_bar, 95, 100, "Wende Geschäftsregeln an")
-        
-        st.session_state['atb_filtered_count'] = stats.get('atb_skipped', 0)
-        
-        results = apply_zoelle_rule(results)
-        
-        with schritte_container:
-            st.success("✅ Geschäftsregeln angewendet (Mindestabgaben, Pauschalen)")
-        
-        update_progress(progress_bar, 100, 100, "✅ Verarbeitung abgeschlossen")
-        time.sleep(0.5)
-        
-        if results:
-            ziel = pd.DataFrame(results)
-            ziel = prepare_dataframe_for_sorting(ziel)
-            ziel_sorted = sort_dataframe_standard(ziel).reset_index(drop=True)
-            
-            with schritte_container:
-                st.success(f"✅ Ergebnis erstellt: {len(ziel_sorted)} Zeilen")
-
-            st.session_state['ziel_sorted'] = ziel_sorted
-            st.session_state['processing_stats'] = dict(stats)
-            st.session_state['results_available'] = True
-            
-            st.success(f"✅ Verarbeitung erfolgreich abgeschlossen! {len(ziel_sorted)} Zeilen erstellt.")
-           
-            display_results(ziel_sorted, dict(stats))
-            
-            process_buergschaft(ziel_sorted)
-        else:
-            st.warning("⚠️ Keine Daten zum Verarbeiten gefunden.")
+        # Die Fortschrittsanzeige bleibt bis zum nächsten Rerun auf 100 % stehen (kein Warten im Script-Thread)
+        show_processing_result(ergebnis)
             
     except Exception as e:
         error_msg = f"{type(e).__name__}: {str(e)}"
@@ -2300,15 +4102,419 @@ def process_data():
     finally:
         st.session_state['processing_active'] = False
         
-        if 'progress_bar' in locals():
+        # Bei Erfolg bleibt die abgeschlossene Fortschrittsanzeige sichtbar, bei Fehlern wird sie entfernt
+        if 'progress_bar' in locals() and st.session_state.get('processing_error'):
             progress_bar.empty()
 
-        if 'results' in locals() and results and not st.session_state.get('processing_error'):
-            time.sleep(0.1)
+# === HINTERGRUND-JOBS ===
+
+# Worker-Prozesse, die der Server selbst startet (0 = Verarbeitung im Vordergrund wie bisher)
+JOB_WORKER_ANZAHL = int(os.environ.get('BUERGCONTROL_JOB_WORKER', '2'))
+# '1' = Worker laufen separat (python worker.py), der Server stellt Jobs nur in die Warteschlange
+JOB_WORKER_EXTERN = os.environ.get('BUERGCONTROL_WORKER_EXTERN', '0') == '1'
+JOB_VERSION = 1
+JOB_POLL_INTERVALL_S = 1.0
+JOB_HEARTBEAT_S = 10
+# Läuft ein Job ohne Lebenszeichen länger als das, gilt sein Worker als abgestürzt
+JOB_HEARTBEAT_TIMEOUT_S = 180
+# Worker behalten den Stufen-Cache der zuletzt verarbeiteten Mandanten
+JOB_CACHE_MANDANTEN = int(os.environ.get('BUERGCONTROL_JOB_CACHE_MANDANTEN', '2'))
+# Jobs eines Mandanten gehen an den Worker seines letzten Jobs (warmer Stufen-Cache);
+# ist dieser belegt, übernimmt nach dieser Wartezeit jeder freie Worker
+JOB_AFFINITAET_S = 30
+JOB_STATUS_TEXT = {
+    'wartend': '⏳ Wartend',
+    'laeuft': '🔄 Läuft',
+    'fertig': '✅ Fertig',
+    'fehler': '❌ Fehler',
+    'abgebrochen': '⏹️ Abgebrochen'
+}
+
+class JobAbgebrochen(Exception):
+    """Verarbeitung wurde vom Benutzer abgebrochen"""
+
+_job_kontext = threading.local()
+_worker_caches = {}
+
+def is_job_queue_active():
+    """Jobs laufen über die Warteschlange (eigene oder externe Worker-Prozesse)"""
+    return JOB_WORKER_ANZAHL > 0 or JOB_WORKER_EXTERN
+
+def jetzt_iso():
+    return datetime.now().isoformat(timespec='seconds')
+
+def melde_warnung(text):
+    """Zeigt eine Warnung an - im Hintergrund-Job wird sie gesammelt und bei der Übernahme angezeigt"""
+    job = getattr(_job_kontext, 'job', None)
+    if job is not None:
+        job['warnungen'].append(text)
+    else:
+        st.warning(text)
+
+def submit_job(eingaben, quelle='ui'):
+    """Stellt einen Verarbeitungslauf in die Warteschlange (Eingaben als Datei, Status in der DB)"""
+    job_id = uuid.uuid4().hex
+    mandant_key = eingaben['mandant_key']
+    
+    # Der Stufen-Cache der Session bleibt im Server-Prozess - der Worker nutzt seinen eigenen Cache des Mandanten (claim_next_job)
+    eingaben = {key: value for key, value in eingaben.items() if key != 'cache'}
+    save_mandant_stand(mandant_key, f'jobs/{job_id}_eingaben', {'version': JOB_VERSION, 'eingaben': eingaben})
+    
+    with db_verbindung() as conn:
+        conn.execute(
+            'INSERT INTO jobs (id, mandant, status, erstellt, zeilen, text, quelle) VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (job_id, mandant_key, 'wartend', jetzt_iso(), len(eingaben['df_leit']), "⏳ Wartet auf freien Worker...", quelle)
+        )
+    return job_id
+
+def claim_next_job(worker_name):
+    """Holt den nächsten wartenden Job - fair über Mandanten, pro Mandant höchstens ein laufender Job, bevorzugt auf dem Worker des letzten Jobs"""
+    grenze = (datetime.now() - timedelta(seconds=JOB_HEARTBEAT_TIMEOUT_S)).isoformat(timespec='seconds')
+    affinitaet_grenze = (datetime.now() - timedelta(seconds=JOB_AFFINITAET_S)).isoformat(timespec='seconds')
+    
+    with db_verbindung() as conn:
+        conn.execute('BEGIN IMMEDIATE')
+        conn.execute(
+            """UPDATE jobs SET status = 'fehler', beendet = ?, fehler = 'Worker ohne Lebenszeichen (abgestürzt oder beendet)'
+               WHERE status = 'laeuft' AND aktualisiert < ?""",
+            (jetzt_iso(), grenze)
+        )
+        # Lebenszeichen der Worker - ein belegter Worker meldet sich erst nach seinem Job wieder
+        conn.execute('DELETE FROM job_worker WHERE aktualisiert < ?', (grenze,))
+        conn.execute('INSERT OR REPLACE INTO job_worker (name, aktualisiert) VALUES (?, ?)', (worker_name, jetzt_iso()))
+        
+        # Mandant, dessen letzter Start am längsten zurückliegt, zuerst - innerhalb des Mandanten der älteste Job.
+        # Jobs eines Mandanten, dessen letzter Worker noch lebt, nimmt nur dieser (bis JOB_AFFINITAET_S gewartet wurde)
+        row = conn.execute(
+            """WITH letzter_worker AS (
+                   SELECT mandant, worker FROM jobs k
+                   WHERE worker IS NOT NULL
+                     AND gestartet = (SELECT MAX(gestartet) FROM jobs l WHERE l.mandant = k.mandant)
+               )
+               SELECT j.id, j.mandant FROM jobs j
+               LEFT JOIN letzter_worker w ON w.mandant = j.mandant
+               WHERE j.status = 'wartend'
+                 AND j.abbrechen = 0
+                 AND j.mandant NOT IN (SELECT mandant FROM jobs WHERE status = 'laeuft')
+                 AND (w.worker IS NULL OR w.worker = ? OR j.erstellt < ?
+                      OR w.worker NOT IN (SELECT name FROM job_worker))
+               ORDER BY COALESCE((SELECT MAX(gestartet) FROM jobs k WHERE k.mandant = j.mandant), '') ASC, j.erstellt ASC
+               LIMIT 1""",
+            (worker_name, affinitaet_grenze)
+        ).fetchone()
+        if row is None:
+            return None
+        
+        conn.execute(
+            "UPDATE jobs SET status = 'laeuft', gestartet = ?, aktualisiert = ?, worker = ?, text = ? WHERE id = ?",
+            (jetzt_iso(), jetzt_iso(), worker_name, "🔄 Verarbeitung gestartet", row['id'])
+        )
+    return {'id': row['id'], 'mandant': row['mandant']}
+
+def update_job(job_id, **felder):
+    """Schreibt Status-Felder eines Jobs (Listen werden als JSON gespeichert)"""
+    for name in ['schritte', 'warnungen']:
+        if name in felder:
+            felder[f'{name}_json'] = json.dumps(felder.pop(name), ensure_ascii=False)
+    felder['aktualisiert'] = jetzt_iso()
+    
+    with db_verbindung() as conn:
+        conn.execute(
+            f"UPDATE jobs SET {', '.join(f'{name} = ?' for name in felder)} WHERE id = ?",
+            (*felder.values(), job_id)
+        )
+
+def load_job(job_id):
+    """Lädt den Status eines Jobs (None wenn unbekannt)"""
+    with db_verbindung() as conn:
+        row = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+    
+    if row is None:
+        return None
+    job = dict(row)
+    job['schritte'] = json.loads(job.pop('schritte_json'))
+    job['warnungen'] = json.loads(job.pop('warnungen_json'))
+    return job
+
+def is_job_cancelled(job_id):
+    with db_verbindung() as conn:
+        row = conn.execute('SELECT abbrechen FROM jobs WHERE id = ?', (job_id,)).fetchone()
+    return row is None or bool(row['abbrechen'])
+
+def get_worker_cache(mandant_key):
+    """Stufen-Cache im Worker-Prozess für die zuletzt verarbeiteten Mandanten (claim_next_job leitet ihre Jobs hierher)"""
+    if mandant_key not in _worker_caches and len(_worker_caches) >= JOB_CACHE_MANDANTEN:
+        del _worker_caches[next(iter(_worker_caches))]
+    cache = _worker_caches.pop(mandant_key, {})
+    _worker_caches[mandant_key] = cache
+    return cache
+
+def execute_job(job_id, mandant_key):
+    """Führt einen Job im Worker aus: Pipeline, Fortschritt/Abbruch über die DB, Ergebnis als Datei"""
+    stand = load_mandant_stand(mandant_key, f'jobs/{job_id}_eingaben', JOB_VERSION)
+    if stand is None:
+        update_job(job_id, status='fehler', beendet=jetzt_iso(), fehler='Eingabedaten des Jobs nicht gefunden')
+        return
+    
+    eingaben = {**stand['eingaben'], 'cache': get_worker_cache(mandant_key)}
+    job = {'schritte': [], 'warnungen': [], 'letztes_update': 0.0}
+    _job_kontext.job = job
+    
+    # Lebenszeichen auch während langer Stufen ohne Fortschrittsmeldung (z.B. Excel-Export)
+    heartbeat_ende = threading.Event()
+    def heartbeat():
+        while not heartbeat_ende.wait(JOB_HEARTBEAT_S):
+            update_job(job_id)
+    threading.Thread(target=heartbeat, daemon=True).start()
+    
+    def fortschritt(current, total, prefix="", suffix=""):
+        jetzt = time.perf_counter()
+        if current < total and jetzt - job['letztes_update'] < JOB_POLL_INTERVALL_S / 2:
+            return
+        job['letztes_update'] = jetzt
+        # Abbruch wird bei jeder weitergegebenen Fortschrittsmeldung geprüft
+        if is_job_cancelled(job_id):
+            raise JobAbgebrochen()
+        update_job(
+            job_id, fortschritt=min(current / total, 1.0) if total else 1.0,
+            text=" ".join(teil for teil in [prefix, suffix] if teil),
+            schritte=job['schritte'], warnungen=job['warnungen']
+        )
+    
+    try:
+        ergebnis = run_pipeline(eingaben, fortschritt, job['schritte'].append)
+        save_mandant_stand(mandant_key, f'jobs/{job_id}_ergebnis', {'version': JOB_VERSION, 'ergebnis': ergebnis})
+        update_job(job_id, status='fertig', beendet=jetzt_iso(), fortschritt=1.0,
+                   schritte=job['schritte'], warnungen=job['warnungen'])
+    except JobAbgebrochen:
+        update_job(job_id, status='abgebrochen', beendet=jetzt_iso(), text='Vom Benutzer abgebrochen',
+                   schritte=job['schritte'], warnungen=job['warnungen'])
+    except Exception as e:
+        update_job(job_id, status='fehler', beendet=jetzt_iso(), fehler=f"{type(e).__name__}: {str(e)}",
+                   traceback=traceback.format_exc(), schritte=job['schritte'], warnungen=job['warnungen'])
+    finally:
+        heartbeat_ende.set()
+        _job_kontext.job = None
+        entferne_job_datei(mandant_key, job_id, 'eingaben')
+
+def entferne_job_datei(mandant_key, job_id, art):
+    pfad = get_stand_file(mandant_key, f'jobs/{job_id}_{art}')
+    if os.path.exists(pfad):
+        os.remove(pfad)
+
+def run_job_worker(worker_name, einmal=False, eltern_pid=None):
+    """Worker-Schleife: holt Jobs aus der Warteschlange, bis keine mehr da sind (einmal) oder der Server endet"""
+    try:
+        while True:
+            if eltern_pid and not is_prozess_aktiv(eltern_pid):
+                return
+            
+            job = claim_next_job(worker_name)
+            if job is not None:
+                execute_job(job['id'], job['mandant'])
+            elif einmal and not has_waiting_jobs():
+                return
+            else:
+                # Wartende Jobs eines anderen Workers übernimmt claim_next_job nach JOB_AFFINITAET_S
+                time.sleep(JOB_POLL_INTERVALL_S)
+    finally:
+        # Abmelden, damit die Jobs seiner Mandanten ohne Wartezeit an andere Worker gehen
+        with db_verbindung() as conn:
+            conn.execute('DELETE FROM job_worker WHERE name = ?', (worker_name,))
+
+def has_waiting_jobs():
+    with db_verbindung() as conn:
+        row = conn.execute("SELECT 1 FROM jobs WHERE status = 'wartend' AND abbrechen = 0 LIMIT 1").fetchone()
+    return row is not None
+
+def is_prozess_aktiv(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+@st.cache_resource
+def start_worker_pool():
+    """Startet einmal pro Server die Worker-Prozesse (worker.py); sie beenden sich mit dem Server"""
+    return subprocess.Popen([
+        sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'worker.py'),
+        '--anzahl', str(JOB_WORKER_ANZAHL), '--eltern-pid', str(os.getpid())
+    ])
+
+def start_processing_job():
+    """Stellt die Verarbeitung in die Warteschlange und merkt die Job-ID in der Session"""
+    if not JOB_WORKER_EXTERN:
+        start_worker_pool()
+    
+    st.session_state['job_id'] = submit_job(collect_processing_inputs())
+    st.session_state['processing_active'] = True
+    st.session_state['processing_error'] = None
+
+def get_session_job():
+    """Job der aktuellen Session - nach einem Seiten-Reload der neueste nicht abgeholte Job des Mandanten"""
+    job_id = st.session_state.get('job_id')
+    if job_id:
+        return load_job(job_id)
+    
+    mandant_key = get_mandant_key()
+    if not mandant_key:
+        return None
+    with db_verbindung() as conn:
+        row = conn.execute(
+            "SELECT id FROM jobs WHERE mandant = ? AND quelle = 'ui' AND abgeholt = 0 ORDER BY erstellt DESC LIMIT 1", (mandant_key,)
+        ).fetchone()
+    if row is None:
+        return None
+    st.session_state['job_id'] = row['id']
+    return load_job(row['id'])
+
+def is_mandant_job_running():
+    """Prüft, ob für den Mandanten bereits ein Job wartet oder läuft"""
+    with db_verbindung() as conn:
+        row = conn.execute(
+            "SELECT 1 FROM jobs WHERE mandant = ? AND status IN ('wartend', 'laeuft') LIMIT 1", (get_mandant_key(),)
+        ).fetchone()
+    return row is not None
+
+def cancel_job(job_id):
+    """Fordert den Abbruch an - wartende Jobs werden sofort beendet, laufende beim nächsten Fortschritt"""
+    with db_verbindung() as conn:
+        conn.execute('UPDATE jobs SET abbrechen = 1 WHERE id = ?', (job_id,))
+        conn.execute(
+            """UPDATE jobs SET status = 'abgebrochen', beendet = ?, text = 'Vor dem Start abgebrochen'
+               WHERE id = ? AND status = 'wartend'""",
+            (jetzt_iso(), job_id)
+        )
+
+@st.fragment(run_every=JOB_POLL_INTERVALL_S)
+def show_job_fortschritt(job_id):
+    """Fortschrittsanzeige eines Jobs - wird regelmäßig neu gezeichnet, ohne die Seite neu zu laden"""
+    job = load_job(job_id)
+    if job is None or job['status'] not in ('wartend', 'laeuft'):
+        st.rerun()
+    
+    if job['status'] == 'wartend':
+        with db_verbindung() as conn:
+            vor_dem_job = conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = 'wartend' AND erstellt < ?", (job['erstellt'],)
+            ).fetchone()[0]
+        st.progress(0.0, text=f"⏳ In der Warteschlange - {vor_dem_job} Job(s) davor")
+    else:
+        laufzeit = (datetime.now() - datetime.fromisoformat(job['gestartet'])).total_seconds()
+        st.progress(job['fortschritt'], text=job['text'] or "🔄 Verarbeitung läuft...")
+        st.caption(f"⏳ Läuft seit {laufzeit:.0f} s im Hintergrund - die Seite kann weiter bedient oder neu geladen werden")
+        if job['schritte']:
+            st.success(job['schritte'][-1])
+    
+    if job['abbrechen']:
+        st.info("⏹️ Abbruch angefordert...")
+    elif st.button("⏹️ Verarbeitung abbrechen", key=f"job_abbrechen_{job_id}"):
+        cancel_job(job_id)
+        st.info("⏹️ Abbruch angefordert...")
+
+def show_processing_job():
+    """Zeigt den laufenden Job oder übernimmt das Ergebnis eines beendeten Jobs; True wenn Ergebnisse angezeigt wurden"""
+    job = get_session_job()
+    if job is None:
+        if st.session_state.pop('job_id', None):
+            st.session_state['processing_active'] = False
+            st.warning("⚠️ Die Verarbeitung ist nicht mehr verfügbar. Bitte erneut starten.")
+        return False
+    
+    if job['status'] in ('wartend', 'laeuft'):
+        st.session_state['processing_active'] = True
+        st.markdown("---")
+        show_job_fortschritt(job['id'])
+        return False
+    
+    # Beendeter Job: Ergebnis einmalig übernehmen und Job als abgeholt markieren
+    update_job(job['id'], abgeholt=1)
+    del st.session_state['job_id']
+    st.session_state['processing_active'] = False
+    
+    st.markdown("---")
+    with st.expander("📋 Verarbeitungsdetails anzeigen", expanded=False):
+        for text in job['schritte']:
+            st.success(text)
+    for text in job['warnungen']:
+        st.warning(text)
+    
+    if job['status'] == 'abgebrochen':
+        st.warning("⏹️ Verarbeitung abgebrochen - es wurden keine Ergebnisse übernommen.")
+        return False
+    
+    if job['status'] == 'fehler':
+        st.session_state['processing_error'] = job['fehler']
+        st.error(f"❌ Fehler bei der Verarbeitung: {job['fehler']}")
+        if job['traceback']:
+            with st.expander("🔍 Debug-Informationen", expanded=False):
+                st.code(job['traceback'])
+        return False
+    
+    stand = load_mandant_stand(job['mandant'], f"jobs/{job['id']}_ergebnis", JOB_VERSION)
+    if stand is None:
+        st.error("❌ Ergebnisdatei des Jobs nicht gefunden. Bitte Verarbeitung erneut starten.")
+        return False
+    entferne_job_datei(job['mandant'], job['id'], 'ergebnis')
+    
+    show_processing_result(stand['ergebnis'])
+    return stand['ergebnis']['ziel_sorted'] is not None
+
+def show_jobs_page():
+    """Statusseite der Warteschlange: eigene Jobs und Auslastung des Servers"""
+    st.title("⚙️ Verarbeitungs-Jobs")
+    
+    with db_verbindung() as conn:
+        auslastung = {
+            row['status']: row['anzahl']
+            for row in conn.execute(
+                "SELECT status, COUNT(*) AS anzahl FROM jobs WHERE status IN ('wartend', 'laeuft') GROUP BY status"
+            )
+        }
+        mandanten_wartend = conn.execute("SELECT COUNT(DISTINCT mandant) FROM jobs WHERE status = 'wartend'").fetchone()[0]
+        rows = conn.execute(
+            'SELECT * FROM jobs WHERE mandant = ? ORDER BY erstellt DESC LIMIT 50', (get_mandant_key(),)
+        ).fetchall()
+    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Laufende Jobs (Server)", auslastung.get('laeuft', 0))
+    with col2:
+        st.metric("Wartende Jobs (Server)", auslastung.get('wartend', 0))
+    with col3:
+        st.metric("Worker", "extern" if JOB_WORKER_EXTERN else JOB_WORKER_ANZAHL)
+    if mandanten_wartend:
+        st.caption(f"Die Warteschlange wird reihum über {mandanten_wartend} Mandanten abgearbeitet, pro Mandant läuft höchstens ein Job.")
+    
+    if not rows:
+        st.info("ℹ️ Für diesen Mandanten wurden noch keine Jobs gestartet.")
+        return
+    
+    def dauer(row):
+        if not row['gestartet']:
+            return None
+        ende = datetime.fromisoformat(row['beendet']) if row['beendet'] else datetime.now()
+        return round((ende - datetime.fromisoformat(row['gestartet'])).total_seconds(), 1)
+    
+    st.dataframe(pd.DataFrame([{
+        'Erstellt': datetime.fromisoformat(row['erstellt']).strftime('%d.%m.%Y %H:%M:%S'),
+        'Status': JOB_STATUS_TEXT.get(row['status'], row['status']),
+        'Fortschritt': f"{row['fortschritt'] * 100:.0f}%",
+        'Zeilen': row['zeilen'],
+        'Dauer (s)': dauer(row),
+        'Worker': row['worker'] or '—',
+        'Abgeholt': '✓' if row['abgeholt'] else '',
+        'Hinweis': row['fehler'] or row['text'] or ''
+    } for row in rows]), hide_index=True, use_container_width=True)
+    
+    if any(row['status'] in ('wartend', 'laeuft') for row in rows):
+        if st.button("🔄 Aktualisieren"):
+            st.rerun()
 
 # === ERGEBNIS-ANZEIGE ===
 
-def display_results(ziel, stats):
+def display_results(ziel, stats, profiler=None):
     """Zeigt Verarbeitungsergebnisse an"""
     st.markdown("---")
     st.subheader("6. Ergebnisse", help="Übersicht aller berechneten Werte für die Bürgschaftsbelastung. Hier sehen Sie die Zusammenfassung aller verarbeiteten Vorgänge.")
@@ -2321,6 +4527,10 @@ def display_results(ziel, stats):
         ℹ️ **ATB-Filter:** {st.session_state['atb_filtered_count']} Zeilen mit ATB in 'Weitere Registriernummer Folgeverfahren' 
         wurden übersprungen (S-Anmeldearten und andere interne Vorgänge).
         """)
+        if is_dataframe_valid(st.session_state.get('atb_ausschluss')):
+            with st.expander("🔍 Ausgeschlossene ATB-Zeilen anzeigen", expanded=False):
+                st.dataframe(st.session_state['atb_ausschluss'], hide_index=True, use_container_width=True)
+                st.caption("Die Zeilen stehen zusätzlich im Excel-Reiter 'ATB-Ausschluss'")
     
     s_arten_summe = sum(st.session_state.stats.get(art, 0) for art in S_ANMELDEARTEN)
     if s_arten_summe > 0:
@@ -2351,10 +4561,10 @@ def display_results(ziel, stats):
     if ncar_count > 0:
         st.metric("NCAR-Zeilen", ncar_count)
     
-    display_processing_protocol(stats)
+    display_processing_protocol(stats, profiler)
     display_financial_summary(ziel)
 
-def display_processing_protocol(stats):
+def display_processing_protocol(stats, profiler=None):
     """Zeigt Verarbeitungsprotokoll als kompakte Tabelle"""
     st.subheader("6.2 Verarbeitungsprotokoll", help="Detaillierte Aufschlüsselung der Verarbeitung: Wie viele Positionen wurden in den Kalkulationsdateien gefunden (Mit Match) und wie viele mussten mit dem Pauschalbetrag berechnet werden (Ohne Match).")
     with st.expander("📊 Details anzeigen", expanded=True):
@@ -2445,6 +4655,8 @@ def display_processing_protocol(stats):
         s_arten_summe = sum(st.session_state.stats.get(art, 0) for art in S_ANMELDEARTEN)
         if s_arten_summe > 0:
             st.caption(f"⚫ {s_arten_summe} S-Anmeldearten (interne Konsolidierungen) wurden nicht verarbeitet")
+        
+        display_laufzeitprotokoll(profiler)
 
 def display_financial_summary(ziel):
     """Zeigt finanzielle Zusammenfassung"""
@@ -2523,86 +4735,260 @@ def display_financial_summary(ziel):
     - Die EUSt wird separat ausgewiesen und ist NICHT in den Gesamtabgaben enthalten
     """)
 
-def process_buergschaft(ziel):
-    """Verarbeitet Bürgschaftssaldo-Berechnung"""
-    st.subheader("6.4 Bürgschaftssaldo-Berechnung", help="Chronologische Darstellung aller Ein- und Ausgänge mit täglichen Salden. Zeigt die Entwicklung der Bürgschaftsauslastung über den gesamten Zeitraum mit Höchst- und Tiefstständen.")
+def calculate_buergschaft(ziel, params, ncar_index=None, saldo_stand=None, profiler=None, details_verzeichnis=None):
+    """Stufe SALDO: Bewegungen, Tagessalden und die drei Saldo-Sheets ohne UI berechnen (ATB-Ausschluss kommt aus dem Matching)"""
+    startbuergschaft = params['startbuergschaft']
+    
+    # Sortierschlüssel einmal je Ergebnis für Bewegungen, Saldo-Sortierung und Sheet Ergebnis
+    with profil_span(profiler, 'Saldo › Sortierschlüssel', len(ziel)):
+        schluessel = build_sortier_schluessel(ziel)
+    with profil_span(profiler, 'Saldo › Bewegungen', len(ziel)) as messung:
+        messung['zeilen'] = anzahl = count_bewegungen(ziel)
+        
+        # Lange Zeiträume: Bewegungen blockweise direkt aus der Zieldatei in den Bewegungs-Speicher schreiben
+        speicher_verzeichnis = None
+        if anzahl >= BEWEGUNGEN_SPEICHERABBILD_AB:
+            os.makedirs(ARTEFAKT_VERZEICHNIS, exist_ok=True)
+            speicher_verzeichnis = tempfile.mkdtemp(prefix='bewegungen_', dir=ARTEFAKT_VERZEICHNIS)
+            bewegungen = write_bewegungs_speicher(ziel, schluessel, speicher_verzeichnis)
+        else:
+            bewegungen = create_bewegungstabelle(ziel, schluessel)
+    try:
+        saldo_engine = calculate_saldo(bewegungen, startbuergschaft, params, saldo_stand, profiler, details_verzeichnis)
+    finally:
+        if speicher_verzeichnis:
+            # Eingeblendete Spalten freigeben, bevor das Verzeichnis entfernt wird (Windows)
+            bewegungen = None
+            shutil.rmtree(speicher_verzeichnis, ignore_errors=True)
+    daily_summary = saldo_engine['daily_summary']
+    
+    with profil_span(profiler, 'Saldo › Sheet Ergebnis', len(ziel)):
+        ziel_mit_saldo = add_tagessummen_to_ziel(ziel, daily_summary, params, schluessel)
+    
+    total_belastung = sum(d['Belastung'] for d in daily_summary.values())
+    total_entlastung = sum(d['Entlastung'] for d in daily_summary.values())
+    
+    saldo = {
+        'daily_summary': daily_summary,
+        'total_belastung': total_belastung,
+        'total_entlastung': total_entlastung,
+        'end_stand': startbuergschaft - total_belastung + total_entlastung,
+        'ziel_mit_saldo': ziel_mit_saldo,
+        'bewegungsdetails_df': saldo_engine['bewegungsdetails_df'],
+        'bewegungsdetails': saldo_engine['bewegungsdetails'],
+        'tageszusammenfassung_df': saldo_engine['tageszusammenfassung_df'],
+        'saldo_stand': saldo_engine['stand'],
+        'saldo_ab_datum': saldo_engine['ab_datum'],
+        'saldo_tage_uebernommen': saldo_engine['tage_uebernommen'],
+        'saldo_tage_gesamt': saldo_engine['tage_gesamt'],
+        'max_auslastung': None,
+        'tiefststand': None,
+        'ncar_transport_mrn': None,
+        'ncar_packstuecke': None,
+        'ncar_bericht': None
+    }
     
-    with st.spinner("💰 Bürgschaftssaldo wird berechnet..."):
-        time.sleep(0.3)
-        bewegungen_df = create_bewegungstabelle(ziel)
-        daily_summary = calculate_daily_summary(bewegungen_df, st.session_state.get('startbuergschaft', 0))
-        
-        col1, col2, col3 = st.columns(3)
-        with col1:
-            st.metric("Startbürgschaft", f"€ {st.session_state.get('startbuergschaft', 0):,.2f}")
-        
-        total_belastung = sum(d['Belastung'] for d in daily_summary.values())
-        total_entlastung = sum(d['Entlastung'] for d in daily_summary.values())
-        end_stand = st.session_state.get('startbuergschaft', 0) - total_belastung + total_entlastung
-        
-        with col2:
-            st.metric("Gesamtbelastung", f"€ {total_belastung:,.2f}")
-            st.metric("Gesamtentlastung", f"€ {total_entlastung:,.2f}")
-        
-        with col3:
-            st.metric("Endbürgschaft", f"€ {end_stand:,.2f}")
-            auslastung = 0 if st.session_state.get('startbuergschaft', 0) == 0 else ((st.session_state.get('startbuergschaft', 0) - end_stand) / st.session_state.get('startbuergschaft', 0) * 100)
-            st.metric("Auslastung", f"{auslastung:.1f}%")
-        
-        ziel_mit_saldo = add_tagessummen_to_ziel(ziel, daily_summary)
-        bewegungsdetails_df = create_bewegungsdetails_df(bewegungen_df, daily_summary, st.session_state.get('startbuergschaft', 0))
-        tageszusammenfassung_df = create_tageszusammenfassung_df_mit_extrema(bewegungen_df, daily_summary, st.session_state.get('startbuergschaft', 0))
-        
-        if len(tageszusammenfassung_df) > 1:
-            gesamt_row = tageszusammenfassung_df[tageszusammenfassung_df['Datum'] == 'GESAMT']
-            if not gesamt_row.empty:
-                max_auslastung = gesamt_row['Auslastung %'].iloc[0]
-                tiefststand = gesamt_row['Tiefststand'].iloc[0]
-        
-            st.session_state['max_auslastung_str'] = f"{max_auslastung:.2f} %".replace('.', ',')
-            st.session_state['tiefststand_str'] = format_currency(tiefststand)
-            st.session_state['max_auslastung'] = f"{max_auslastung:.1f}%"
-            st.session_state['ziel_sorted'] = ziel
-
-        ncar_info = ""
-        if st.session_state.get('ncar_enabled', True) and 'df_ncar' in st.session_state and st.session_state['df_ncar'] is not None:
-            with st.spinner("✨ NCAR-Daten werden eingearbeitet..."):
-                ziel_mit_saldo = enhance_ziel_with_ncar(ziel_mit_saldo, st.session_state['df_ncar'])
-                
-                transport_mrn_rows = (ziel_mit_saldo['MRN-Nummer Eingang'] != ziel_mit_saldo['ATB-Nummer']).sum()
-                packstuck_rows = (pd.to_numeric(ziel_mit_saldo['Menge'], errors='coerce') > 0).sum()
-                
-                ncar_info = f" (inkl. NCAR: {transport_mrn_rows} Transport-MRN, {packstuck_rows} mit Packstücken)"
-        
-        buergschaft_info = ""
-        if st.session_state.get('buergschaft_erhöhung_aktiv', False):
-            betrag = st.session_state.get('buergschaft_erhöhung_betrag', 0)
-            datum = st.session_state.get('buergschaft_erhöhung_datum', date.today())
-            buergschaft_info = f" | Bürgschaft +{betrag/1000000:.1f} Mio am {datum.strftime('%d.%m.%Y')}"
-        
-        st.success(f"✅ Bürgschaftssaldo wurde berechnet!{ncar_info}{buergschaft_info}")
-        
-        st.info(f"""
-        **Excel wird 3 Sheets enthalten:**
-        1. **Ergebnis** - {len(ziel_mit_saldo)} Zeilen mit Tagessalden{ncar_info}
-        2. **Bewegungsdetails** - {len(bewegungsdetails_df)} Zeilen mit allen Ein-/Ausgängen
-        3. **Tageszusammenfassung** - {len(tageszusammenfassung_df)} Zeilen mit Höchst-/Tiefstständen pro Tag
-        """)
-        
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-            ziel_mit_saldo.to_excel(writer, index=False, sheet_name='Ergebnis')
-            bewegungsdetails_df.to_excel(writer, index=False, sheet_name='Bewegungsdetails')
-            tageszusammenfassung_df.to_excel(writer, index=False, sheet_name='Tageszusammenfassung')
-        output.seek(0)
+    tageszusammenfassung_df = saldo['tageszusammenfassung_df']
+    if len(tageszusammenfassung_df) > 1:
+        gesamt_row = tageszusammenfassung_df[tageszusammenfassung_df['Datum'] == 'GESAMT']
+        if not gesamt_row.empty:
+            saldo['max_auslastung'] = gesamt_row['Auslastung %'].iloc[0]
+            saldo['tiefststand'] = gesamt_row['Tiefststand'].iloc[0]
+    
+    if ncar_index is not None:
+        with profil_span(profiler, 'Saldo › NCAR-Abgleich', len(saldo['ziel_mit_saldo'])):
+            ziel_mit_saldo, saldo['ncar_bericht'] = enhance_ziel_with_ncar(saldo['ziel_mit_saldo'], ncar_index)
+        saldo['ziel_mit_saldo'] = ziel_mit_saldo
+        saldo['ncar_transport_mrn'] = (ziel_mit_saldo['MRN-Nummer Eingang'] != ziel_mit_saldo['ATB-Nummer']).sum()
+        saldo['ncar_packstuecke'] = (pd.to_numeric(ziel_mit_saldo['Menge'], errors='coerce') > 0).sum()
+    
+    return saldo
 
-        st.session_state['excel_file'] = output.getvalue()
-        
-        # HISTORIE-HOOK: Nach erfolgreicher Verarbeitung speichern
-        save_to_history()
+def create_excel_export(saldo, atb_ausschluss=None):
+    """Stufe EXPORT: schreibt Ergebnis, Bewegungsdetails, Tageszusammenfassung und - falls Zeilen ausgeschlossen wurden - als vierten Reiter ATB-Ausschluss in eine Excel-Datei (Bytes)"""
+    if saldo.get('bewegungsdetails_df') is None:
+        return create_excel_export_bloecke(saldo, atb_ausschluss)
+    
+    output = io.BytesIO()
+    # Datumsspalten des Ergebnisses sind datetime64 - Format wie bei Datumswerten
+    with pd.ExcelWriter(output, engine='xlsxwriter', datetime_format='YYYY-MM-DD') as writer:
+        build_ergebnis_export(saldo['ziel_mit_saldo']).to_excel(writer, index=False, sheet_name='Ergebnis')
+        saldo['bewegungsdetails_df'].to_excel(writer, index=False, sheet_name='Bewegungsdetails')
+        saldo['tageszusammenfassung_df'].to_excel(writer, index=False, sheet_name='Tageszusammenfassung')
+        if is_dataframe_valid(atb_ausschluss):
+            atb_ausschluss.to_excel(writer, index=False, sheet_name='ATB-Ausschluss')
+    output.seek(0)
+    return output.getvalue()
 
-        st.markdown("---")
-        st.success("✅ Excel-Datei wurde erfolgreich erstellt! Wechseln Sie zum Downloads-Tab.")
+EXCEL_MAX_ZEILEN = 1048576
+EXCEL_KOPF_FORMAT = {'bold': True, 'align': 'center', 'valign': 'top', 'top': 1, 'right': 1, 'bottom': 1, 'left': 1}
+
+def iter_dataframe_bloecke(df, zeilen=BEWEGUNGEN_BLOCK_ZEILEN):
+    """Ein DataFrame in Zeilenblöcken"""
+    for start in range(0, max(len(df), 1), zeilen):
+        yield df.iloc[start:start + zeilen]
+
+def write_excel_zelle(worksheet, zeile, spalte, wert, datum_format):
+    """Schreibt einen Wert wie to_excel: leere Werte bleiben leer, Daten mit Datumsformat, Unendlich als Text"""
+    if wert is None or (pd.api.types.is_scalar(wert) and pd.isna(wert)) or (isinstance(wert, str) and wert == ''):
+        return
+    if isinstance(wert, (datetime, date)):
+        worksheet.write(zeile, spalte, wert, datum_format)
+    elif isinstance(wert, (bool, np.bool_)):
+        worksheet.write(zeile, spalte, bool(wert))
+    elif isinstance(wert, (int, float, np.integer, np.floating)):
+        wert = float(wert) if isinstance(wert, (float, np.floating)) else int(wert)
+        worksheet.write(zeile, spalte, ('inf' if wert > 0 else '-inf') if np.isinf(wert) else wert)
+    else:
+        worksheet.write(zeile, spalte, str(wert))
+
+def write_excel_sheet(workbook, name, bloecke, formate):
+    """Schreibt DataFrame-Blöcke Zeile für Zeile in ein Sheet (wie to_excel ohne Index); volle Sheets werden als '<Name> 2' usw. fortgesetzt"""
+    worksheet = None
+    spalten = None
+    zeile = nummer = 0
+    for block in bloecke:
+        if spalten is None:
+            spalten = list(block.columns)
+        for werte in zip(*[block[spalte].tolist() for spalte in spalten]):
+            if worksheet is None or zeile == EXCEL_MAX_ZEILEN:
+                nummer += 1
+                worksheet = workbook.add_worksheet(name if nummer == 1 else f'{name} {nummer}')
+                for spalte, kopf in enumerate(spalten):
+                    worksheet.write(0, spalte, kopf, formate['kopf'])
+                zeile = 1
+            for spalte, wert in enumerate(werte):
+                write_excel_zelle(worksheet, zeile, spalte, wert, formate['datum'])
+            zeile += 1
+    
+    if worksheet is None:
+        # Ohne Zeilen nur die Kopfzeile
+        worksheet = workbook.add_worksheet(name)
+        for spalte, kopf in enumerate(spalten or []):
+            worksheet.write(0, spalte, kopf, formate['kopf'])
+
+def create_excel_export_bloecke(saldo, atb_ausschluss=None):
+    """EXPORT im Bewegungs-Speicher-Modus: die Sheets werden blockweise geschrieben (xlsxwriter constant_memory), die Bewegungsdetails direkt aus den abgelegten Blöcken"""
+    output = io.BytesIO()
+    workbook = xlsxwriter.Workbook(output, {'constant_memory': True})
+    formate = {
+        'kopf': workbook.add_format(EXCEL_KOPF_FORMAT),
+        'datum': workbook.add_format({'num_format': 'YYYY-MM-DD'})
+    }
+    write_excel_sheet(workbook, 'Ergebnis', iter_dataframe_bloecke(build_ergebnis_export(saldo['ziel_mit_saldo'])), formate)
+    write_excel_sheet(workbook, 'Bewegungsdetails', iter_bewegungsdetails(saldo), formate)
+    write_excel_sheet(workbook, 'Tageszusammenfassung', [saldo['tageszusammenfassung_df']], formate)
+    if is_dataframe_valid(atb_ausschluss):
+        write_excel_sheet(workbook, 'ATB-Ausschluss', iter_dataframe_bloecke(atb_ausschluss), formate)
+    workbook.close()
+    return output.getvalue()
+
+def run_saldo_stage(ziel, params, preis_key, df_ncar, mandant_key, cache, profiler=None, atb_ausschluss=None):
+    """Stufen SALDO und EXPORT ohne UI: liefert Saldo-Ergebnis und Excel-Bytes"""
+    ncar_key = dataframe_fingerprint(df_ncar, NCAR_PFLICHTSPALTEN)
+    saldo_key = build_stage_key(
+        preis_key or dataframe_fingerprint(ziel),
+        {name: params[name] for name in SALDO_PARAMETER},
+        ncar_key
+    )
+    
+    # Stufe NCAR: ATB-Index einmal je NCAR-Datei, doppelte ATB werden deterministisch auf die erste Zeile reduziert
+    ncar_index = None
+    if df_ncar is not None:
+        with profil_span(profiler, 'NCAR-Index', len(df_ncar)) as messung:
+            ncar_index, messung['cache'] = run_cached_stage(cache, 'ncar', ncar_key, lambda: build_ncar_index(df_ncar))
+        if ncar_index['duplikate']:
+            melde_warnung(
+                f"⚠️ NCAR-Datei: {ncar_index['duplikate']} doppelte Zeilen zu {ncar_index['duplikat_atbs']} ATB-Nummern "
+                f"- es gilt jeweils die erste Zeile der Datei"
+            )
+    
+    details_verzeichnis = get_details_verzeichnis(mandant_key) if mandant_key else None
+    
+    def berechne_saldo():
+        # Gespeicherte Tages-Checkpoints des Mandanten: nur Tage ab der ersten Änderung werden neu gerechnet
+        saldo_stand = load_mandant_stand(mandant_key, 'saldo_stand', SALDO_VERSION) if mandant_key else None
+        saldo = calculate_buergschaft(ziel, params, ncar_index, saldo_stand, profiler, details_verzeichnis)
+        if mandant_key:
+            save_mandant_stand(mandant_key, 'saldo_stand', saldo['saldo_stand'])
+            bereinige_details_bloecke(details_verzeichnis, saldo['saldo_stand']['details'])
+        return saldo
+    
+    with profil_span(profiler, 'Saldo', len(ziel)) as messung:
+        saldo, messung['cache'] = run_cached_stage(cache, 'saldo', saldo_key, berechne_saldo)
+        details = saldo['bewegungsdetails']
+        if messung['cache'] and not is_details_vorhanden(details['verzeichnis'], details['bloecke']):
+            # Ein späterer Lauf des Mandanten hat die Blöcke dieses Ergebnisses inzwischen ersetzt
+            saldo, messung['cache'] = berechne_saldo(), False
+            cache['saldo'] = (saldo_key, saldo)
+    
+    with profil_span(profiler, 'Excel-Export', len(saldo['ziel_mit_saldo'])) as messung:
+        export_key = build_stage_key(saldo_key, dataframe_fingerprint(atb_ausschluss))
+        excel_file, messung['cache'] = run_cached_stage(
+            cache, 'export', export_key, lambda: create_excel_export(saldo, atb_ausschluss)
+        )
+    
+    return saldo, excel_file
+
+def display_buergschaft(saldo, params, atb_ausschluss=None):
+    """Zeigt das Ergebnis der Bürgschaftssaldo-Berechnung"""
+    st.subheader("6.4 Bürgschaftssaldo-Berechnung", help="Chronologische Darstellung aller Ein- und Ausgänge mit täglichen Salden. Zeigt die Entwicklung der Bürgschaftsauslastung über den gesamten Zeitraum mit Höchst- und Tiefstständen.")
+    
+    startbuergschaft = params['startbuergschaft']
+    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Startbürgschaft", f"€ {startbuergschaft:,.2f}")
+    
+    with col2:
+        st.metric("Gesamtbelastung", f"€ {saldo['total_belastung']:,.2f}")
+        st.metric("Gesamtentlastung", f"€ {saldo['total_entlastung']:,.2f}")
+    
+    with col3:
+        st.metric("Endbürgschaft", f"€ {saldo['end_stand']:,.2f}")
+        auslastung = 0 if startbuergschaft == 0 else ((startbuergschaft - saldo['end_stand']) / startbuergschaft * 100)
+        st.metric("Auslastung", f"{auslastung:.1f}%")
+    
+    ziel_mit_saldo = saldo['ziel_mit_saldo']
+    tageszusammenfassung_df = saldo['tageszusammenfassung_df']
+    
+    ncar_info = ""
+    if saldo['ncar_transport_mrn'] is not None:
+        ncar_info = f" (inkl. NCAR: {saldo['ncar_transport_mrn']} Transport-MRN, {saldo['ncar_packstuecke']} mit Packstücken)"
+    
+    ncar_bericht = saldo.get('ncar_bericht')
+    if ncar_bericht and ncar_bericht['vervielfachung_vermieden']:
+        st.caption(f"🔵 NCAR: {ncar_bericht['vervielfachung_vermieden']} zusätzliche Ergebniszeilen durch doppelte ATB-Nummern vermieden")
+    
+    buergschaft_info = ""
+    if params['buergschaft_erhöhung_aktiv']:
+        betrag = params['buergschaft_erhöhung_betrag']
+        datum = params['buergschaft_erhöhung_datum']
+        buergschaft_info = f" | Bürgschaft +{betrag/1000000:.1f} Mio am {datum.strftime('%d.%m.%Y')}"
+    
+    st.success(f"✅ Bürgschaftssaldo wurde berechnet!{ncar_info}{buergschaft_info}")
+    
+    if saldo['saldo_tage_uebernommen'] > 0:
+        ab_text = saldo['saldo_ab_datum'].strftime('%d.%m.%Y') if saldo['saldo_ab_datum'] else '—'
+        st.caption(
+            f"⚡ Saldo ab {ab_text} neu berechnet - {saldo['saldo_tage_uebernommen']} von "
+            f"{saldo['saldo_tage_gesamt']} Tagen aus dem letzten Lauf übernommen"
+        )
+    
+    # Vierter Reiter nur, wenn Zeilen wegen ATB in 'Weitere Registriernummer' ausgeschlossen wurden
+    atb_info = ""
+    if is_dataframe_valid(atb_ausschluss):
+        atb_info = f"\n    4. **ATB-Ausschluss** - {len(atb_ausschluss)} ausgeschlossene Leitdatei-Zeilen (Audit)"
+    
+    st.info(f"""
+    **Excel wird {4 if atb_info else 3} Sheets enthalten:**
+    1. **Ergebnis** - {len(ziel_mit_saldo)} Zeilen mit Tagessalden{ncar_info}
+    2. **Bewegungsdetails** - {saldo['bewegungsdetails']['zeilen']} Zeilen mit allen Ein-/Ausgängen
+    3. **Tageszusammenfassung** - {len(tageszusammenfassung_df)} Zeilen mit Höchst-/Tiefstständen pro Tag{atb_info}
+    """)
+    
+    st.markdown("---")
+    st.success("✅ Excel-Datei wurde erfolgreich erstellt! Wechseln Sie zum Downloads-Tab.")
 
 # === UI KOMPONENTEN ===
 
@@ -2689,10 +5075,10 @@ def setup_sidebar():
             st.caption("Klicken Sie auf '2️⃣ Downloads' oben")
             
         # HISTORIE-HOOK: Historie-Anzeige in Sidebar
-        history = load_history()
-        if history:
+        history_anzahl = count_history()
+        if history_anzahl:
             st.markdown("---")
-            st.info(f"📊 **Bürgschaftsverlauf:** {len(history)} Einträge")
+            st.info(f"📊 **Bürgschaftsverlauf:** {history_anzahl} Einträge")
 
         st.markdown("---")
         
@@ -2765,11 +5151,13 @@ def show_file_upload_section():
         if leitdatei is not None:
             process_leitdatei(leitdatei)
 
-    if st.session_state.get('results_available', False) and 'ziel_sorted' in st.session_state:
+    ergebnis_angezeigt = show_processing_job()
+    
+    if st.session_state.get('results_available', False) and 'ziel_sorted' in st.session_state and not ergebnis_angezeigt:
         st.markdown("---")
         
         with st.expander("📊 Ergebnisse erneut anzeigen", expanded=False):
-            display_results(st.session_state['ziel_sorted'], st.session_state.get('processing_stats', {}))
+            display_results(st.session_state['ziel_sorted'], st.session_state.get('processing_stats', {}), st.session_state.get('laufzeit_profil'))
         
         if 'excel_file' in st.session_state:
             st.info("✅ Excel-Datei bereits erstellt. Wechseln Sie zum **Downloads-Tab** um sie herunterzuladen.")
@@ -2796,13 +5184,12 @@ def show_date_filter_and_imports():
     if filter_button or st.session_state.get('datum_filter_confirmed', False):
         st.session_state['datum_filter_confirmed'] = True
         
-        df_leit = st.session_state.df_leit_unfiltered
-        gestell_col = find_col(df_leit, ['Datum Überlassung - CUSTST'])
-        df_leit['_gestell_date'] = pd.to_datetime(df_leit[gestell_col], errors='coerce').dt.date
-        df_leit = df_leit.dropna(subset=['_gestell_date'])
-        mask = (df_leit['_gestell_date'] >= von_datum) & (df_leit['_gestell_date'] <= bis_datum)
-        df_leit_filtered = df_leit[mask].copy()
-        df_leit_filtered = df_leit_filtered.drop(columns=['_gestell_date'])
+        try:
+            df_leit_filtered = filter_leit_zeitraum(st.session_state.df_leit_unfiltered, von_datum, bis_datum)
+            anmeldeart_col = find_col(df_leit_filtered, ['Anmeldeart Folgeverfahren'])
+        except ValueError as e:
+            st.error(f"❌ Kritischer Fehler: {e}")
+            st.stop()
         
         if df_leit_filtered.empty:
             st.warning("⚠️ Keine Daten im gewählten Zeitraum gefunden!")
@@ -2810,7 +5197,6 @@ def show_date_filter_and_imports():
         
         st.session_state.df_leit = df_leit_filtered
         
-        anmeldeart_col = find_col(df_leit_filtered, ['Anmeldeart Folgeverfahren'])
         st.session_state.stats = calculate_statistics(df_leit_filtered, anmeldeart_col)
         
         st.success(f"✅ {len(df_leit_filtered)} Einträge im Zeitraum {von_datum.strftime('%d.%m.%Y')} - {bis_datum.strftime('%d.%m.%Y')}")
@@ -2823,6 +5209,13 @@ def show_date_filter_and_imports():
     else:
         st.info("👆 Bitte wählen Sie einen Zeitraum und klicken Sie auf 'Filter anwenden'")           
 
+def filter_leit_zeitraum(df_leit, von_datum, bis_datum):
+    """Filtert die Leitdatei auf Vorgänge mit Gestellungsdatum im Bürgschaftszeitraum"""
+    gestell_col = find_col(df_leit, ['Datum Überlassung - CUSTST'])
+    gestell_datum = pd.to_datetime(df_leit[gestell_col], errors='coerce').dt.normalize()
+    mask = (gestell_datum >= pd.Timestamp(von_datum)) & (gestell_datum <= pd.Timestamp(bis_datum))
+    return df_leit[mask].copy()
+
 def process_leitdatei(leitdatei):
     """Verarbeitet die Leitdatei - NUR wenn noch nicht geladen"""
     if 'df_leit' in st.session_state and st.session_state.df_leit is not None:
@@ -2832,20 +5225,11 @@ def process_leitdatei(leitdatei):
         file_bytes = leitdatei.getvalue()
         st.session_state['leitdatei_bytes'] = file_bytes
         
-        with st.spinner("Leitdatei wird geladen..."):
+        with st.spinner("Leitdatei wird geladen..."), profil_span(st.session_state.setdefault('ingest_profil', {}), 'Ingest Leitdatei') as messung:
             df_leit = pd.read_excel(io.BytesIO(file_bytes))
+            messung['zeilen'] = len(df_leit)
             
-            required_leit_cols = [
-                ['Datum Überlassung - CUSTST'],
-                ['Weitere Registriernummer Folgeverfahren', 'Weitere Registriernummer'],
-                ['Registriernummer Folgeverfahren'],
-                ['Anmeldeart Folgeverfahren'],
-                ['Bezugsnummer/LRN SumA'],
-                ['Registriernummer/MRN SumA'],
-                ['Datum Ende - CUSFIN']
-            ]
-            
-            validate_dataframe(df_leit, required_leit_cols, "Leitdatei")
+            validate_dataframe(df_leit, LEIT_PFLICHTSPALTEN, "Leitdatei")
         
         st.session_state.df_leit_unfiltered = df_leit
         st.success(f"✅ Leitdatei erfolgreich hochgeladen ({len(df_leit)} Zeilen)")
@@ -2889,11 +5273,11 @@ def show_ncar_upload():
             
             with st.spinner("NCAR-Datei wird verarbeitet..."):
                 try:
-                    ncar_df = pd.read_excel(io.BytesIO(file_bytes))
+                    with profil_span(st.session_state.setdefault('ingest_profil', {}), 'Ingest NCAR') as messung:
+                        ncar_df = pd.read_excel(io.BytesIO(file_bytes))
+                        messung['zeilen'] = len(ncar_df)
                     
-                    required_cols = ['Registriernr.-SumA', 'RegistriernNr./MRN', 'Anzahl Packstücke']
-                    
-                    if not validate_import_file(ncar_df, required_cols, "NCAR-Datei"):
+                    if not validate_import_file(ncar_df, NCAR_PFLICHTSPALTEN, "NCAR-Datei"):
                         if 'ncar_bytes' in st.session_state:
                             del st.session_state['ncar_bytes']
                     else:
@@ -2956,7 +5340,11 @@ def display_statistics_table():
     
     for anmeldeart, file_type in [("IMDC", "Importdatei EZA"), ("WIDS", "Importdatei ZL"), ("NCDP", "NCTS-Datei")]:
         if st.session_state.stats.get(anmeldeart, 0) > 0:
-            anmeldeart_col = find_col(st.session_state.df_leit, ['Anmeldeart Folgeverfahren'])
+            try:
+                anmeldeart_col = find_col(st.session_state.df_leit, ['Anmeldeart Folgeverfahren'])
+            except ValueError as e:
+                st.error(f"❌ Kritischer Fehler: {e}")
+                st.stop()
             anmeldeart_data = st.session_state.df_leit[st.session_state.df_leit[anmeldeart_col] == anmeldeart]
             
             erledigungs_daten = pd.to_datetime(anmeldeart_data['Datum Ende - CUSFIN'], errors='coerce').dropna()
@@ -2990,13 +5378,7 @@ def show_all_imports():
             file_type="4.1 Import EZA",
             file_key="importdatei_eza",
             session_key="df_import_eza",
-            required_cols=[
-                ['Registriernummer/MRN', 'Registriernummer / MRN', 'MRN'],
-                ['PositionNo'],
-                ['Warentarifnummer'],
-                ['Zollwert'],
-                ['AbgabeZollsatz']
-            ],
+            required_cols=IMPORT_PFLICHTSPALTEN['IMDC'],
             special_processing="eza"
         )
     
@@ -3006,14 +5388,7 @@ def show_all_imports():
             file_type="4.2 Import ZL / VAV",
             file_key="importdatei_zl",
             session_key="df_import_zl",
-            required_cols=[
-                ['Registriernummer/MRN', 'Registriernummer / MRN', 'MRN', 'Registrienummer/MRN'],
-                ['PositionNo'],
-                ['Warentarifnummer'],
-                ['Vorraussichtliche Zollabgabe', 'Voraussichtliche Zollabgabe'],
-                ['Vorraussichtliche Zollsatzabgabe', 'Voraussichtliche Zollsatzabgabe'],
-                ['DV1UmgerechnerterRechnungsbetrag']
-            ],
+            required_cols=IMPORT_PFLICHTSPALTEN['WIDS'],
             special_processing=None
         )
     
@@ -3023,10 +5398,7 @@ def show_all_imports():
             file_type="4.3 NCTS",
             file_key="nctsdatei",
             session_key="df_ncts",
-            required_cols=[
-                ['MRN'],
-                ['Sicherheit']
-            ],
+            required_cols=IMPORT_PFLICHTSPALTEN['NCDP'],
             special_processing=None
         )
 
@@ -3077,32 +5449,12 @@ def process_import_upload(anmeldeart, file_type, file_key, session_key, required
                 
                 with st.spinner(f"🔄 {file_type} wird verarbeitet..."):
                     try:
-                        df_import = pd.read_excel(io.BytesIO(file_bytes))
-                        
-                        if special_processing == "eza":
-                            original_col_count = len(df_import.columns)
-                            original_row_count = len(df_import)
-                            
-                            if st.session_state.get('eza_auto_reduce', True) and original_col_count > len(EXAKTE_EZA_SPALTEN):
-                                found_columns = [col for col in EXAKTE_EZA_SPALTEN if col in df_import.columns]
-                                if len(found_columns) >= 5:
-                                    df_import = df_import[found_columns].copy()
-                            
-                            if len(df_import.columns) >= 6:
-                                col_E = df_import.columns[4]
-                                col_F = df_import.columns[5]
-                                df_import = df_import.drop_duplicates(subset=[col_E, col_F], keep='first')
-                                removed_count = original_row_count - len(df_import)
-                            else:
-                                removed_count = 0
-                            
-                            unique_count = len(df_import)
+                        with profil_span(st.session_state.setdefault('ingest_profil', {}), f'Ingest {file_type}') as messung:
+                            df_import = pd.read_excel(io.BytesIO(file_bytes))
                             
-                            df_import = process_eza_be_anteil(df_import)
-                            multiplied_count = len(df_import) - unique_count
-                            
-                            df_import.attrs['removed_duplicates'] = removed_count
-                            df_import.attrs['be_multiplied'] = multiplied_count
+                            if special_processing == "eza":
+                                df_import = prepare_eza_import(df_import, st.session_state.get('eza_auto_reduce', True))
+                            messung['zeilen'] = len(df_import)
                         
                         validate_dataframe(df_import, required_cols, file_type)
                         
@@ -3120,6 +5472,17 @@ def process_import_upload(anmeldeart, file_type, file_key, session_key, required
         st.info("Nicht benötigt")
         st.session_state[session_key] = None
 
+def find_missing_imports(stats, df_import_eza, df_import_zl, df_ncts):
+    """Liefert die Importdateien, die laut Leitdatei-Statistik benötigt werden, aber fehlen"""
+    missing_files = []
+    if stats.get("IMDC", 0) > 0 and df_import_eza is None:
+        missing_files.append("Import EZA")
+    if stats.get("WIDS", 0) > 0 and df_import_zl is None:
+        missing_files.append("Import ZL")
+    if stats.get("NCDP", 0) > 0 and not is_dataframe_valid(df_ncts):
+        missing_files.append("NCTS")
+    return missing_files
+
 def show_processing_button():
     """Zeigt Verarbeitungs-Button wenn alle Dateien vorhanden"""
     if (st.session_state.df_import_eza is not None or st.session_state.df_import_zl is not None or 
@@ -3176,118 +5539,216 @@ def show_processing_button():
             datum = st.session_state.get('buergschaft_erhöhung_datum', date.today())
             st.info(f"💰 Bürgschaftserhöhung: +{betrag:,.0f} € am {datum.strftime('%d.%m.%Y')} aktiviert")
         
-        can_process = True
-        missing_files = []
-        
-        if st.session_state.stats.get("IMDC", 0) > 0 and st.session_state.df_import_eza is None:
-            can_process = False
-            missing_files.append("Import EZA")
-        
-        if st.session_state.stats.get("WIDS", 0) > 0 and st.session_state.df_import_zl is None:
-            can_process = False
-            missing_files.append("Import ZL")
-        
-        if st.session_state.stats.get("NCDP", 0) > 0 and not is_dataframe_valid(st.session_state.get('df_ncts')):
-            can_process = False
-            missing_files.append("NCTS")
+        missing_files = find_missing_imports(
+            st.session_state.stats, st.session_state.df_import_eza, st.session_state.df_import_zl, st.session_state.get('df_ncts')
+        )
+        can_process = not missing_files
         
         if not can_process:
             st.error(f"Fehlende Dateien: {', '.join(missing_files)}")
         else:
             st.markdown("")
-            if st.button("🚀 Verarbeitung starten", use_container_width=True,
+            st.checkbox(
+                "⚡ Delta-Modus (nur neue/geänderte Leitdatei-Zeilen verarbeiten)", key='delta_modus',
+                help="Kumulative Leitdateien: Zeilen werden über LRN, MRN SumA und SumA-Position mit dem letzten Lauf dieses Mandanten verglichen. Unveränderte Zeilen werden übernommen."
+            )
+            if is_job_queue_active() and is_mandant_job_running():
+                st.info("⏳ Für diesen Mandanten läuft bereits eine Verarbeitung - der Fortschritt wird unten angezeigt.")
+            elif st.button("🚀 Verarbeitung starten", use_container_width=True,
                         help="Startet die Berechnung der Bürgschaftsbelastung mit allen hochgeladenen Dateien"):
-                st.info("🔄 Verarbeitung wurde gestartet...")
-                process_data()
+                if is_job_queue_active():
+                    start_processing_job()
+                    st.rerun()
+                else:
+                    st.info("🔄 Verarbeitung wurde gestartet...")
+                    process_data()
 
 # === HISTORIE FUNKTIONEN ===
 
-def get_history_file():
-    """Gibt den Pfad zur Historie-Datei zurück"""
-    if 'mandant' not in st.session_state:
-        return None
+HISTORIE_SEITENGROESSE = 25
+
+def count_history(zeitraum=None, mandant_key=None):
+    """Zählt die Historie-Einträge des Mandanten (optional für einen Bürgschaftszeitraum)"""
+    mandant_key = mandant_key or get_mandant_key()
+    if not mandant_key:
+        return 0
+    
+    query = 'SELECT COUNT(*) FROM runs WHERE mandant = ?'
+    params = [mandant_key]
+    if zeitraum:
+        query += ' AND von_datum = ? AND bis_datum = ?'
+        params.extend(zeitraum)
+    
+    try:
+        with db_verbindung() as conn:
+            return conn.execute(query, params).fetchone()[0]
+    except sqlite3.Error:
+        return 0
+
+def load_history_zeitraeume(mandant_key=None):
+    """Lädt alle Bürgschaftszeiträume, für die Historie-Einträge existieren (ISO-Daten)"""
+    mandant_key = mandant_key or get_mandant_key()
+    if not mandant_key:
+        return []
     
-    mandant_clean = st.session_state['mandant'].lower().replace(' ', '_')
-    return f"historie_{mandant_clean}.json"
+    with db_verbindung() as conn:
+        rows = conn.execute(
+            'SELECT DISTINCT von_datum, bis_datum FROM runs WHERE mandant = ? ORDER BY von_datum DESC, bis_datum DESC',
+            (mandant_key,)
+        ).fetchall()
+    return [(row['von_datum'], row['bis_datum']) for row in rows]
 
-def load_history():
-    """Lädt die Historie aus der Datei"""
-    history_file = get_history_file()
-    if not history_file or not os.path.exists(history_file):
+def load_history(limit=HISTORIE_SEITENGROESSE, offset=0, zeitraum=None, mandant_key=None):
+    """Lädt nur die angezeigten Historie-Einträge (neueste zuerst) ohne Statistiken und Artefakte"""
+    mandant_key = mandant_key or get_mandant_key()
+    if not mandant_key:
         return []
     
+    query = """SELECT id, timestamp, von_datum, bis_datum, zeilen, startbuergschaft, max_auslastung
+               FROM runs WHERE mandant = ?"""
+    params = [mandant_key]
+    if zeitraum:
+        query += ' AND von_datum = ? AND bis_datum = ?'
+        params.extend(zeitraum)
+    query += ' ORDER BY timestamp DESC LIMIT ? OFFSET ?'
+    params.extend([limit, offset])
+    
     try:
-        with open(history_file, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except Exception:
+        with db_verbindung() as conn:
+            rows = conn.execute(query, params).fetchall()
+    except sqlite3.Error:
         return []
+    
+    return [{
+        'id': row['id'],
+        'timestamp': row['timestamp'],
+        'von_datum': iso_to_german_date(row['von_datum']),
+        'bis_datum': iso_to_german_date(row['bis_datum']),
+        'zeilen': row['zeilen'],
+        'startbuergschaft': row['startbuergschaft'],
+        'max_auslastung': row['max_auslastung']
+    } for row in rows]
 
-def save_history(history):
-    """Speichert die Historie in die Datei"""
-    history_file = get_history_file()
-    if not history_file:
-        return
+def load_history_entry(run_id):
+    """Lädt einen vollständigen Historie-Eintrag (Statistiken, Parameter) für die Detailansicht"""
+    with db_verbindung() as conn:
+        row = conn.execute('SELECT * FROM runs WHERE id = ?', (run_id,)).fetchone()
+        if not row:
+            return None
+        
+        processing_stats = {
+            r['schluessel']: r['wert']
+            for r in conn.execute('SELECT schluessel, wert FROM processing_stats WHERE run_id = ?', (run_id,))
+        }
+        config = {
+            r['name']: json.loads(r['wert_json'])
+            for r in conn.execute('SELECT name, wert_json FROM run_parameter WHERE run_id = ?', (run_id,))
+        }
+        profil = {
+            r['stufe']: {
+                'zeilen': r['zeilen'],
+                'wand_s': r['wand_s'],
+                'cpu_s': r['cpu_s'],
+                'rss_delta_mb': r['rss_delta_mb'],
+                'cache': bool(r['aus_cache'])
+            }
+            for r in conn.execute('SELECT * FROM run_profil WHERE run_id = ? ORDER BY position', (run_id,))
+        }
+    
+    return {
+        'id': row['id'],
+        'mandant': row['mandant'],
+        'timestamp': row['timestamp'],
+        'von_datum': iso_to_german_date(row['von_datum']),
+        'bis_datum': iso_to_german_date(row['bis_datum']),
+        'zeilen': row['zeilen'],
+        'startbuergschaft': row['startbuergschaft'],
+        'max_auslastung': row['max_auslastung'],
+        'stats': json.loads(row['stats_json']) if row['stats_json'] else {},
+        'processing_stats': processing_stats,
+        'config': config,
+        'profil': profil
+    }
+
+def save_history(entry, excel_bytes):
+    """Speichert einen Historie-Eintrag in der Datenbank"""
+    mandant_key = get_mandant_key()
+    if not mandant_key:
+        return None
     
     try:
-        with open(history_file, 'w', encoding='utf-8') as f:
-            json.dump(history, f, indent=2, ensure_ascii=False)
-    except Exception as e:
+        with db_verbindung() as conn:
+            return insert_history_run(conn, mandant_key, entry, excel_bytes)
+    except (sqlite3.Error, OSError) as e:
         st.error(f"❌ Fehler beim Speichern der Historie: {e}")
+        return None
 
-def save_to_history():
-    """Speichert die aktuelle Verarbeitung in der Historie"""
-    if not all([
-        'excel_file' in st.session_state,
-        'von_datum' in st.session_state,
-        'bis_datum' in st.session_state,
-        'ziel_sorted' in st.session_state
-    ]):
-        return
-    
-    import base64
+def get_history_basis(werte=None):
+    """Zeitraum, Statistiken und Konfiguration des Laufs für den Historie-Eintrag (beim Start festgehalten)"""
+    werte = st.session_state if werte is None else werte
+    if 'von_datum' not in werte or 'bis_datum' not in werte:
+        return None
     
-    history = load_history()
+    return {
+        'von_datum': werte['von_datum'].strftime('%d.%m.%Y'),
+        'bis_datum': werte['bis_datum'].strftime('%d.%m.%Y'),
+        'startbuergschaft': werte.get('startbuergschaft', 0),
+        'stats': werte.get('stats', {}),
+        'config': {
+            'pauschalbetrag': werte.get('pauschalbetrag', 10000),
+            'ersatz_zollsatz': werte.get('zollsatz_ersatz', 0.12),
+            'buergschaft_erhöhung_aktiv': werte.get('buergschaft_erhöhung_aktiv', False),
+            'buergschaft_erhöhung_datum': werte.get('buergschaft_erhöhung_datum', date.today()).strftime('%d.%m.%Y') if werte.get('buergschaft_erhöhung_aktiv', False) else None,
+            'buergschaft_erhöhung_betrag': werte.get('buergschaft_erhöhung_betrag', 0) if werte.get('buergschaft_erhöhung_aktiv', False) else None
+        }
+    }
+
+def save_to_history(basis=None):
+    """Speichert die aktuelle Verarbeitung in der Historie"""
+    basis = basis or get_history_basis()
+    if basis is None or 'excel_file' not in st.session_state or 'ziel_sorted' not in st.session_state:
+        return None
     
     # Erstelle Historie-Eintrag
     entry = {
+        **basis,
         'timestamp': datetime.now().isoformat(),
-        'von_datum': st.session_state['von_datum'].strftime('%d.%m.%Y'),
-        'bis_datum': st.session_state['bis_datum'].strftime('%d.%m.%Y'),
         'zeilen': len(st.session_state['ziel_sorted']),
-        'startbuergschaft': st.session_state.get('startbuergschaft', 0),
         'max_auslastung': st.session_state.get('max_auslastung', 'N/A'),
-        'excel_data': base64.b64encode(st.session_state['excel_file']).decode('utf-8'),
-        'stats': st.session_state.get('stats', {}),
-        'processing_stats': st.session_state.get('processing_stats', {}),
-        'config': {
-            'pauschalbetrag': st.session_state.get('pauschalbetrag', 10000),
-            'ersatz_zollsatz': st.session_state.get('zollsatz_ersatz', 0.12),
-            'buergschaft_erhöhung_aktiv': st.session_state.get('buergschaft_erhöhung_aktiv', False),
-            'buergschaft_erhöhung_datum': st.session_state.get('buergschaft_erhöhung_datum', date.today()).strftime('%d.%m.%Y') if st.session_state.get('buergschaft_erhöhung_aktiv', False) else None,
-            'buergschaft_erhöhung_betrag': st.session_state.get('buergschaft_erhöhung_betrag', 0) if st.session_state.get('buergschaft_erhöhung_aktiv', False) else None
-        }
+        'processing_stats': st.session_state.get('processing_stats', {})
     }
     
-    # Füge am Anfang hinzu
-    history.insert(0, entry)
-    
-    # Behalte nur die letzten 30 Einträge
-    history = history[:30]
+    return save_history(entry, st.session_state['excel_file'])
+
+def save_result_to_history(mandant_key, ergebnis):
+    """Speichert ein Verarbeitungsergebnis ohne Session in der Historie (z.B. Jobs über die API)"""
+    saldo = ergebnis['saldo']
+    entry = {
+        **ergebnis['historie_basis'],
+        'timestamp': datetime.now().isoformat(),
+        'zeilen': len(ergebnis['ziel_sorted']),
+        'max_auslastung': f"{saldo['max_auslastung']:.1f}%" if saldo['max_auslastung'] is not None else 'N/A',
+        'processing_stats': ergebnis['stats']
+    }
     
-    save_history(history)
+    with profil_span(ergebnis['profiler'], 'Historie speichern'):
+        with db_verbindung() as conn:
+            run_id = insert_history_run(conn, mandant_key, entry, ergebnis['excel_file'])
+    save_run_profil(run_id, ergebnis['profiler'])
+    return run_id
 
 def show_history_page():
     """Zeigt die Historie-Seite mit verbesserter Radio-Button-Tabellen-Ansicht"""
     st.title("📊 Bürgschaftsverlauf")
     
-    history = load_history()
+    gesamt_anzahl = count_history()
     
-    if not history:
+    if not gesamt_anzahl:
         st.info("ℹ️ Noch keine Historie vorhanden.")
         st.write("Nach der ersten erfolgreichen Verarbeitung werden hier alle Ihre Verarbeitungen gespeichert.")
         return
     
-    st.success(f"✅ {len(history)} gespeicherte Verarbeitungen")
+    st.success(f"✅ {gesamt_anzahl} gespeicherte Verarbeitungen")
     
     # Erstelle 40-60 Layout
     col_left, col_right = st.columns([2, 3])
@@ -3296,6 +5757,26 @@ def show_history_page():
         st.subheader("📋 Verarbeitungen auswählen")
         st.caption("Wählen Sie einen Eintrag aus der Liste")
         
+        # Filter nach Bürgschaftszeitraum (nutzt den Index mandant/Zeitraum)
+        zeitraeume = load_history_zeitraeume()
+        zeitraum = None
+        if len(zeitraeume) > 1:
+            zeitraum_labels = ["Alle Zeiträume"] + [
+                f"{iso_to_german_date(von)} - {iso_to_german_date(bis)}" for von, bis in zeitraeume
+            ]
+            zeitraum_auswahl = st.selectbox("Bürgschaftszeitraum", zeitraum_labels, key="history_zeitraum")
+            if zeitraum_auswahl != "Alle Zeiträume":
+                zeitraum = zeitraeume[zeitraum_labels.index(zeitraum_auswahl) - 1]
+        
+        # Seitenweise Abfrage - es werden nur die angezeigten Zeilen geladen
+        anzahl = count_history(zeitraum) if zeitraum else gesamt_anzahl
+        seiten = max(1, (anzahl + HISTORIE_SEITENGROESSE - 1) // HISTORIE_SEITENGROESSE)
+        seite = 1
+        if seiten > 1:
+            seite = st.number_input(f"Seite (von {seiten})", min_value=1, max_value=seiten, value=1, step=1, key="history_seite")
+        offset = (seite - 1) * HISTORIE_SEITENGROESSE
+        history = load_history(HISTORIE_SEITENGROESSE, offset, zeitraum)
+        
         # Erstelle Header
         st.markdown("""
         <div style="font-family: monospace; font-size: 0.9em; color: #666; margin-bottom: 5px;">
@@ -3310,15 +5791,15 @@ def show_history_page():
             timestamp = datetime.fromisoformat(entry['timestamp'])
             
             # Formatiere mit festen Breiten
-            nr = f"{i+1:02d}"  # Immer 2-stellig
+            nr = f"{offset+i+1:02d}"  # Mindestens 2-stellig
             datum = timestamp.strftime('%d.%m.%Y')  # Immer 10 Zeichen
             zeit = timestamp.strftime('%H:%M')  # Immer 5 Zeichen
             von_dt = datetime.strptime(entry['von_datum'], '%d.%m.%Y')
             bis_dt = datetime.strptime(entry['bis_datum'], '%d.%m.%Y')
-            zeitraum = f"{von_dt.strftime('%m-%Y')} bis {bis_dt.strftime('%m-%Y')}"
+            zeitraum_text = f"{von_dt.strftime('%m-%Y')} bis {bis_dt.strftime('%m-%Y')}"
             
             # Verwende Pipes als Trenner
-            option = f"{nr} | {datum} | {zeit} | {zeitraum}"
+            option = f"{nr} | {datum} | {zeit} | {zeitraum_text}"
             options.append(option)
         
         # Radio-Buttons mit formatierter Liste
@@ -3338,7 +5819,7 @@ def show_history_page():
     with col_right:
         if selected:
             index = options.index(selected)
-            entry = history[index]
+            entry = load_history_entry(history[index]['id'])
             
             st.subheader("📄 Details zur ausgewählten Verarbeitung")
             
@@ -3358,24 +5839,25 @@ def show_history_page():
             
             col1, col2 = st.columns(2)
             
-            import base64
-            
             with col1:
-                excel_data = base64.b64decode(entry['excel_data'])
+                excel_data = load_history_artifact(entry['id'], 'excel')
                 
                 mandant_prefix = st.session_state.get('mandant', 'Unbekannt')[:3].upper()
                 von_dt = datetime.strptime(entry['von_datum'], '%d.%m.%Y')
                 bis_dt = datetime.strptime(entry['bis_datum'], '%d.%m.%Y')
                 excel_filename = f"Verwahrliste_{mandant_prefix}_{von_dt.strftime('%m_%y')}#{bis_dt.strftime('%m_%y')}_Historie.xlsx"
                 
-                st.download_button(
-                    label="📊 Excel herunterladen",
-                    data=excel_data,
-                    file_name=excel_filename,
-                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                    use_container_width=True,
-                    type="primary"
-                )
+                if excel_data:
+                    st.download_button(
+                        label="📊 Excel herunterladen",
+                        data=excel_data,
+                        file_name=excel_filename,
+                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                        use_container_width=True,
+                        type="primary"
+                    )
+                else:
+                    st.warning("⚠️ Excel-Datei dieses Laufs ist nicht mehr vorhanden.")
             
             with col2:
                 if st.button("📄 Dokumentation erstellen", use_container_width=True, type="secondary"):
@@ -3490,6 +5972,12 @@ def show_history_page():
                     if protocol_data:
                         df_protocol = pd.DataFrame(protocol_data)
                         st.dataframe(df_protocol, hide_index=True, use_container_width=True)
+
+                # Laufzeitprotokoll
+                if entry.get('profil'):
+                    st.markdown("---")
+                    st.subheader("⏱️ Laufzeiten")
+                    display_laufzeitprotokoll(entry['profil'])
         else:
             st.info("👈 Wählen Sie links einen Eintrag aus, um Details anzuzeigen")
 
@@ -3524,8 +6012,8 @@ def main():
         # HISTORIE-HOOK: Historie-Tab hinzufügen
         selected = option_menu(
             menu_title=None,
-            options=["Verarbeitung", "Downloads", "Bürgschaftsverlauf", "Einstellungen"],
-            icons=["clipboard-data", "download", "clock-history", "gear"],
+            options=["Verarbeitung", "Downloads", "Bürgschaftsverlauf", "Jobs", "Einstellungen"],
+            icons=["clipboard-data", "download", "clock-history", "list-task", "gear"],
             default_index=1 if has_downloads and st.session_state.get('show_downloads', False) else 0,
             orientation="horizontal",
             styles={
@@ -3554,6 +6042,8 @@ def main():
             show_downloads_section()
         elif selected == "Bürgschaftsverlauf":
             show_history_page()
+        elif selected == "Jobs":
+            show_jobs_page()
         elif selected == "Einstellungen":
             show_settings_page()
 
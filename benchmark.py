@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+"""buergcontrolBASE Benchmark - synthetische ATLAS-Daten und Zeitmessung je Verarbeitungsstufe
+
+Aufruf:
+    python benchmark.py --groessen 10000 100000 1000000 --ausgabe benchmark_ergebnis.json
+    python benchmark.py --groessen 10000 --mix "IMDC=0.5,WIDS=0.2,NCDP=0.1,(leer)=0.2" --xlsx
+"""
+
+import argparse
+import io
+import json
+import logging
+import platform
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import app
+
+# Streamlit meldet im Bare-Mode bei jedem st.*-Aufruf einen fehlenden ScriptRunContext
+for logger_name in list(logging.root.manager.loggerDict):
+    if logger_name.startswith('streamlit'):
+        logging.getLogger(logger_name).setLevel(logging.ERROR)
+
+STANDARD_GROESSEN = [10000]
+
+# Anteil der Anmeldearten an der Leitdatei (angelehnt an reale Mandantendaten)
+STANDARD_MIX = {
+    'IMDC': 0.30,
+    'WIDS': 0.15,
+    'IPDC': 0.10,
+    'NCDP': 0.12,
+    '(leer)': 0.12,
+    'APDC': 0.05,
+    'AVDC': 0.03,
+    'NCAR': 0.05,
+    'SUSP': 0.05,
+    'SUDC': 0.03
+}
+
+BENCHMARK_PARAMETER = {
+    'startbuergschaft': 2000000.0,
+    'buergschaft_erhöhung_aktiv': False
+}
+
+# === DATENGENERATOR ===
+
+def parse_mix(text):
+    """Liest einen Anmeldeart-Mix im Format 'IMDC=0.3,WIDS=0.2,(leer)=0.1'"""
+    mix = {}
+    for teil in text.split(','):
+        art, anteil = teil.split('=')
+        mix[art.strip()] = float(anteil)
+    return mix
+
+def _nummern(prefix, werte, stellen):
+    """Erzeugt fortlaufende Registriernummern (Prefix + nullgefüllte Zahl)"""
+    return (prefix + pd.Series(werte).astype(str).str.zfill(stellen)).to_numpy(dtype=object)
+
+def generate_testdaten(zeilen, mix=None, seed=42, start=datetime(2024, 5, 1), tage=365):
+    """Erzeugt Leitdatei, EZA (mit BE-Anteil), ZL/VAV, NCTS und NCAR in der Struktur der ATLAS-Exporte"""
+    rng = np.random.default_rng(seed)
+    mix = mix or STANDARD_MIX
+
+    arten = np.array(list(mix.keys()), dtype=object)
+    anteile = np.array(list(mix.values()), dtype=float)
+    art = arten[rng.choice(len(arten), zeilen, p=anteile / anteile.sum())]
+    idx = np.arange(zeilen)
+
+    gestell = pd.Timestamp(start) + pd.to_timedelta(rng.integers(0, tage * 86400, zeilen), unit='s')
+    ende = gestell + pd.to_timedelta(rng.integers(3600, 40 * 86400, zeilen), unit='s')
+    mrn_suma = _nummern('24DE2604E', idx, 9)
+    reg = _nummern('24DE2604JCA', idx, 7)
+    position_suma = rng.integers(1, 30, zeilen)
+
+    # Weitere Registriernummer: teils ATB (wird übersprungen), teils eigene MRN, sonst leer
+    zufall = rng.random(zeilen)
+    weitere = np.full(zeilen, np.nan, dtype=object)
+    atb = zufall < 0.05
+    weitere[atb] = _nummern('ATB', idx[atb], 18)
+    mit_weitere = ~atb & np.isin(art, ['IMDC', 'WIDS', 'IPDC']) & (zufall < 0.55)
+    weitere[mit_weitere] = _nummern('24DE9999X', idx[mit_weitere], 9)
+
+    zollbetrag = np.round(rng.uniform(0, 300, zeilen), 2)
+
+    leit = pd.DataFrame({
+        'Teilnehmer': 'NIPG',
+        'Niederlassung SumA': 'DUAO',
+        'Datum Überlassung - CUSTST': gestell,
+        'Datum Ende - CUSFIN': ende,
+        'Bezugsnummer/LRN SumA': _nummern('LRN', idx, 10),
+        'Registriernummer/MRN SumA': mrn_suma,
+        'Weitere Registriernummer SumA': _nummern('ATB15', idx, 16),
+        'Position SumA': position_suma,
+        'Warennummer SumA': np.nan,
+        'Warenbeschreibung SumA': rng.choice(['Personalkleidung', 'PERSONAL EFFECTS', 'Ersatzteile', 'Elektronik'], zeilen),
+        'Verwahrungsort SumA': 'N/A - Niederlassung Düsseldorf',
+        'Niederlassung Folgeverfahren': 'DUAO',
+        'Anmeldeart Folgeverfahren': np.where(art == '(leer)', np.nan, art),
+        'Registriernummer Folgeverfahren': reg,
+        'Weitere Registriernummer Folgeverfahren': weitere,
+        'Zollwert Folgeverfahren': np.round(rng.uniform(0, 5000, zeilen) * (rng.random(zeilen) < 0.6), 2),
+        'Zollbetrag Folgeverfahren': zollbetrag,
+        'Verwahrdauer': (ende - gestell).days + 1,
+        'Zollbetrag': zollbetrag
+    })
+
+    def import_zeilen(anmeldeart):
+        """Leitdatei-Zeilen mit Importanmeldung (85 %) und ihre Positionen (1-3)"""
+        quelle = np.flatnonzero((art == anmeldeart) & (rng.random(zeilen) < 0.85))
+        quelle = np.repeat(quelle, rng.integers(1, 4, len(quelle)))
+        position = pd.Series(quelle).groupby(quelle).cumcount().to_numpy() + 1
+        # Import-MRN: meist die weitere Registriernummer, sonst die Registriernummer
+        gueltig = pd.notna(weitere[quelle]) & ~atb[quelle]
+        mrn = np.where(gueltig & (rng.random(len(quelle)) < 0.7), weitere[quelle], reg[quelle])
+        return quelle, position, mrn
+
+    quelle, position, mrn = import_zeilen('IMDC')
+    anzahl = len(quelle)
+    zollwert = np.round(rng.uniform(10, 20000, anzahl) * (rng.random(anzahl) < 0.9), 2)
+    zollsatz = rng.choice([0.0, 0.0, 2.7, 4.5, 12.0], anzahl)
+    be_anteil = mrn_suma[quelle] + ' - POS ' + position_suma[quelle].astype(str)
+    mehrfach = rng.random(anzahl) < 0.1
+    be_anteil[mehrfach] = be_anteil[mehrfach] + ', ' + mrn_suma[quelle[mehrfach]] + ' - POS ' + (position_suma[quelle[mehrfach]] + 1).astype(str)
+
+    eza = pd.DataFrame({
+        'Teilnehmer': 40100,
+        'Anmeldeart_A': 'IM',
+        'Verfahren': 'IMDC',
+        'Bezugsnummer/LRN': _nummern('FL', quelle, 10),
+        'Anlagedatum': gestell[quelle],
+        'Zeit': '08:00:00',
+        'Überlassungsdatum': gestell[quelle].normalize(),
+        'Registriernummer/MRN': mrn,
+        'PositionNo': position,
+        'Zollwert': zollwert,
+        'AbgabeZoll': np.round(zollwert * zollsatz / 100, 2),
+        'AbgabeZollsatz': zollsatz,
+        'Eustwert': np.round(zollwert * 1.02, 2),
+        'AbgabeEust': np.round(zollwert * 1.02 * 0.19, 2),
+        'Warentarifnummer': rng.integers(10**10, 10**11, anzahl),
+        'BEAnteil SumA': np.where(rng.random(anzahl) < 0.6, be_anteil, '')
+    })
+    # Mehrfach exportierte Positionen (werden bei der EZA-Aufbereitung entfernt)
+    eza = pd.concat([eza, eza.sample(frac=0.02, random_state=seed)], ignore_index=True)
+
+    quelle, position, mrn = import_zeilen('WIDS')
+    anzahl = len(quelle)
+    zollsatz = rng.choice([0.0, 2.7, 4.5], anzahl)
+    zl = pd.DataFrame({
+        'Teilnehmer': 40100,
+        'Verfahren': 'WIDS',
+        'Registrienummer/MRN': mrn,
+        'PositionNo': position,
+        'Warentarifnummer': rng.integers(10**7, 10**8, anzahl),
+        'Vorraussichtliche Zollabgabe': np.where(zollsatz > 0, np.round(rng.uniform(0, 500, anzahl), 2), 0.0),
+        'Vorraussichtliche Zollsatzabgabe': zollsatz,
+        'DV1UmgerechnerterRechnungsbetrag': np.round(rng.uniform(0, 9000, anzahl), 2)
+    })
+
+    quelle = np.flatnonzero((art == 'NCDP') & (rng.random(zeilen) < 0.85))
+    betraege = rng.uniform(100, 20000, len(quelle))
+    ncts = pd.DataFrame({
+        'Bezugsnummer': _nummern('NKR-', quelle, 8),
+        'Land': 'DE',
+        'MRN': reg[quelle],
+        'Sicherheit': [
+            '{"Sicherheit Nr":1,"Art":"1","Andere Form":null,"Sicherheitsleistungen":"{Leistung Nr: 1 Konto: GE001039 '
+            f'Sicherheit: {betrag:.2f} Prozentwarenwert: 25.00% Umgerechnete Sicherheit:{betrag:.2f} EUR}} "}}'
+            for betrag in betraege
+        ],
+        'Annahme': gestell[quelle],
+        'Überlassung': gestell[quelle],
+        'Erledigung': ende[quelle],
+        'Status': 'Erledigung',
+        'Empfänger': 'Mustermann GmbH',
+        'NL': 'FRAO'
+    })
+
+    quelle = np.flatnonzero(rng.random(zeilen) < 0.1)
+    ncar = pd.DataFrame({
+        'Niederlassung': 'HAMO',
+        'Bezugsnummer (NCAR)': _nummern('ZOLL', quelle, 8),
+        'RegistriernNr./MRN': _nummern('25CH042C', quelle, 10),
+        'Anzahl Positionen': 1,
+        'Anzahl Packstücke': rng.integers(1, 80, len(quelle)),
+        'Registriernr.-SumA': mrn_suma[quelle],
+        'Status': 'Beendigung abgeschlossen'
+    })
+
+    return {'leit': leit, 'eza': eza, 'zl': zl, 'ncts': ncts, 'ncar': ncar}
+
+# === MESSUNG ===
+
+def get_max_rss_mb():
+    """Höchster Arbeitsspeicher des Prozesses bisher (MB, gerundet)"""
+    max_rss = app.get_max_rss_mb()
+    return None if max_rss is None else round(max_rss, 1)
+
+@contextmanager
+def messe_stufe(ergebnisse, stufe, zeilen=None, speicher=True):
+    """Misst Laufzeit und Speicher-Peak einer Stufe und hängt das Ergebnis an"""
+    if speicher:
+        tracemalloc.reset_peak()
+    start = time.perf_counter()
+    messung = {'stufe': stufe, 'zeilen': zeilen}
+    try:
+        yield messung
+    finally:
+        messung['sekunden'] = round(time.perf_counter() - start, 4)
+        if speicher:
+            messung['speicher_peak_mb'] = round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 1)
+        messung['max_rss_mb'] = get_max_rss_mb()
+        ergebnisse.append(messung)
+
+def run_benchmark(daten, params, xlsx=False, speicher=True):
+    """Führt die Verarbeitung Stufe für Stufe aus (ohne UI) und misst jede Stufe"""
+    ergebnisse = []
+    if speicher:
+        tracemalloc.start()
+
+    try:
+        if xlsx:
+            # Ingest wie beim Upload: Excel-Bytes lesen (Erzeugen der Dateien wird nicht gemessen)
+            for name in ['leit', 'eza', 'zl', 'ncts', 'ncar']:
+                puffer = io.BytesIO()
+                daten[name].to_excel(puffer, index=False)
+                with messe_stufe(ergebnisse, f'ingest_{name}', len(daten[name]), speicher):
+                    daten[name] = pd.read_excel(io.BytesIO(puffer.getvalue()))
+
+        with messe_stufe(ergebnisse, 'eza_aufbereitung', len(daten['eza']), speicher) as messung:
+            df_eza = app.prepare_eza_import(daten['eza'])
+            messung['zeilen_danach'] = len(df_eza)
+
+        with messe_stufe(ergebnisse, 'statistik', len(daten['leit']), speicher):
+            leit_stats = app.calculate_statistics(daten['leit'], 'Anmeldeart Folgeverfahren')
+
+        with messe_stufe(ergebnisse, 'normalisierung', len(daten['leit']), speicher):
+            df_leit, data_sources, field_mappings = app.normalize_inputs(
+                daten['leit'], df_eza, daten['zl'], daten['ncts']
+            )
+
+        # Matching in der Reihenfolge von create_match_table, aber je Anmeldeart gemessen
+        stats = defaultdict(int)
+        match_table = []
+        quellen = {'IMDC': 'df_import_eza', 'WIDS': 'df_import_zl', 'NCDP': 'df_ncts'}
+        for anmeldeart in app.VERARBEITBARE_ARTEN:
+            anzahl = len(app.get_partition_positionen(data_sources['leit_partition'], anmeldeart))
+            if anzahl == 0 or (anmeldeart in quellen and data_sources[quellen[anmeldeart]].empty):
+                continue
+            with messe_stufe(ergebnisse, f'matching_{anmeldeart}', anzahl, speicher):
+                match_table.extend(app.process_anmeldeart_generic(
+                    anmeldeart, df_leit, data_sources['leit_partition'], data_sources, field_mappings, stats, params
+                ))
+
+        pauschale_arten = [art for art in app.PAUSCHALE_ARTEN if leit_stats.get(art, 0) > 0]
+        with messe_stufe(ergebnisse, 'matching_pauschale', sum(leit_stats[art] for art in pauschale_arten), speicher):
+            match_table.extend(app.process_pauschale_anmeldearten(
+                df_leit, data_sources['leit_partition'], field_mappings, stats, pauschale_arten
+            ))
+
+        with messe_stufe(ergebnisse, 'preise', len(match_table), speicher):
+            puffer = app.create_ergebnis_puffer(len(match_table))
+            app.price_match_table(match_table, df_leit, data_sources, field_mappings, params, puffer)
+
+        with messe_stufe(ergebnisse, 'geschaeftsregeln', puffer['anzahl'], speicher):
+            puffer = app.apply_geschaeftsregeln(puffer, params)
+
+        with messe_stufe(ergebnisse, 'sortierung', puffer['anzahl'], speicher):
+            ziel = app.sort_dataframe_standard(app.build_ergebnis_frame(puffer)).reset_index(drop=True)
+
+        with messe_stufe(ergebnisse, 'bewegungen', len(ziel), speicher):
+            bewegungen_df = app.create_bewegungstabelle(ziel)
+
+        with messe_stufe(ergebnisse, 'saldo_und_sheets', len(bewegungen_df), speicher):
+            saldo_engine = app.calculate_saldo(bewegungen_df, params['startbuergschaft'], params)
+
+        with messe_stufe(ergebnisse, 'ergebnis_sheet', len(ziel), speicher):
+            ziel_mit_saldo = app.add_tagessummen_to_ziel(ziel, saldo_engine['daily_summary'], params)
+
+        with messe_stufe(ergebnisse, 'ncar', len(daten['ncar']), speicher):
+            ziel_mit_saldo, _ = app.enhance_ziel_with_ncar(ziel_mit_saldo, app.build_ncar_index(daten['ncar']))
+
+        with messe_stufe(ergebnisse, 'export', len(ziel_mit_saldo), speicher) as messung:
+            excel_bytes = app.create_excel_export({
+                'ziel_mit_saldo': ziel_mit_saldo,
+                'bewegungsdetails_df': saldo_engine['bewegungsdetails_df'],
+                'tageszusammenfassung_df': saldo_engine['tageszusammenfassung_df']
+            })
+            messung['bytes'] = len(excel_bytes)
+    finally:
+        if speicher:
+            tracemalloc.stop()
+
+    return ergebnisse, dict(stats)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark der Bürgschaftsverarbeitung mit synthetischen ATLAS-Daten")
+    parser.add_argument('--groessen', type=int, nargs='+', default=STANDARD_GROESSEN,
+                        help="Anzahl Leitdatei-Zeilen je Szenario, z.B. 10000 100000 1000000")
+    parser.add_argument('--mix', type=parse_mix, default=None,
+                        help="Anmeldeart-Mix, z.B. 'IMDC=0.3,WIDS=0.2,(leer)=0.1' (Standard: realer Mandanten-Mix)")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--xlsx', action='store_true',
+                        help="Eingangsdaten als Excel erzeugen und das Einlesen mitmessen (langsam bei großen Dateien)")
+    parser.add_argument('--ohne-speicher', action='store_true',
+                        help="Keine Speichermessung mit tracemalloc (geringerer Messaufwand)")
+    parser.add_argument('--ausgabe', default='benchmark_ergebnis.json', help="JSON-Datei für die Ergebnisse")
+    args = parser.parse_args()
+
+    params = {**app.get_processing_params(), **BENCHMARK_PARAMETER}
+
+    bericht = {
+        'zeitpunkt': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'plattform': platform.platform(),
+        'mix': args.mix or STANDARD_MIX,
+        'seed': args.seed,
+        'szenarien': []
+    }
+
+    for zeilen in args.groessen:
+        print(f"▶ {zeilen:,} Leitdatei-Zeilen: Testdaten werden erzeugt...".replace(',', '.'))
+        start = time.perf_counter()
+        daten = generate_testdaten(zeilen, args.mix, args.seed)
+        generierung = time.perf_counter() - start
+
+        stufen, stats = run_benchmark(daten, params, xlsx=args.xlsx, speicher=not args.ohne_speicher)
+
+        szenario = {
+            'zeilen': zeilen,
+            'eingaben': {name: len(df) for name, df in daten.items()},
+            'generierung_sekunden': round(generierung, 2),
+            'gesamt_sekunden': round(sum(stufe['sekunden'] for stufe in stufen), 4),
+            'max_rss_mb': get_max_rss_mb(),
+            'stufen': stufen,
+            'processing_stats': stats
+        }
+        bericht['szenarien'].append(szenario)
+
+        for stufe in stufen:
+            speicher_text = f"  {stufe['speicher_peak_mb']:>8.1f} MB" if 'speicher_peak_mb' in stufe else ''
+            print(f"   {stufe['stufe']:<20} {stufe['sekunden']:>9.3f} s{speicher_text}")
+        print(f"   {'GESAMT':<20} {szenario['gesamt_sekunden']:>9.3f} s")
+
+        # Nach jedem Szenario schreiben, damit lange Läufe nicht verloren gehen
+        with open(args.ausgabe, 'w', encoding='utf-8') as f:
+            json.dump(bericht, f, indent=2, ensure_ascii=False, default=str)
+
+    print(f"✅ Ergebnisse gespeichert: {args.ausgabe}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""buergcontrolBASE Paritätsprüfung - Legacy-Verarbeitung gegen aktuelle Engine (Excel-Reiter Zelle für Zelle,
+Reiter ATB-Ausschluss gegen die Anzahl der in der Legacy-Verarbeitung übersprungenen ATB-Zeilen)
+
+Aufruf:
+    python paritaet.py --demo
+    python paritaet.py --groessen 10000 100000 --erhoehung --warmlauf
+    python paritaet.py --demo --toleranz 0.005 --max-abweichungen 50
+
+Exit-Code 0 bei Parität, 1 bei Abweichungen.
+"""
+
+import argparse
+import importlib.util
+import io
+import logging
+import os
+import sys
+import tempfile
+import time
+from datetime import date
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+import app
+from benchmark import generate_testdaten
+
+for logger_name in list(logging.root.manager.loggerDict):
+    if logger_name.startswith('streamlit'):
+        logging.getLogger(logger_name).setLevel(logging.ERROR)
+
+BASIS_VERZEICHNIS = os.path.dirname(os.path.abspath(__file__))
+LEGACY_APP = os.path.join(BASIS_VERZEICHNIS, 'bcb01_cursor', 'legacy', 'app.py')
+DEMO_VERZEICHNIS = os.path.join(BASIS_VERZEICHNIS, 'bcb01_cursor', 'sample_data')
+DEMO_DATEIEN = {
+    'leit': '1 SumA_Leitdatei_Demo.xlsx',
+    'ncar': '1.1  NCAR_Demo.xlsx',
+    'eza': '2 Importverzollung_EZA_Demo.xlsx',
+    'zl': '3 Importverzollung_ZL_VAV_Demo.xlsx',
+    'ncts': '4 NCTS_Aus_Sich_Demo.xlsx'
+}
+
+PARITAETS_SHEETS = ['Ergebnis', 'Bewegungsdetails', 'Tageszusammenfassung']
+# Audit-Reiter der aktuellen Engine - die Legacy-Referenz zählt die übersprungenen ATB-Zeilen nur ('atb_filtered_count')
+AUDIT_SHEET = 'ATB-Ausschluss'
+
+PARITAETS_PARAMETER = {
+    'startbuergschaft': 2000000.0,
+    'pauschalbetrag': 10000.0,
+    'zollsatz_ersatz': 0.12,
+    'buergschaft_erhöhung_datum': date(2024, 9, 2),
+    'buergschaft_erhöhung_betrag': 500000.0
+}
+
+# === EINGABEN ===
+
+def load_legacy_app():
+    """Lädt die Legacy-Referenz (bcb01_cursor/legacy/app.py) als eigenes Modul"""
+    spec = importlib.util.spec_from_file_location('legacy_app', LEGACY_APP)
+    modul = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(modul)
+    return modul
+
+def load_demo_daten(verzeichnis=DEMO_VERZEICHNIS):
+    """Liest die Demo-Dateien wie beim Upload ein"""
+    return {name: pd.read_excel(os.path.join(verzeichnis, datei)) for name, datei in DEMO_DATEIEN.items()}
+
+def prepare_eingaben(daten):
+    """Bereitet die Eingaben einmal wie im Upload-Dialog auf (Datumsfilter über den gesamten Zeitraum, EZA-Aufbereitung)"""
+    df_leit = daten['leit'].copy()
+    gestell_col = app.find_col(df_leit, ['Datum Überlassung - CUSTST'])
+    gestell_datum = pd.to_datetime(df_leit[gestell_col], errors='coerce').dt.date
+    df_leit = df_leit[gestell_datum.notna()].copy()
+
+    def optional(df):
+        return df if df is not None and not df.empty else None
+
+    df_eza = optional(daten.get('eza'))
+    return {
+        'df_leit': df_leit,
+        'df_import_eza': app.prepare_eza_import(df_eza.copy()) if df_eza is not None else None,
+        'df_import_zl': optional(daten.get('zl')),
+        'df_ncts': optional(daten.get('ncts')),
+        'df_ncar': optional(daten.get('ncar')),
+        'von_datum': gestell_datum.min(),
+        'bis_datum': gestell_datum.max()
+    }
+
+# === VERARBEITUNG ===
+
+def run_engine(modul, eingaben, erhoehung=False, session_behalten=False):
+    """Führt process_data (inkl. process_buergschaft) eines Moduls ohne UI aus und liefert Excel-Bytes und Laufzeit"""
+    if not session_behalten:
+        for key in list(st.session_state.keys()):
+            del st.session_state[key]
+        st.session_state['mandant'] = 'Paritaet'
+        modul.init_session_state()
+
+    st.session_state.update(PARITAETS_PARAMETER)
+    st.session_state.update({
+        'von_datum': eingaben['von_datum'],
+        'bis_datum': eingaben['bis_datum'],
+        'buergschaft_erhöhung_aktiv': erhoehung,
+        'excel_file': None,
+        'processing_error': None
+    })
+    for key in ['df_import_eza', 'df_import_zl', 'df_ncts', 'df_ncar']:
+        st.session_state[key] = eingaben[key].copy() if eingaben[key] is not None else None
+    st.session_state['df_leit'] = eingaben['df_leit'].copy()
+    st.session_state['stats'] = modul.calculate_statistics(st.session_state['df_leit'], 'Anmeldeart Folgeverfahren')
+
+    start = time.perf_counter()
+    modul.process_data()
+    dauer = time.perf_counter() - start
+
+    if st.session_state.get('processing_error'):
+        raise RuntimeError(f"{modul.__name__}: {st.session_state['processing_error']}")
+    if not st.session_state.get('excel_file'):
+        raise RuntimeError(f"{modul.__name__}: keine Excel-Datei erzeugt")
+    return st.session_state['excel_file'], dauer
+
+# === VERGLEICH ===
+
+def compare_spalte(alt, neu, toleranz):
+    """Liefert die Zeilen, in denen sich zwei Spalten unterscheiden (NaN gilt als gleich)"""
+    beide_leer = alt.isna() & neu.isna()
+    if pd.api.types.is_numeric_dtype(alt) and pd.api.types.is_numeric_dtype(neu):
+        with np.errstate(invalid='ignore'):
+            gleich = (alt - neu).abs() <= toleranz
+    else:
+        gleich = alt.astype(str) == neu.astype(str)
+    return np.flatnonzero(~(gleich | beide_leer).to_numpy())
+
+def compare_workbooks(excel_alt, excel_neu, toleranz=0.0):
+    """Vergleicht die drei Excel-Reiter Zelle für Zelle und liefert alle Abweichungen"""
+    abweichungen = []
+    for sheet in PARITAETS_SHEETS:
+        alt = pd.read_excel(io.BytesIO(excel_alt), sheet_name=sheet)
+        neu = pd.read_excel(io.BytesIO(excel_neu), sheet_name=sheet)
+
+        if list(alt.columns) != list(neu.columns):
+            abweichungen.append({
+                'sheet': sheet, 'zeile': None, 'spalte': 'Spaltenschema',
+                'legacy': list(alt.columns), 'neu': list(neu.columns)
+            })
+        if len(alt) != len(neu):
+            abweichungen.append({
+                'sheet': sheet, 'zeile': None, 'spalte': 'Zeilenanzahl',
+                'legacy': len(alt), 'neu': len(neu)
+            })
+
+        zeilen = min(len(alt), len(neu))
+        for spalte in [col for col in alt.columns if col in neu.columns]:
+            for zeile in compare_spalte(alt[spalte].iloc[:zeilen], neu[spalte].iloc[:zeilen], toleranz):
+                abweichungen.append({
+                    # Excel-Zeile (Kopfzeile = 1)
+                    'sheet': sheet, 'zeile': int(zeile) + 2, 'spalte': spalte,
+                    'legacy': alt[spalte].iloc[zeile], 'neu': neu[spalte].iloc[zeile]
+                })
+    return abweichungen
+
+def compare_atb_ausschluss(excel_neu, anzahl_legacy, leit_spalten):
+    """Prüft den Reiter ATB-Ausschluss: so viele Zeilen wie die Legacy-Referenz übersprungen hat, mit den Spalten der Leitdatei"""
+    abweichungen = []
+    mappe = pd.ExcelFile(io.BytesIO(excel_neu))
+    ausschluss = pd.read_excel(mappe, sheet_name=AUDIT_SHEET) if AUDIT_SHEET in mappe.sheet_names else None
+
+    anzahl = 0 if ausschluss is None else len(ausschluss)
+    if anzahl != anzahl_legacy:
+        abweichungen.append({
+            'sheet': AUDIT_SHEET, 'zeile': None, 'spalte': 'Zeilenanzahl',
+            'legacy': anzahl_legacy, 'neu': anzahl
+        })
+    if ausschluss is not None and list(ausschluss.columns) != list(leit_spalten):
+        abweichungen.append({
+            'sheet': AUDIT_SHEET, 'zeile': None, 'spalte': 'Spaltenschema',
+            'legacy': list(leit_spalten), 'neu': list(ausschluss.columns)
+        })
+    return abweichungen
+
+def print_abweichungen(abweichungen, max_abweichungen):
+    """Gibt die ersten Abweichungen und eine Zusammenfassung je Reiter aus"""
+    for sheet in PARITAETS_SHEETS + [AUDIT_SHEET]:
+        anzahl = sum(1 for a in abweichungen if a['sheet'] == sheet)
+        print(f"   {sheet:<22} {'✅ identisch' if anzahl == 0 else f'❌ {anzahl} Abweichungen'}")
+    for a in abweichungen[:max_abweichungen]:
+        ort = f"Zeile {a['zeile']}" if a['zeile'] is not None else ''
+        print(f"      {a['sheet']} {ort} [{a['spalte']}]: legacy={a['legacy']!r} neu={a['neu']!r}")
+    if len(abweichungen) > max_abweichungen:
+        print(f"      ... {len(abweichungen) - max_abweichungen} weitere")
+
+def check_szenario(name, daten, legacy, erhoehung, toleranz, max_abweichungen, warmlauf):
+    """Prüft ein Eingabeszenario gegen die Legacy-Referenz; liefert True bei Parität"""
+    eingaben = prepare_eingaben(daten)
+    print(f"▶ {name} ({len(eingaben['df_leit'])} Leitdatei-Zeilen, Erhöhung {'an' if erhoehung else 'aus'})")
+
+    excel_alt, dauer_alt = run_engine(legacy, eingaben, erhoehung)
+    atb_legacy = st.session_state.get('atb_filtered_count', 0)
+    leit_spalten = eingaben['df_leit'].columns
+    excel_neu, dauer_neu = run_engine(app, eingaben, erhoehung)
+    print(f"   Laufzeit legacy {dauer_alt:.2f} s | neu {dauer_neu:.2f} s")
+    abweichungen = compare_workbooks(excel_alt, excel_neu, toleranz)
+    abweichungen += compare_atb_ausschluss(excel_neu, atb_legacy, leit_spalten)
+    print_abweichungen(abweichungen, max_abweichungen)
+    ok = not abweichungen
+
+    if warmlauf:
+        # Zweiter Lauf mit Stufen-Cache, Match-Tabelle und Saldo-Stand aus dem ersten Lauf
+        excel_warm, dauer_warm = run_engine(app, eingaben, erhoehung, session_behalten=True)
+        print(f"   Warmlauf neu {dauer_warm:.2f} s")
+        abweichungen = compare_workbooks(excel_alt, excel_warm, toleranz)
+        abweichungen += compare_atb_ausschluss(excel_warm, atb_legacy, leit_spalten)
+        print_abweichungen(abweichungen, max_abweichungen)
+        ok = ok and not abweichungen
+
+    return ok
+
+def main():
+    parser = argparse.ArgumentParser(description="Paritätsprüfung der Excel-Ausgabe gegen die Legacy-Verarbeitung")
+    parser.add_argument('--demo', action='store_true', help="Demo-Dateien aus bcb01_cursor/sample_data prüfen")
+    parser.add_argument('--groessen', type=int, nargs='*', default=[],
+                        help="Synthetische Szenarien (Leitdatei-Zeilen) aus dem Benchmark-Generator")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--erhoehung', action='store_true', help="Zusätzlich mit aktiver Bürgschaftserhöhung prüfen")
+    parser.add_argument('--warmlauf', action='store_true',
+                        help="Aktuelle Engine ein zweites Mal mit gespeicherten Zwischenständen prüfen")
+    parser.add_argument('--toleranz', type=float, default=0.0,
+                        help="Erlaubte Abweichung numerischer Zellen (Standard 0 = exakt)")
+    parser.add_argument('--max-abweichungen', type=int, default=20, help="Anzahl angezeigter Abweichungen")
+    args = parser.parse_args()
+
+    szenarien = []
+    if args.demo or not args.groessen:
+        szenarien.append(('Demo-Dateien', load_demo_daten()))
+    for zeilen in args.groessen:
+        szenarien.append((f'Synthetisch {zeilen}', generate_testdaten(zeilen, seed=args.seed)))
+
+    legacy = load_legacy_app()
+
+    # Datenbank und Artefakte der Prüfläufe nicht im Arbeitsverzeichnis ablegen
+    os.chdir(tempfile.mkdtemp(prefix='paritaet_'))
+
+    ergebnisse = []
+    for name, daten in szenarien:
+        for erhoehung in ([False, True] if args.erhoehung else [False]):
+            ergebnisse.append(check_szenario(
+                name, daten, legacy, erhoehung, args.toleranz, args.max_abweichungen, args.warmlauf
+            ))
+
+    if all(ergebnisse):
+        print("✅ Parität: alle Szenarien identisch")
+        return 0
+    print(f"❌ Parität verletzt in {ergebnisse.count(False)} von {len(ergebnisse)} Szenarien")
+    return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
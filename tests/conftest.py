@@ -0,0 +1,55 @@
+"""Gemeinsame Fixtures: Projektverzeichnis im Importpfad, jeder Test in einem eigenen Arbeitsverzeichnis"""
+import os
+import sys
+
+import pytest
+import streamlit as st
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+import paritaet  # noqa: E402
+from benchmark import generate_testdaten  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def arbeitsverzeichnis(tmp_path, monkeypatch):
+    """Datenbank und Artefakte (Stände, Bewegungsdetails-Blöcke) je Test in tmp_path"""
+    monkeypatch.chdir(tmp_path)
+    # Relativer DB-Pfad: Schema in jedem neuen Arbeitsverzeichnis neu anlegen
+    monkeypatch.setattr(app, '_DB_INITIALISIERT', set())
+    return tmp_path
+
+
+@pytest.fixture(scope='session')
+def testdaten():
+    """Synthetische Eingaben aus dem Benchmark-Generator, wie im Upload-Dialog aufbereitet"""
+    return paritaet.prepare_eingaben(generate_testdaten(600, seed=7))
+
+
+@pytest.fixture
+def bewegungs_speicher(monkeypatch):
+    """Bewegungs-Speicher schon ab der ersten Bewegung, mit kleinen Blöcken über mehrere Tage"""
+    monkeypatch.setattr(app, 'BEWEGUNGEN_SPEICHERABBILD_AB', 0)
+    monkeypatch.setattr(app, 'BEWEGUNGEN_BLOCK_ZEILEN', 97)
+
+
+@pytest.fixture
+def app_lauf():
+    """Führt process_data für einen Mandanten mit frischer Session aus und liefert die Excel-Bytes"""
+    def lauf(eingaben, mandant, delta=False, erhoehung=False):
+        for key in list(st.session_state.keys()):
+            del st.session_state[key]
+        st.session_state['mandant'] = mandant
+        app.init_session_state()
+        st.session_state['delta_modus'] = delta
+        excel, _ = paritaet.run_engine(app, eingaben, erhoehung, session_behalten=True)
+        return excel
+    return lauf
+
+
+@pytest.fixture
+def ziel(testdaten, app_lauf):
+    """Zieldatei (sortiertes Ergebnis) eines Laufs ohne Mandant"""
+    app_lauf(testdaten, None)
+    return st.session_state['ziel_sorted']
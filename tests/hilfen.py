@@ -0,0 +1,35 @@
+"""Hilfen der Saldo-Tests: Parameter, Änderung einer Zieldatei-Zeile und Vergleich zweier Saldo-Ergebnisse"""
+from datetime import date
+
+import pandas as pd
+
+import app
+
+PARAMETER = {
+    'startbuergschaft': 2000000.0,
+    'buergschaft_erhöhung_aktiv': True,
+    'buergschaft_erhöhung_datum': date(2024, 9, 2),
+    'buergschaft_erhöhung_betrag': 500000.0
+}
+
+
+def aendere_mitte(ziel):
+    """Erhöht die Gesamtabgaben einer Zeile aus der Mitte des Zeitraums; liefert Zieldatei und Gestellungstag"""
+    tage = ziel['Gestellungsdatum'].dropna().sort_values()
+    idx = tage.index[len(tage) // 2]
+    geaendert = ziel.copy()
+    geaendert.loc[idx, 'Gesamtabgaben'] += 1234.56
+    return geaendert, tage[idx].date()
+
+
+def get_details(saldo):
+    """Bewegungsdetails als ein DataFrame, auch wenn sie nur als Blöcke vorliegen"""
+    return pd.concat(list(app.iter_bewegungsdetails(saldo)), ignore_index=True)
+
+
+def assert_saldo_gleich(neu, voll):
+    """Bewegungsdetails, Tageszusammenfassung, Ergebnis-Sheet und Tagessalden sind identisch"""
+    pd.testing.assert_frame_equal(get_details(neu), get_details(voll))
+    pd.testing.assert_frame_equal(neu['tageszusammenfassung_df'], voll['tageszusammenfassung_df'])
+    pd.testing.assert_frame_equal(neu['ziel_mit_saldo'], voll['ziel_mit_saldo'])
+    assert neu['daily_summary'] == voll['daily_summary']
@@ -0,0 +1,103 @@
+"""Bewegungs-Speicher: blockweise Saldo-Engine und Export gegen die Verarbeitung im Speicher"""
+import gc
+import io
+import os
+import weakref
+
+import numpy as np
+import openpyxl
+import pandas as pd
+import pytest
+import xlsxwriter
+
+import app
+import paritaet
+from hilfen import PARAMETER, aendere_mitte, assert_saldo_gleich
+
+
+def test_excel_wie_im_speicher(testdaten, app_lauf, monkeypatch):
+    excel_speicher = app_lauf(testdaten, 'Speicher', erhoehung=True)
+    monkeypatch.setattr(app, 'BEWEGUNGEN_SPEICHERABBILD_AB', 0)
+    monkeypatch.setattr(app, 'BEWEGUNGEN_BLOCK_ZEILEN', 97)
+    excel_bloecke = app_lauf(testdaten, 'Bloecke', erhoehung=True)
+    excel_warm = app_lauf(testdaten, 'Bloecke', erhoehung=True)
+    
+    assert len(os.listdir(app.get_details_verzeichnis('bloecke'))) > 1
+    assert paritaet.compare_workbooks(excel_speicher, excel_bloecke) == []
+    assert paritaet.compare_workbooks(excel_speicher, excel_warm) == []
+
+
+def test_bewegungen_wie_tabelle(ziel, bewegungs_speicher, tmp_path):
+    speicher = app.write_bewegungs_speicher(ziel, None, str(tmp_path / 'bewegungen'))
+    bloecke = list(app.iter_bewegungs_bloecke(speicher))
+    tabelle = app.create_bewegungstabelle(ziel)
+    
+    assert speicher['anzahl'] == app.count_bewegungen(ziel) == len(tabelle)
+    assert all(block['Datum'].iloc[-1] < folgender['Datum'].iloc[0] for block, folgender in zip(bloecke, bloecke[1:]))
+    gesamt = pd.concat(bloecke, ignore_index=True)
+    pd.testing.assert_frame_equal(gesamt.drop(columns='_saldo_rang'), tabelle.drop(columns='_saldo_rang'))
+    # Der Saldo-Rang gilt je Block - die Saldo-Reihenfolge der Blöcke hintereinander entspricht der der Tabelle
+    saldo_reihenfolge = pd.concat([app.sort_bewegungen(block) for block in bloecke], ignore_index=True)
+    pd.testing.assert_frame_equal(saldo_reihenfolge, app.sort_bewegungen(tabelle).reset_index(drop=True))
+
+
+def test_spalten_eingeblendet(ziel, bewegungs_speicher, tmp_path):
+    speicher = app.write_bewegungs_speicher(ziel, None, str(tmp_path / 'bewegungen'))
+    ausschnitte = list(app.iter_bewegungs_ausschnitte(speicher))
+    
+    assert set(speicher['spalten']) == set(app.BEWEGUNGS_SPEICHER_SPALTEN)
+    assert all(isinstance(werte, np.memmap) for werte in speicher['spalten'].values())
+    assert len(ausschnitte) > 1
+    assert all(isinstance(werte, np.memmap) for ausschnitt in ausschnitte for werte in ausschnitt.values())
+    # Neben den eingeblendeten Spalten bleiben nur die Wörterbücher der Schlüsselspalten im Speicher
+    assert set(speicher) == {'anzahl', 'dateien', 'woerterbuecher', 'spalten'}
+    assert len(speicher['woerterbuecher']['Anmeldeart']) <= ziel['Anmeldeart'].nunique(dropna=False)
+
+
+def test_zeilenquellen_nach_dem_schreiben_freigegeben(ziel, bewegungs_speicher, tmp_path, monkeypatch):
+    quellen = []
+    original = app.build_bewegungs_spalten
+    
+    def build_bewegungs_spalten(*args, **kwargs):
+        spalten = original(*args, **kwargs)
+        quellen.extend(weakref.ref(werte) for werte in spalten.values())
+        return spalten
+    
+    monkeypatch.setattr(app, 'build_bewegungs_spalten', build_bewegungs_spalten)
+    speicher = app.write_bewegungs_speicher(ziel, None, str(tmp_path / 'bewegungen'))
+    gc.collect()
+    
+    assert len(quellen) > len(app.BEWEGUNGS_SPEICHER_SPALTEN)
+    assert all(referenz() is None for referenz in quellen)
+    assert sorted(os.listdir(tmp_path / 'bewegungen')) == sorted([*speicher['dateien'].values(), 'speicher.pkl'])
+
+
+@pytest.mark.parametrize('mit_verzeichnis', [False, True])
+def test_checkpoint_im_speicher_modus(ziel, bewegungs_speicher, monkeypatch, tmp_path, mit_verzeichnis):
+    verzeichnis = str(tmp_path / 'saldo_details') if mit_verzeichnis else None
+    erster = app.calculate_buergschaft(ziel, PARAMETER, details_verzeichnis=verzeichnis)
+    geaendert, tag = aendere_mitte(ziel)
+    inkrementell = app.calculate_buergschaft(geaendert, PARAMETER, saldo_stand=erster['saldo_stand'], details_verzeichnis=verzeichnis)
+    
+    assert inkrementell['bewegungsdetails_df'] is None
+    assert inkrementell['saldo_ab_datum'] == tag
+    monkeypatch.setattr(app, 'BEWEGUNGEN_SPEICHERABBILD_AB', 2000000)
+    assert_saldo_gleich(inkrementell, app.calculate_buergschaft(geaendert, PARAMETER))
+
+
+def test_excel_sheet_fortsetzung(monkeypatch):
+    monkeypatch.setattr(app, 'EXCEL_MAX_ZEILEN', 4)
+    output = io.BytesIO()
+    workbook = xlsxwriter.Workbook(output, {'constant_memory': True})
+    formate = {'kopf': workbook.add_format(app.EXCEL_KOPF_FORMAT), 'datum': workbook.add_format({'num_format': 'YYYY-MM-DD'})}
+    df = pd.DataFrame({'Nr': range(7), 'Wert': ['a', '', None, 1.5, float('inf'), pd.NA, pd.Timestamp('2024-01-02')]}, dtype=object)
+    app.write_excel_sheet(workbook, 'Test', app.iter_dataframe_bloecke(df, 2), formate)
+    app.write_excel_sheet(workbook, 'Leer', [df.iloc[:0]], formate)
+    workbook.close()
+    
+    mappe = openpyxl.load_workbook(output)
+    assert mappe.sheetnames == ['Test', 'Test 2', 'Test 3', 'Leer']
+    werte = [zeile for name in ['Test', 'Test 2', 'Test 3'] for zeile in list(mappe[name].values)[1:]]
+    assert [zeile[0] for zeile in werte] == list(range(7))
+    assert [zeile[1] for zeile in werte][:5] == ['a', None, None, 1.5, 'inf']
+    assert list(mappe['Leer'].values) == [('Nr', 'Wert')]
@@ -0,0 +1,41 @@
+"""Delta-Modus: Folgelauf mit angehängten, geänderten und entfernten Leitdatei-Zeilen gegen einen vollständigen Lauf"""
+import streamlit as st
+
+import paritaet
+
+
+def build_leit_varianten(df_leit):
+    """Leitdatei des ersten Laufs (ohne die letzten Zeilen, mit später entfernten Zeilen) und des Folgelaufs (eine Zeile geändert)"""
+    erster_teil = df_leit.iloc[:int(len(df_leit) * 0.8)]
+    entfernt = erster_teil.index[::37]
+    alt = erster_teil
+    neu = df_leit.drop(index=entfernt).copy()
+    
+    zollwert_col = [col for col in neu.columns if 'Zollwert' in col][0]
+    neu.loc[neu.index[len(neu) // 2], zollwert_col] = 12345
+    return alt.reset_index(drop=True), neu.reset_index(drop=True), len(entfernt)
+
+
+def test_delta_wie_vollstaendiger_lauf(testdaten, app_lauf):
+    alt, neu, anzahl_entfernt = build_leit_varianten(testdaten['df_leit'])
+    
+    app_lauf({**testdaten, 'df_leit': alt}, 'Delta', delta=True)
+    excel_delta = app_lauf({**testdaten, 'df_leit': neu}, 'Delta', delta=True)
+    delta_info = st.session_state['delta_info']
+    excel_voll = app_lauf({**testdaten, 'df_leit': neu}, 'Voll')
+    
+    assert not delta_info['vollstaendig']
+    assert delta_info['eingefuegt'] > 0
+    assert delta_info['geaendert'] >= 1
+    assert delta_info['entfernt'] == anzahl_entfernt
+    assert paritaet.compare_workbooks(excel_voll, excel_delta) == []
+
+
+def test_delta_ohne_aenderung(testdaten, app_lauf):
+    app_lauf(testdaten, 'Delta', delta=True)
+    excel_delta = app_lauf(testdaten, 'Delta', delta=True)
+    delta_info = st.session_state['delta_info']
+    excel_voll = app_lauf(testdaten, 'Voll')
+    
+    assert delta_info['eingefuegt'] == delta_info['geaendert'] == delta_info['entfernt'] == 0
+    assert paritaet.compare_workbooks(excel_voll, excel_delta) == []
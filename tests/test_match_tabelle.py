@@ -0,0 +1,71 @@
+"""Persistente Match-Tabelle: Folgeläufe übernehmen unveränderte Zeilen und matchen geänderte neu"""
+import pytest
+
+import app
+import paritaet
+
+
+@pytest.fixture
+def match_laeufe(monkeypatch):
+    """Arbeitsstand der Match-Tabelle je Lauf (übernommene und neu gematchte Zeilen)"""
+    laeufe = []
+    original = app.create_match_speicher
+
+    def mitschreiben(*args, **kwargs):
+        match_speicher = original(*args, **kwargs)
+        laeufe.append(match_speicher)
+        return match_speicher
+
+    monkeypatch.setattr(app, 'create_match_speicher', mitschreiben)
+    return laeufe
+
+
+def test_geaenderte_leitzeile_neu_gematcht(testdaten, app_lauf, match_laeufe):
+    df_leit = testdaten['df_leit']
+    app_lauf(testdaten, 'Match')
+    gespeichert = app.load_match_table('match')
+    erster = match_laeufe[-1]
+
+    # Schlüsselfeld (Position SumA) einer IMDC-Zeile ändern
+    neu = df_leit.copy()
+    idx = neu.index[neu['Anmeldeart Folgeverfahren'] == 'IMDC'][0]
+    neu.loc[idx, 'Position SumA'] = 9999
+    app_lauf({**testdaten, 'df_leit': neu}, 'Match')
+    zweiter = match_laeufe[-1]
+
+    assert len(zweiter['neue_eintraege']) == zweiter['neu_berechnet'] == 1
+    neuer_key = next(iter(zweiter['neue_eintraege']))
+    assert neuer_key.startswith('IMDC|') and neuer_key not in gespeichert
+    assert '|9999' in neuer_key
+
+    # Alle übrigen Zeilen kommen unverändert aus der gespeicherten Tabelle
+    assert zweiter['wiederverwendet'] == erster['wiederverwendet'] + erster['neu_berechnet'] - 1
+    assert zweiter['verwendete_keys'] - {neuer_key} <= set(gespeichert)
+    assert neuer_key in app.load_match_table('match')
+
+
+def test_geaenderte_importzeile_invalidiert(testdaten, app_lauf, match_laeufe):
+    df_leit = testdaten['df_leit']
+    app_lauf(testdaten, 'Match')
+    gespeichert = app.load_match_table('match')
+
+    # Zollabgabe einer ZL-Zeile ändern, deren MRN von einer WIDS-Zeile referenziert wird
+    wids_mrns = set(df_leit.loc[df_leit['Anmeldeart Folgeverfahren'] == 'WIDS', 'Registriernummer Folgeverfahren'])
+    zl = testdaten['df_import_zl'].copy()
+    zl_idx = zl.index[zl['Registrienummer/MRN'].isin(wids_mrns)][0]
+    mrn = zl.loc[zl_idx, 'Registrienummer/MRN']
+    zl.loc[zl_idx, 'Vorraussichtliche Zollabgabe'] += 100
+    geaendert = {**testdaten, 'df_import_zl': zl}
+    excel_folgelauf = app_lauf(geaendert, 'Match')
+    folgelauf = match_laeufe[-1]
+
+    neu_gematcht = set(folgelauf['neue_eintraege'])
+    assert neu_gematcht and folgelauf['neu_berechnet'] == len(neu_gematcht)
+    for leit_key in neu_gematcht:
+        assert leit_key.startswith('WIDS|') and str(mrn) in leit_key
+        # Veralteter Eintrag ist ersetzt, nicht übernommen
+        assert leit_key in gespeichert
+        assert app.load_match_table('match')[leit_key]['signatur'] != gespeichert[leit_key]['signatur']
+
+    excel_frisch = app_lauf(geaendert, 'Frisch')
+    assert paritaet.compare_workbooks(excel_frisch, excel_folgelauf) == []
@@ -0,0 +1,43 @@
+"""Parität der Excel-Ausgabe gegen die Legacy-Verarbeitung, inklusive Warmlauf mit gespeicherten Zwischenständen"""
+import io
+
+import pandas as pd
+import pytest
+
+import paritaet
+from benchmark import generate_testdaten
+
+
+@pytest.fixture(scope='module')
+def legacy():
+    return paritaet.load_legacy_app()
+
+
+@pytest.mark.parametrize('erhoehung', [False, True])
+def test_demo_dateien(legacy, erhoehung):
+    assert paritaet.check_szenario('Demo-Dateien', paritaet.load_demo_daten(), legacy, erhoehung, 0.0, 20, True)
+
+
+@pytest.mark.parametrize('erhoehung', [False, True])
+def test_synthetisch_bewegungs_speicher(legacy, bewegungs_speicher, erhoehung):
+    daten = generate_testdaten(600, seed=11)
+    assert paritaet.check_szenario('Synthetisch 600', daten, legacy, erhoehung, 0.0, 20, True)
+
+
+def test_atb_ausschluss_geprueft():
+    leit = pd.DataFrame({'Anmeldeart Folgeverfahren': ['IMDC', 'WIDS'], 'Weitere Registriernummer Folgeverfahren': ['ATB1', 'ATB2']})
+    output = io.BytesIO()
+    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
+        pd.DataFrame({'Ergebnis': []}).to_excel(writer, index=False, sheet_name='Ergebnis')
+        leit.to_excel(writer, index=False, sheet_name=paritaet.AUDIT_SHEET)
+    excel = output.getvalue()
+    
+    assert paritaet.compare_atb_ausschluss(excel, 2, leit.columns) == []
+    assert [a['spalte'] for a in paritaet.compare_atb_ausschluss(excel, 3, leit.columns)] == ['Zeilenanzahl']
+    assert [a['spalte'] for a in paritaet.compare_atb_ausschluss(excel, 2, ['Anmeldeart'])] == ['Spaltenschema']
+    # Ohne Reiter gilt: keine Zeile ausgeschlossen
+    ohne_reiter = io.BytesIO()
+    with pd.ExcelWriter(ohne_reiter, engine='xlsxwriter') as writer:
+        pd.DataFrame({'Ergebnis': []}).to_excel(writer, index=False, sheet_name='Ergebnis')
+    assert paritaet.compare_atb_ausschluss(ohne_reiter.getvalue(), 0, leit.columns) == []
+    assert len(paritaet.compare_atb_ausschluss(ohne_reiter.getvalue(), 2, leit.columns)) == 1
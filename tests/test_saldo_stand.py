@@ -0,0 +1,45 @@
+"""Saldo-Checkpoints: inkrementelle Neuberechnung ab dem ersten geänderten Tag gegen eine vollständige Berechnung"""
+import pytest
+
+import app
+from hilfen import PARAMETER, aendere_mitte, assert_saldo_gleich
+
+
+@pytest.mark.parametrize('mit_verzeichnis', [False, True])
+def test_checkpoint_wie_vollstaendige_berechnung(ziel, tmp_path, mit_verzeichnis):
+    verzeichnis = str(tmp_path / 'saldo_details') if mit_verzeichnis else None
+    erster = app.calculate_buergschaft(ziel, PARAMETER, details_verzeichnis=verzeichnis)
+    geaendert, tag = aendere_mitte(ziel)
+    
+    inkrementell = app.calculate_buergschaft(geaendert, PARAMETER, saldo_stand=erster['saldo_stand'], details_verzeichnis=verzeichnis)
+    voll = app.calculate_buergschaft(geaendert, PARAMETER)
+    
+    assert inkrementell['saldo_ab_datum'] == tag
+    assert 0 < inkrementell['saldo_tage_uebernommen'] < inkrementell['saldo_tage_gesamt']
+    assert_saldo_gleich(inkrementell, voll)
+
+
+def test_checkpoint_ohne_aenderung(ziel):
+    erster = app.calculate_buergschaft(ziel, PARAMETER)
+    zweiter = app.calculate_buergschaft(ziel, PARAMETER, saldo_stand=erster['saldo_stand'])
+    
+    assert zweiter['saldo_ab_datum'] is None
+    assert zweiter['saldo_tage_uebernommen'] == zweiter['saldo_tage_gesamt']
+    assert_saldo_gleich(zweiter, erster)
+
+
+def test_checkpoint_andere_parameter(ziel):
+    erster = app.calculate_buergschaft(ziel, PARAMETER)
+    parameter = {**PARAMETER, 'startbuergschaft': 3000000.0}
+    zweiter = app.calculate_buergschaft(ziel, parameter, saldo_stand=erster['saldo_stand'])
+    
+    assert zweiter['saldo_tage_uebernommen'] == 0
+    assert_saldo_gleich(zweiter, app.calculate_buergschaft(ziel, parameter))
+
+
+def test_stand_ohne_bewegungsdetails(ziel, tmp_path):
+    verzeichnis = str(tmp_path / 'saldo_details')
+    stand = app.calculate_buergschaft(ziel, PARAMETER, details_verzeichnis=verzeichnis)['saldo_stand']
+    
+    assert 'bewegungsdetails_df' not in stand
+    assert all(set(block) == {'datei', 'zeilen'} for block in stand['details'])
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""buergcontrolBASE Job-Worker - arbeitet die Verarbeitungs-Warteschlange (Tabelle jobs) in eigenen Prozessen ab
+
+Aufruf:
+    python worker.py --anzahl 4
+    python worker.py --einmal
+
+Der Streamlit-Server startet die Worker selbst (BUERGCONTROL_JOB_WORKER). Mit BUERGCONTROL_WORKER_EXTERN=1
+stellt der Server Jobs nur ein und die Worker werden separat gestartet (gleiches Arbeitsverzeichnis).
+"""
+
+import argparse
+import logging
+import multiprocessing
+import os
+import socket
+import sys
+
+def run_worker(name, einmal, eltern_pid):
+    """Einstiegspunkt eines Worker-Prozesses"""
+    # Streamlit-Warnungen zum Bare-Modus unterdrücken
+    logging.getLogger('streamlit').setLevel(logging.ERROR)
+    import app
+    for logger_name in list(logging.root.manager.loggerDict):
+        if logger_name.startswith('streamlit'):
+            logging.getLogger(logger_name).setLevel(logging.ERROR)
+    
+    app.run_job_worker(name, einmal=einmal, eltern_pid=eltern_pid)
+
+def main():
+    parser = argparse.ArgumentParser(description="Worker für die Verarbeitungs-Warteschlange")
+    parser.add_argument('--anzahl', type=int, default=int(os.environ.get('BUERGCONTROL_JOB_WORKER', '2')),
+                        help="Anzahl paralleler Worker-Prozesse")
+    parser.add_argument('--einmal', action='store_true', help="Beenden, sobald die Warteschlange leer ist")
+    parser.add_argument('--eltern-pid', type=int, default=None,
+                        help="Beenden, sobald dieser Prozess (Streamlit-Server) nicht mehr läuft")
+    args = parser.parse_args()
+    
+    # spawn statt fork: jeder Worker lädt app.py frisch (keine geerbten DB-Verbindungen oder Threads)
+    kontext = multiprocessing.get_context('spawn')
+    prozesse = [
+        kontext.Process(
+            target=run_worker, name=f'worker-{nummer}',
+            args=(f'{socket.gethostname()}:{os.getpid()}:{nummer}', args.einmal, args.eltern_pid)
+        )
+        for nummer in range(1, max(args.anzahl, 1) + 1)
+    ]
+    for prozess in prozesse:
+        prozess.start()
+    
+    try:
+        for prozess in prozesse:
+            prozess.join()
+    except KeyboardInterrupt:
+        for prozess in prozesse:
+            prozess.terminate()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())